@@ -3,64 +3,70 @@ API endpoints for /audio
 This deals with the API access for audio files uploading/downloading.
 """
 from pathlib import Path
+from typing import BinaryIO, Tuple
 
 import flask
 import flask_uploads
 
+from ..blob_store import BlobStore, find_existing_file, link_named_file, remove_named_file
 from ..error_response import error_information
 from ..extensions import db
 from ..db_models import Audio, FileMetaData
 from ..upload_config import audio_files, uploads_url_base
 from ..serialization import AudioSchema
 
-def create_audio(filepath: Path, data: bytes, base_path: Path=None) -> Audio:
+def create_audio(filename: str, stream: BinaryIO, *, base_path: Path=None,
+                 reuse_existing: bool=False, commit: bool=True) -> Tuple[Audio, bool]:
     """Helper function to create the database rows and associated files
     for an Audio item
 
-    filepath: Relative Path to the audio file on disk
-    data: the data contained in this audio file, if an empty bytes array is passed in
-          no data is written to `filepath` otherwise this data is written to the file
-          path that was passed in as the first parameter.
-          base_path: The path to the storage for audio files, if this not provided
-          it will default to the upload file destination found in the app config
-          `config['UPLOADED_AUDIO_DEST']`
+    filename: Name of the audio file, a number is added to the name if it is
+              already in use
+    stream: the contents of the audio file, these are stored in the blob store
+            and linked at the file name
+    base_path: The path to the storage for audio files, if this not provided
+               it will default to the upload file destination found in the app config
+               `config['UPLOADED_AUDIO_DEST']`
+    reuse_existing: If an Audio with the same contents already exists it is
+                    returned instead of creating a new one
+    commit: If false the rows are added to the session but not committed
 
-    Returns the ORM object that corresponds to this audio file
+    Returns the ORM object that corresponds to this audio file and whether it was created
     """
     if not base_path:
         base_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
-    storage_location = base_path / filepath
-    if data: # We got data so we have to write this out the the filename
-        with filepath.open('wb') as audio_file_data:
-            audio_file_data.write(data)
-    filename = str(filepath)
+    store = BlobStore.from_config(flask.current_app.config)
+    blob = store.store(stream)
+    existing = find_existing_file(blob.hash, Audio) if reuse_existing else None
+    if existing is not None:
+        return existing, False
+    storage_location = link_named_file(store, blob, base_path, filename)
+    filename = str(storage_location.relative_to(base_path))
     file_url = uploads_url_base + 'audio_uploads/' + filename
-    metadata = FileMetaData(path=file_url, name=filename)
+    metadata = FileMetaData(path=file_url, name=filename, blob=blob)
     current_file = Audio(file_info=metadata, url=file_url)
     db.session.add(current_file)
-    db.session.commit()
-    return current_file
+    if commit:
+        db.session.commit()
+    return current_file, True
 
 
-def post(audioFile):
-    """handle POST request for audio file"""
-    try:
-        filename = audio_files.save(audioFile)
-    except flask_uploads.UploadNotAllowed:
+def post(audioFile, reuseExisting=False):
+    """handle POST request for audio file.
+    If reuseExisting is set and audio with the same contents was uploaded before,
+    that audio is returned with a 200 status instead of creating a new one."""
+    basename = audio_files.get_basename(audioFile.filename)
+    if not audio_files.file_allowed(audioFile, basename):
         return error_information(
             status=415,
             title="Invalid file format for audio upload",
             detail="Invalid file format for audio upload, must be an audio file."
                    " Got filename {} , allowed extensions are {}".format(audioFile.filename, audio_files.extensions),
         )
-    else:
-        # We already write out the file using the flask uploads helper
-        # so no need to write it again, hence the empty data passed in below
-        # which is handled in a special case in the create_audio function.
-        current_file = create_audio(filename, b'')
+    current_file, created = create_audio(basename, audioFile.stream, reuse_existing=reuseExisting)
 
     result = AudioSchema().dump(current_file).data
-    return result, 201
+    return result, 201 if created else 200
 
 
 def get(audioID):
@@ -73,6 +79,23 @@ def get(audioID):
     result = AudioSchema().dump(audio_info).data
     return result, 200
 
+def delete(audioID):
+    """Delete an uploaded audio file that isn't part of any utterance.
+    Its contents are removed once no other upload has the same contents."""
+    audio_info = Audio.query.get_or_404(audioID)
+    if audio_info.utterances:
+        return error_information(
+            status=409,
+            title="Audio is in use",
+            detail="Audio {} is part of the utterances {}".format(
+                audioID, ", ".join(str(utterance.id) for utterance in audio_info.utterances)),
+        )
+    remove_named_file(BlobStore.from_config(flask.current_app.config), audio_info.file_info,
+                      Path(flask.current_app.config['UPLOADED_AUDIO_DEST']))
+    db.session.delete(audio_info)
+    db.session.commit()
+    return None, 204
+
 def search(pageNumber=1, pageSize=20):
     """Search audio files"""
     paginated_results = Audio.query.paginate(page=pageNumber, per_page=pageSize, error_out=True)
@@ -4,6 +4,9 @@ Get information about the backend capabilities supported through this API.
 """
 import persephone
 
+from ..extensions import model_cache
+from ..warmup import warmup
+
 # TODO: These label types should be found from querying against the capabilities of the installed Persephone library
 # directly. This is a workaround to enable more front end development to proceed.
 AVAILABLE_LABEL_TYPES = [
@@ -63,4 +66,12 @@ def supported_features():
 
 def accepted_filetypes():
     """Return information about file types that are accepted for uploads"""
-    return ACCEPTED_UPLOAD_TYPES, 200
\ No newline at end of file
+    return ACCEPTED_UPLOAD_TYPES, 200
+
+def readiness():
+    """Report if the worker process serving this request has finished warming up"""
+    return warmup.status(), 200 if warmup.ready else 503
+
+def model_cache_stats():
+    """Return the counters of the model cache in the worker process serving this request"""
+    return model_cache.stats(), 200
@@ -4,18 +4,20 @@ Make these endpoints be behind an auth wall if possible.
 """
 import logging
 import os
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import tempfile
-from zipfile import ZipFile
+from typing import Optional
+from zipfile import ZipFile, ZipInfo
 
 import flask
-import flask_uploads
+from werkzeug.utils import secure_filename
 
 from .audio import create_audio
 from .transcription import create_transcription
 
-from ..db_models import FileMetaData
+from ..blob_store import BlobStore, link_named_file
 from ..error_response import error_information
+from ..extensions import db
 from ..serialization import AudioSchema, TranscriptionSchema
 from ..upload_config import (
     compressed_files,
@@ -32,22 +34,33 @@ def extension_allowed(filename, flask_upload_config):
     ext = ext[1:] # remove dot, so '.txt' --> 'txt'
     return ext in flask_upload_config.extensions
 
-def utterances(utterancesFile):
-    """handle POST request for bulk utterances file uploading"""
-    try:
-        filename = compressed_files.save(utterancesFile)
-    except flask_uploads.UploadNotAllowed:
+def member_filename(member: ZipInfo) -> Optional[str]:
+    """The file name a zip member is stored under, None for directories and members without a usable name.
+    Members are flattened to a plain base name, so files in folders of the zip
+    and names with "../" or absolute paths are stored in the upload directory itself."""
+    if member.filename.endswith('/'):
+        return None
+    return secure_filename(PurePosixPath(member.filename.replace('\\', '/')).name) or None
+
+def utterances(utterancesFile, reuseExisting=False):
+    """handle POST request for bulk utterances file uploading.
+    The zip file itself is stored in the blob store, so uploading the same zip
+    again doesn't store another copy. If reuseExisting is set, files in the zip
+    with the same contents as earlier uploads return the existing rows."""
+    basename = compressed_files.get_basename(utterancesFile.filename)
+    if not compressed_files.file_allowed(utterancesFile, basename):
         return error_information(
             status=415,
             title="Invalid file format for bulk utterances upload",
             detail="Invalid file format for bulk utterances upload, must be a compressed file."
                    " Got filename {} , allowed extensions are {}".format(utterancesFile.filename, compressed_files.extensions),
         )
+    store = BlobStore.from_config(flask.current_app.config)
+    zip_blob = store.store(utterancesFile.stream)
+    link_named_file(store, zip_blob, Path(flask.current_app.config['UPLOADED_COMPRESSED_DEST']), basename)
+    db.session.commit()
     try:
-        # have to read from the full path
-        base_zip_path = flask.current_app.config['UPLOADED_COMPRESSED_DEST']
-        full_path = os.path.join(base_zip_path, filename)
-        zf = ZipFile(full_path, mode='r')
+        zf = ZipFile(str(store.blob_path(zip_blob.hash)), mode='r')
     except NotImplementedError:
         # If Zip compression is not implemented
         return error_information(
@@ -58,8 +71,11 @@ def utterances(utterancesFile):
     check_against = [audio_files, text_files] # Allowed upload types
     to_extract = []
     for member in zf.infolist():
-        if any(extension_allowed(member.filename, flask_uploadset) for flask_uploadset in check_against):
-            to_extract.append(member)
+        extracted_name = member_filename(member)
+        if extracted_name is None:
+            logger.info("Skipping directory or unusable name in uploaded zip file: %s", member)
+        elif any(extension_allowed(extracted_name, flask_uploadset) for flask_uploadset in check_against):
+            to_extract.append((member, extracted_name))
         else:
             logger.info("Not allowed filetype in uploaded zip file: %s", member)
 
@@ -74,20 +90,24 @@ def utterances(utterancesFile):
     audio_results = []
     transcription_results = []
 
-    for file in to_extract:
-        extracted_name = file.filename
-        path, extension = os.path.splitext(extracted_name)
-        if extension in audio_files.extensions:
-            # Got an audio file
-            data = zf.open(file).read() # extract data without creating file on disk
-            audio_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST']) / extracted_name
-            audio_result = create_audio(filepath=audio_path, data=data)
+    for file, extracted_name in to_extract:
+        if extension_allowed(extracted_name, audio_files):
+            # Got an audio file, its contents are hashed as they are extracted
+            with zf.open(file) as member:
+                audio_result, _ = create_audio(
+                    extracted_name, member,
+                    base_path=Path(flask.current_app.config['UPLOADED_AUDIO_DEST']),
+                    reuse_existing=reuseExisting
+                )
             audio_results.append(audio_result)
-        elif extension in text_files.extensions:
+        elif extension_allowed(extracted_name, text_files):
             # Got a text/transcription file
-            data = zf.open(file).read() # extract data without creating file on disk
-            transcription_path = Path(flask.current_app.config['UPLOADED_TEXT_DEST']) / extracted_name
-            transcription_result = create_transcription(filepath=transcription_path, data=data)
+            data = zf.open(file).read().decode('utf-8') # extract data without creating file on disk
+            transcription_result, _ = create_transcription(
+                filepath=Path(extracted_name),
+                data=data,
+                reuse_existing=reuseExisting
+            )
             transcription_results.append(transcription_result)
 
     audio_created_serialized = [AudioSchema().dump(a).data for a in audio_results]
@@ -5,20 +5,24 @@ This deals with the API for corpus model definitions and metadata
 import logging
 import os
 from pathlib import Path
-from shutil import copyfile
-from typing import Set
+from typing import Dict, List, Sequence, Set, Tuple
 import uuid
 import zipfile
 
 import flask
-from persephone.corpus import Corpus
 import sqlalchemy
+from sqlalchemy.orm import joinedload
 
-from ..db_models import (DBcorpus, TestingDataSet, TrainingDataSet, ValidationDataSet,
-                         Label, CorpusLabelSet, get_or_create)
+from ..bulk_queries import bulk_insert, missing_ids
+from ..corpus_build import run_corpus_build
+from ..db_models import (Audio, DBcorpus, DBUtterance, Job, Transcription, TestingDataSet, TrainingDataSet, ValidationDataSet,
+                         Label, CorpusLabelSet)
 from ..error_response import error_information
 from ..extensions import db
-from ..serialization import CorpusSchema, LabelSchema
+from ..file_links import materialize_files
+from ..jobs import create_job, get_executor, submit_job
+from ..preprocessing import preprocess_corpus
+from ..serialization import CorpusSchema, JobSchema, LabelSchema
 
 
 logger = logging.getLogger(__name__)
@@ -29,19 +33,18 @@ def strip_unsafe_characters(filename: str):
     """
     return "".join([c for c in filename if c.isalpha() or c.isdigit() or c==' ' or c=='_']).rstrip()
 
-def create_prefixes(audio_uploads_path: Path, transcription_uploads_path: Path, prefix_information,
-                    base_path: Path, prefix_name: str) -> set:
-    """Create a persephone formatted prefix file.
-    Assumes that "label" and "wav" directories exist
+def partition_files(audio_uploads_path: Path, transcription_uploads_path: Path, prefix_information,
+                    base_path: Path) -> Tuple[set, List[Tuple[Path, Path]]]:
+    """Find the prefixes of a data split and the (source, destination) pairs
+    of the label and audio files that have to be materialized in the corpus.
 
     :prefix_information: Data about training splits from the DB
     :audio_uploads_path: Path to storage for uploaded audio files
     :transcription_uploads_path: Path to storage for uploaded transcription files
     :base_path: Base path of this corpus
-    :prefix_name: Name of current data split, must be one of:
-                  "train_prefixes.txt", "test_prefixes", "validation_prefixes"
     """
     prefixes = set()
+    files = []
     count = 0
     for data in prefix_information:
         count += 1
@@ -52,26 +55,73 @@ def create_prefixes(audio_uploads_path: Path, transcription_uploads_path: Path,
         cleaned_prefix = strip_unsafe_characters(prefix)
         prefixes.add(cleaned_prefix)
 
-        # copy transcription to "/label" directory
+        # transcription goes in the "/label" directory
         label_src_path  = transcription_uploads_path / label_filename
         label_dest_path = base_path / "label" / (cleaned_prefix+extension)
-        copyfile(str(label_src_path), str(label_dest_path))
+        files.append((label_src_path, label_dest_path))
 
-        # copy audio to "/wav" directory
+        # audio goes in the "/wav" directory
         audio_filename = data.utterance.audio.file_info.name
         audio_src_path = audio_uploads_path / audio_filename
         audio_dest_path = base_path / "wav" / (cleaned_prefix+".wav")
-        copyfile(str(audio_src_path), str(audio_dest_path))
+        files.append((audio_src_path, audio_dest_path))
 
     if len(prefixes) != count:
         raise ValueError("Duplicate prefix found")
+    return prefixes, files
+
+def create_prefixes(audio_uploads_path: Path, transcription_uploads_path: Path, prefix_information,
+                    base_path: Path, prefix_name: str) -> Tuple[set, List[Tuple[Path, Path]]]:
+    """Create a persephone formatted prefix file.
+    Assumes that "label" and "wav" directories exist.
+    Returns the prefixes and the files to materialize as given by `partition_files`.
 
+    :prefix_name: Name of current data split, must be one of:
+                  "train_prefixes.txt", "test_prefixes", "validation_prefixes"
+    """
+    prefixes, files = partition_files(audio_uploads_path, transcription_uploads_path,
+                                      prefix_information, base_path)
     prefix_file_path = base_path / prefix_name
     with prefix_file_path.open(mode='w') as pf:
         for prefix in prefixes:
             pf.write(prefix)
             pf.write(os.linesep)
-    return prefixes
+    return prefixes, files
+
+def check_partitions(train_prefixes: set, testing_prefixes: set, validation_prefixes: set) -> None:
+    """Raise a ValueError if an utterance prefix is in more than one data split"""
+    if train_prefixes & testing_prefixes:
+        raise ValueError("Overlapping prefixes detected with training and testing: {}".format(train_prefixes & testing_prefixes))
+    if train_prefixes & validation_prefixes:
+        raise ValueError("Overlapping prefixes detected with training and validation: {}".format(train_prefixes & validation_prefixes))
+    if validation_prefixes & testing_prefixes:
+        raise ValueError("Overlapping prefixes detected with validation and testing: {}".format(validation_prefixes & testing_prefixes))
+
+def partition_rows(data_set, corpus_id: int) -> list:
+    """The rows of a data split of a corpus, loaded together with the files of their
+    utterances so that checking the data split doesn't query each utterance"""
+    utterance = joinedload(data_set.utterance)
+    return data_set.query.filter_by(corpus_id=corpus_id).options(
+        utterance.joinedload(DBUtterance.audio).joinedload(Audio.file_info),
+        utterance.joinedload(DBUtterance.transcription).joinedload(Transcription.file_info),
+    ).all()
+
+def validate_partitions(audio_uploads_path: Path, transcription_uploads_path: Path,
+                        corpus: DBcorpus, corpus_path: Path) -> dict:
+    """Check that the data splits of a corpus can be built without touching the filesystem,
+    raising a ValueError if they overlap and a FileNotFoundError if an uploaded file is missing.
+    Returns the number of utterances in each data split."""
+    data_sets = (("training", TrainingDataSet), ("testing", TestingDataSet), ("validation", ValidationDataSet))
+    partitions = {
+        name: partition_files(audio_uploads_path, transcription_uploads_path,
+                              partition_rows(data_set, corpus.id), corpus_path)
+        for name, data_set in data_sets
+    }
+    check_partitions(partitions["training"][0], partitions["testing"][0], partitions["validation"][0])
+    missing = [str(source) for _, files in partitions.values() for source, _ in files if not source.exists()]
+    if missing:
+        raise FileNotFoundError("Uploaded files missing for corpus: {}".format(", ".join(missing)))
+    return {name: len(prefixes) for name, (prefixes, _) in partitions.items()}
 
 def labels_set(corpus: DBcorpus) -> Set[Label]:
     """Retrieve the set of labels associated with a corpus.
@@ -84,15 +134,17 @@ def labels_set(corpus: DBcorpus) -> Set[Label]:
     return labels
 
 def create_corpus_file_structure(audio_uploads_path: Path, transcription_uploads_path: Path,
-                                 corpus: DBcorpus, corpus_path: Path) -> None:
+                                 corpus: DBcorpus, corpus_path: Path, max_workers: int = 8) -> None:
     """Create the needed file structure on disk for a persephone.Corpus
-    object to be created
+    object to be created. Uploaded files are linked into the corpus rather
+    than copied wherever the filesystem allows it.
 
     :audio_uploads_path: Base path to storage for uploaded audio files
     :transcription_uploads_path: Base path to storage for uploaded transcription files
     :corpus: The DBcorpus object specifying how the persephone.Corpus must
              be created.
     :corpus_path: path to corpus
+    :max_workers: Number of files materialized in parallel
     """
     if corpus_path.exists():
         raise FileExistsError("Corpus already exists at path {}".format(corpus_path))
@@ -105,44 +157,56 @@ def create_corpus_file_structure(audio_uploads_path: Path, transcription_uploads
     label_path.mkdir()
 
     # Create prefix files as required for specifying data splits in
-    # persephone.Corpus creation
-    train_prefixes = create_prefixes(audio_uploads_path, transcription_uploads_path, corpus.training, corpus_path, "train_prefixes.txt")
-    testing_prefixes = create_prefixes(audio_uploads_path, transcription_uploads_path, corpus.testing, corpus_path, "test_prefixes.txt")
-    if train_prefixes & testing_prefixes:
-        raise ValueError("Overlapping prefixes detected with training and testing: {}".format(train_prefixes & testing_prefixes))
-    validation_prefixes = create_prefixes(audio_uploads_path, transcription_uploads_path, corpus.validation, corpus_path, "valid_prefixes.txt")
-    if train_prefixes & validation_prefixes:
-        raise ValueError("Overlapping prefixes detected with training and validation: {}".format(train_prefixes & validation_prefixes))
-    if validation_prefixes & testing_prefixes:
-        raise ValueError("Overlapping prefixes detected with validation and testing: {}".format(validation_prefixes & testing_prefixes))
-
-def fix_corpus_format(corpus):
-    """Fix serialization issue from Schema in quick manner
-    TODO: Fix the serialization schema
+    # persephone.Corpus creation, the rows of each split are loaded with their files in one query
+    train_prefixes, train_files = create_prefixes(audio_uploads_path, transcription_uploads_path, partition_rows(TrainingDataSet, corpus.id), corpus_path, "train_prefixes.txt")
+    testing_prefixes, testing_files = create_prefixes(audio_uploads_path, transcription_uploads_path, partition_rows(TestingDataSet, corpus.id), corpus_path, "test_prefixes.txt")
+    validation_prefixes, validation_files = create_prefixes(audio_uploads_path, transcription_uploads_path, partition_rows(ValidationDataSet, corpus.id), corpus_path, "valid_prefixes.txt")
+    check_partitions(train_prefixes, testing_prefixes, validation_prefixes)
+
+    # The splits don't overlap, so every destination is distinct
+    materialize_files(train_files + testing_files + validation_files, max_workers=max_workers)
+
+def partition_membership(corpus_ids: Sequence[int]) -> Dict[int, Dict[str, List[int]]]:
+    """The utterance IDs in each data split of the given corpora.
+    These are fetched with one query however many corpora there are."""
+    membership = {
+        corpus_id: {"testing": [], "training": [], "validation": []}
+        for corpus_id in corpus_ids
+    } # type: Dict[int, Dict[str, List[int]]]
+    if not membership:
+        return membership
+    data_sets = (("testing", TestingDataSet), ("training", TrainingDataSet), ("validation", ValidationDataSet))
+    queries = [
+        db.session.query(data_set.id, data_set.corpus_id, sqlalchemy.literal(name), data_set.utterance_id)
+        .filter(data_set.corpus_id.in_(list(membership)))
+        for name, data_set in data_sets
+    ]
+    # Sorted by row ID so the utterances of a data split are in the order they were added
+    for _, corpus_id, name, utterance_id in sorted(queries[0].union_all(*queries[1:]).all()):
+        membership[corpus_id][name].append(utterance_id)
+    return membership
+
+def fix_corpus_format(corpus: dict, partition: Dict[str, List[int]] = None) -> dict:
+    """Add the data splits of a corpus to its serialized form.
+
+    :corpus: The corpus as serialized by CorpusSchema
+    :partition: The utterance IDs in each data split of the corpus as given by
+                `partition_membership`, these are fetched if they aren't given
     """
-    import copy
-    fixed_format = copy.copy(corpus)
-
-    testing_ids = [item.utterance_id for item in TestingDataSet.query.filter_by(corpus_id=corpus['id']).all()]
-    training_ids = [item.utterance_id for item in TrainingDataSet.query.filter_by(corpus_id=corpus['id']).all()]
-    validation_ids = [item.utterance_id for item in ValidationDataSet.query.filter_by(corpus_id=corpus['id']).all()]
-
-    del fixed_format['testing']
-    del fixed_format['training']
-    del fixed_format['validation']
-    fixed_format['partition'] = {
-        "testing": testing_ids,
-        "training": training_ids,
-        "validation": validation_ids,
-    }
+    if partition is None:
+        partition = partition_membership([corpus['id']])[corpus['id']]
+    fixed_format = dict(corpus)
+    fixed_format['partition'] = partition
     return fixed_format
 
 def search(pageNumber=1, pageSize=20):
     """Handle request for all available DBcorpus"""
     paginated_results = DBcorpus.query.paginate(page=pageNumber, per_page=pageSize, error_out=True)
+    # The data splits of the whole page are fetched at once
+    membership = partition_membership([row.id for row in paginated_results.items])
     results = []
     for row in paginated_results.items:
-        serialized = fix_corpus_format(CorpusSchema().dump(row).data)
+        serialized = fix_corpus_format(CorpusSchema().dump(row).data, membership[row.id])
         results.append(serialized)
     return results, 200
 
@@ -155,13 +219,33 @@ def get(corpusID):
 
 
 def post(corpusInfo):
-    """Create a DBcorpus"""
+    """Create a DBcorpus and submit the job that builds it.
+    The corpus can be used for training once the build job has marked it ready."""
     INT64_MAX =  2^63 - 1 # Largest size that the 64bit integer value for the max_samples
                           # can contain, this exists because the API will complain if a None
                           # is returned, so we get much the same behavior by making the default
                           # value the integer max value
 
     max_samples = corpusInfo.get('max_samples', INT64_MAX)
+
+    # Every utterance is checked in one query before anything is created
+    partitions = (
+        (TrainingDataSet, corpusInfo['training']),
+        (TestingDataSet, corpusInfo['testing']),
+        (ValidationDataSet, corpusInfo['validation']),
+    )
+    missing_utterances = missing_ids(
+        db.session, DBUtterance.__table__.c.id,
+        (utterance_id for _, utterance_IDs in partitions for utterance_id in utterance_IDs)
+    )
+    if missing_utterances:
+        return error_information(
+            status=400,
+            title="Utterances not found",
+            detail="These utterance IDs don't exist: {}".format(
+                ", ".join(str(utterance_id) for utterance_id in sorted(missing_utterances))),
+        )
+
     current_corpus = DBcorpus(
         name=corpusInfo['name'],
         labelType=corpusInfo['labelType'],
@@ -170,74 +254,77 @@ def post(corpusInfo):
     current_corpus.max_samples = max_samples
     db.session.add(current_corpus)
     db.session.flush() # Make sure that current_corpus.id exists before using as key
-    training_set_IDs = corpusInfo['training']
-    for train_utterance_id in training_set_IDs:
-        db.session.add(
-            TrainingDataSet(
-                corpus_id=current_corpus.id,
-                utterance_id=train_utterance_id
-            )
-        )
-
-    testing_set_IDs = corpusInfo['testing']
-    for test_utterance_id in testing_set_IDs:
-        db.session.add(
-            TestingDataSet(
-                corpus_id=current_corpus.id,
-                utterance_id=test_utterance_id
-            )
-        )
-
-    validation_set_IDs = corpusInfo['validation']
-    for validation_utterance_id in validation_set_IDs:
-        db.session.add(
-            ValidationDataSet(
-                corpus_id=current_corpus.id,
-                utterance_id=validation_utterance_id
-            )
-        )
+    for data_set, utterance_IDs in partitions:
+        bulk_insert(db.session, data_set.__table__, [
+            {"corpus_id": current_corpus.id, "utterance_id": utterance_id}
+            for utterance_id in utterance_IDs
+        ])
 
     #Saving Corpus as UUIDs to remove name collision issues
     corpus_uuid = uuid.uuid1()
-    corpus_path = Path(flask.current_app.config['CORPUS_PATH']) / str(corpus_uuid)
-    audio_uploads_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
-    transcription_uploads_path = Path(flask.current_app.config['UPLOADED_TEXT_DEST'])
-    create_corpus_file_structure(audio_uploads_path, transcription_uploads_path, current_corpus, corpus_path)
     current_corpus.filesystem_path = str(corpus_uuid) # see if there's some other way of handling a UUID value directly into SQLAlchemy
     db.session.add(current_corpus)
 
-    # Creating the corpus object has the side-effect of creating a directory located at the path
-    # given to `tgt_dir`
-    persephone_corpus = Corpus(
-        feat_type=current_corpus.featureType,
-        label_type=current_corpus.labelType,
-        tgt_dir=corpus_path,
-    )
-    labels = persephone_corpus.labels
-    # Create database entries for any labels in the corpus that don't
-    # currently exist in the Label table
-    for l in labels:
-        current_label = get_or_create(db.session, Label, label=l)
-        db.session.add(current_label)
-
-        # Make CorpusLabelSet entry
-        db.session.add(
-            CorpusLabelSet(
-                corpus=current_corpus,
-                label=current_label
-            )
+    # The data splits are checked before the corpus is recorded, only the
+    # slow stages of the build are left to the background job
+    app = flask.current_app._get_current_object() # pylint: disable=protected-access
+    try:
+        validate_partitions(
+            Path(app.config['UPLOADED_AUDIO_DEST']),
+            Path(app.config['UPLOADED_TEXT_DEST']),
+            current_corpus,
+            Path(app.config['CORPUS_PATH']) / current_corpus.filesystem_path
         )
+    except (ValueError, FileNotFoundError) as error:
+        db.session.rollback()
+        return error_information(
+            status=400,
+            title="Invalid corpus",
+            detail=str(error),
+        )
+    current_corpus.build_stage = "validate"
     try:
         db.session.commit()
     except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
         return error_information(
             status=400,
             title="Database error",
             detail="Database error",
         )
-    else:
-        result = fix_corpus_format(CorpusSchema().dump(current_corpus).data)
-        return result, 201
+
+    # The files, features and labels of the corpus are built in the background
+    build_job = submit_corpus_build(current_corpus.id)
+    result = fix_corpus_format(CorpusSchema().dump(current_corpus).data)
+    result["buildJob"] = JobSchema().dump(build_job).data
+    return result, 202
+
+def submit_corpus_build(corpus_id: int) -> Job:
+    """Submit a job building a corpus from the stage after its last completed one"""
+    app = flask.current_app._get_current_object() # pylint: disable=protected-access
+    current_job = create_job("corpus-build")
+    submit_job(
+        app,
+        current_job.id,
+        get_executor(app, "corpus-build", app.config['CORPUS_BUILD_WORKERS'], threads=True),
+        run_corpus_build,
+        app,
+        current_job.id,
+        corpus_id,
+        on_success=lambda summary: summary
+    )
+    return current_job
+
+def build(corpusID):
+    """Restart the build of a corpus from the stage after the last one that completed.
+
+    This resumes builds that failed or were interrupted, a corpus that is
+    already ready completes straight away without running any stage.
+    """
+    DBcorpus.query.get_or_404(corpusID)
+    current_job = submit_corpus_build(corpusID)
+    result = JobSchema().dump(current_job).data
+    return result, 202
 
 def get_label_set(corpusID):
     """Get the label set for a corpus with the given ID"""
@@ -251,5 +338,39 @@ def get_label_set(corpusID):
     return {"corpus": corpus_data, "labels": results }, 200
 
 def preprocess(corpusID):
-    """Preprocess a corpus"""
-    raise NotImplementedError
\ No newline at end of file
+    """Submit a job to extract the features of every utterance of a corpus.
+
+    Features are extracted in parallel and utterances with up to date features
+    are skipped, the job progress reports how many utterances are done.
+    """
+    current_corpus = DBcorpus.query.get_or_404(corpusID)
+    if current_corpus.completed_build_stage != "ready":
+        # The build lays out the files that features are extracted from
+        return error_information(
+            status=409,
+            title="The corpus is not ready",
+            detail="The corpus {} hasn't finished building, its last completed build stage is {}. "
+                   "Wait for its build job to finish or restart the build.".format(
+                       corpusID, current_corpus.completed_build_stage),
+        )
+    app = flask.current_app._get_current_object() # pylint: disable=protected-access
+    corpus_path = Path(app.config['CORPUS_PATH']) / current_corpus.filesystem_path
+
+    def mark_preprocessed(summary: dict) -> dict:
+        DBcorpus.query.get(corpusID).preprocessed = True
+        return summary
+
+    current_job = create_job("preprocessing")
+    submit_job(
+        app,
+        current_job.id,
+        get_executor(app, "corpus-preprocessing", 1, threads=True),
+        preprocess_corpus,
+        app,
+        current_job.id,
+        corpus_path,
+        current_corpus.featureType,
+        on_success=mark_preprocessed
+    )
+    result = JobSchema().dump(current_job).data
+    return result, 202
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+API endpoints for /jobs
+This deals with checking on the status of work that runs in the background.
+"""
+from ..db_models import Job
+from ..error_response import error_information
+from ..serialization import JobSchema
+from ..training_scheduler import training_scheduler
+
+
+def get(jobID):
+    """Get the status, and result if it has finished, of a job"""
+    current_job = Job.query.get_or_404(jobID)
+    result = JobSchema().dump(current_job).data
+    return result, 200
+
+def delete(jobID):
+    """Cancel a training job, stopping it if it has already started"""
+    current_job = Job.query.get_or_404(jobID)
+    if current_job.kind != "training":
+        return error_information(
+            status=400,
+            title="Job can't be cancelled",
+            detail="Only training jobs can be cancelled, job {} is a {} job".format(jobID, current_job.kind),
+        )
+    if current_job.status not in (Job.QUEUED, Job.RUNNING):
+        return error_information(
+            status=409,
+            title="Job has already finished",
+            detail="Job {} has already finished with status {}".format(jobID, current_job.status),
+        )
+    training_scheduler.cancel(current_job)
+    result = JobSchema().dump(current_job).data
+    return result, 200
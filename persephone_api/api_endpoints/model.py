@@ -2,80 +2,34 @@
 API endpoints for /model
 This deals with the API access for model definitions and metadata
 """
+import json
 from pathlib import Path
-import pickle
+from typing import List, Optional
 import uuid
 
 import flask
 import sqlalchemy
 
-from persephone import experiment
-from persephone import rnn_ctc
-from persephone.corpus_reader import CorpusReader
-from persephone import model
+from persephone.utils import make_batches
 
-from .corpus import labels_set
 from .transcription import create_transcription
 
-from ..db_models import Audio, DBcorpus, FileMetaData, Transcription, TranscriptionModel
+from ..db_models import Audio, CorpusLabelSet, DBcorpus, FileMetaData, Job, Transcription, TranscriptionModel
 from ..error_response import error_information
-from ..extensions import db
-from ..serialization import TranscriptionModelSchema, TranscriptionSchema
+from ..evaluation import evaluate_model
+from ..extensions import db, micro_batcher
+from ..feature_cache import FeatureCache, audio_content_hash
+from ..inference import ModelDescriptor, checkout_model, decode_audio_file, decode_features
+from ..jobs import create_job, get_executor, submit_job
+from ..memoization import find_memoized_transcription, memoize_transcription, transcription_coalescer
+from ..model_registry import latest_checkpoint, model_registry
+from ..segmentation import decode_long_audio
+from ..serialization import JobSchema, TranscriptionModelSchema, TranscriptionSchema
+from ..training_progress import follow_events, read_events
+from ..training_scheduler import RESUME, SCRATCH, WARM_START, training_scheduler
 from ..upload_config import uploads_url_base
 
 
-# quick and dirty way of persisting models, most certainly not fit for production
-# in a multi user environment
-available_models = {}
-
-def get_transcription_model(model_id: int) -> model.Model:
-    """Return an instance of a Persephone model for a given ID"""
-    return available_models[model_id]
-
-def register_transcription_model(model_id: int, model_object: model.Model) -> None:
-    """Register a python object containing the transcription model"""
-    available_models[model_id] = model_object
-
-def decide_batch_size(num_train: int) -> int:
-    """Determine size of batches for use in training"""
-    if num_train >= 512:
-        batch_size = 16
-    elif num_train < 128:
-        if num_train < 4:
-            batch_size = 1
-        else:
-            batch_size = 4
-    else:
-        batch_size = int(num_train / 32)
-
-    return batch_size
-
-def create_RNN_CTC_model(model_db: TranscriptionModel, corpus_storage_path: Path,
-                         models_storage_path: Path) -> rnn_ctc.Model:
-    """Create a persephone RNN CTC model
-
-    :model: The database entry contaning the information about the model attempting
-            to be created here.
-    :corpus_storage_path: The path the corpuses are stored at.
-    :models_storage_path: The path the models are stored at.
-    """
-    model_path = models_storage_path / model_db.filesystem_path
-    exp_dir = experiment.prep_exp_dir(directory=str(model_path))
-    corpus_db_entry = model_db.corpus
-    pickled_corpus_path = corpus_storage_path / corpus_db_entry.filesystem_path / "corpus.p"
-    with pickled_corpus_path.open('rb') as pickle_file:
-        corpus = pickle.load(pickle_file)
-
-    corpus_reader = CorpusReader(corpus, batch_size=decide_batch_size(len(corpus.train_prefixes)))
-    return rnn_ctc.Model(
-        exp_dir,
-        corpus_reader,
-        num_layers=model_db.num_layers,
-        hidden_size=model_db.hidden_size,
-        beam_width=model_db.beam_width,
-        decoding_merge_repeated=model_db.decoding_merge_repeated
-        )
-
 def search(pageNumber=1, pageSize=20):
     """Handle request to search over all models"""
     paginated_results = TranscriptionModel.query.paginate(
@@ -90,6 +44,34 @@ def get(modelID):
     result = TranscriptionModelSchema().dump(transcription_model).data
     return result, 200
 
+def model_from_info(modelInfo: dict, current_corpus: DBcorpus) -> TranscriptionModel:
+    """Create the DB entry for a model from its API description, filling in defaults.
+    Raises ValueError if the description is inconsistent."""
+    min_epochs = modelInfo.get('minimumEpochs', 0)
+    max_epochs = modelInfo.get('maximumEpochs', None)
+    if max_epochs and min_epochs > max_epochs:
+        raise ValueError("Minimum epochs must be smaller than the maximum."
+                         "Got max: {} min: {}. Check your parameters".format(max_epochs, min_epochs))
+
+    model_uuid = uuid.uuid1()
+
+    return TranscriptionModel(
+        name=modelInfo['name'],
+        corpus=current_corpus,
+        num_layers=modelInfo.get('numberLayers', 3),
+        hidden_size=modelInfo.get('hiddenSize', 250),
+        min_epochs=min_epochs,
+        max_epochs=max_epochs,
+        beam_width=modelInfo.get('beamWidth', 100),
+        decoding_merge_repeated=modelInfo.get('decodingMergeRepeated', True),
+        early_stopping_steps=modelInfo.get('earlyStoppingSteps', None),
+        batching_strategy=modelInfo.get('batchingStrategy', "fixed"),
+        frames_per_batch=modelInfo.get('framesPerBatch', None),
+        filesystem_path=str(model_uuid),
+        max_train_LER=modelInfo.get('maximumTrainingLER', 0.3),
+        max_valid_LER=modelInfo.get('maximumValidationLER', 1.0)
+    )
+
 def post(modelInfo):
     """Create a new transcription model"""
     current_corpus = DBcorpus.query.get(modelInfo['corpusID'])
@@ -100,40 +82,24 @@ def post(modelInfo):
             detail="The corpus ID provided is not available, "
                    "make sure the corpus your model is using exists first.",
         )
+    if current_corpus.completed_build_stage != "ready":
+        return error_information(
+            status=400,
+            title="The corpus is not ready",
+            detail="The corpus {} hasn't finished building, its last completed build stage is {}. "
+                   "Wait for its build job to finish or restart the build.".format(
+                       current_corpus.id, current_corpus.completed_build_stage),
+        )
 
-    min_epochs = modelInfo.get('minimumEpochs', 0)
-    max_epochs = modelInfo.get('maximumEpochs', None)
-    if max_epochs and min_epochs > max_epochs:
+    try:
+        current_model = model_from_info(modelInfo, current_corpus)
+    except ValueError as error:
         return error_information(
             status=400,
             title="Minimum epochs must be smaller than the maximum.",
-            detail="Minimum epochs must be smaller than the maximum."
-                   "Got max: {} min: {}. Check your parameters".format(max_epochs, min_epochs),
+            detail=str(error),
         )
 
-    early_stopping_steps = modelInfo.get('earlyStoppingSteps', None)
-    num_layers = modelInfo.get('numberLayers', 3)
-    hidden_size = modelInfo.get('hiddenSize', 250)
-    beam_width = modelInfo.get('beamWidth', 100)
-    decoding_merge_repeated = modelInfo.get('decodingMergeRepeated', True)
-
-    model_uuid = uuid.uuid1()
-
-    current_model = TranscriptionModel(
-        name=modelInfo['name'],
-        corpus=current_corpus,
-        num_layers=num_layers,
-        hidden_size=hidden_size,
-        min_epochs=min_epochs,
-        max_epochs=max_epochs,
-        beam_width=beam_width,
-        decoding_merge_repeated=decoding_merge_repeated,
-        early_stopping_steps=early_stopping_steps,
-        filesystem_path=str(model_uuid),
-        max_train_LER=modelInfo.get('maximumTrainingLER', 0.3),
-        max_valid_LER=modelInfo.get('maximumValidationLER', 1.0)
-    )
-
     db.session.add(current_model)
 
     try:
@@ -149,86 +115,363 @@ def post(modelInfo):
         return result, 201
 
 
-def train(modelID):
-    """Submit task to train a model"""
+def train(modelID, priority=0, mode=SCRATCH, fromModelID=None):
+    """Submit a job to train a model.
+
+    Training runs in the background under the control of the training scheduler,
+    this returns as soon as the job has been queued.
+    A model can be trained from scratch, resumed from its latest checkpoint or
+    warm started from the weights of another model with the same labels.
+    """
     current_model = TranscriptionModel.query.get_or_404(modelID)
-    persephone_model = create_RNN_CTC_model(
-        current_model,
-        corpus_storage_path=Path(flask.current_app.config['CORPUS_PATH']),
-        models_storage_path=Path(flask.current_app.config['MODELS_PATH'])
+    parameters = {"mode": mode}
+    if mode == RESUME:
+        model_path = Path(flask.current_app.config['MODELS_PATH']) / current_model.filesystem_path
+        if latest_checkpoint(model_path) is None:
+            return error_information(
+                status=400,
+                title="No checkpoint to resume from",
+                detail="Model {} has not saved a checkpoint yet, train it from scratch.".format(modelID),
+            )
+    elif mode == WARM_START:
+        if fromModelID is None:
+            return error_information(
+                status=400,
+                title="No model to warm start from",
+                detail="Provide the ID of a trained model to warm start from with fromModelID.",
+            )
+        source_model = TranscriptionModel.query.get(fromModelID)
+        descriptor = model_registry.resolve(source_model) if source_model is not None else None
+        if descriptor is None:
+            return untrained_model_error(fromModelID)
+        incompatibility = warm_start_incompatibility(current_model, source_model, descriptor)
+        if incompatibility:
+            return error_information(
+                status=400,
+                title="Models are not compatible",
+                detail="Can't warm start model {} from model {}: {}".format(modelID, fromModelID, incompatibility),
+            )
+        parameters["fromModelID"] = fromModelID
+    current_job = training_scheduler.submit(current_model, priority=priority, parameters=parameters)
+    result = JobSchema().dump(current_job).data
+    return result, 202
+
+def warm_start_incompatibility(current_model: TranscriptionModel, source_model: TranscriptionModel,
+                               descriptor: ModelDescriptor) -> Optional[str]:
+    """Reason why a model can't be initialized from the weights of another model, None if it can.
+    The networks must have the same shape, so the labels, features and layers must match."""
+    labels = CorpusLabelSet.query.filter_by(corpus_id=current_model.corpus_id).all()
+    if set(descriptor.labels) != {item.label.label for item in labels}:
+        return "the label sets are different"
+    if descriptor.feature_type != current_model.corpus.featureType:
+        return "the feature types are different"
+    if (source_model.num_layers, source_model.hidden_size) != (current_model.num_layers, current_model.hidden_size):
+        return "the number or size of layers are different"
+    return None
+
+def training_in_progress(model_id: int) -> bool:
+    """Check if the model has a training job queued or running"""
+    in_progress = db.session.query(
+        Job.query.filter(
+            Job.model_id == model_id,
+            Job.kind == "training",
+            Job.status.in_((Job.QUEUED, Job.RUNNING))
+        ).exists()
+    ).scalar()
+    # End the transaction so that the next check sees jobs that have changed since
+    db.session.rollback()
+    return in_progress
+
+def train_events(modelID):
+    """Stream the progress of the training of a model as Server-Sent Events.
+
+    An event is sent as training starts, at the end of every epoch with the training
+    and validation label error rates, throughput and elapsed time, and when training ends.
+    The stream is closed after TRAINING_EVENTS_MAX_STREAM_SECONDS, or once every event has been
+    sent if the model isn't being trained, so that streams don't hold API workers. Clients
+    reconnect with the Last-Event-ID they saw, a 204 tells them there is nothing more to follow.
+    """
+    current_model = TranscriptionModel.query.get_or_404(modelID)
+    model_path = Path(flask.current_app.config['MODELS_PATH']) / current_model.filesystem_path
+    last_event_id = flask.request.headers.get('Last-Event-ID', '')
+    start_after = int(last_event_id) if last_event_id.isdigit() else None
+    if (start_after is not None and not training_in_progress(modelID)
+            and len(list(read_events(model_path))) <= start_after):
+        return flask.Response(status=204)
+    return flask.Response(
+        flask.stream_with_context(follow_events(
+            model_path,
+            start_after=start_after,
+            max_seconds=flask.current_app.config['TRAINING_EVENTS_MAX_STREAM_SECONDS'],
+            is_training=lambda: training_in_progress(modelID)
+        )),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def untrained_model_error(modelID):
+    """Error response for requests that need a trained model"""
+    return error_information(
+        status=400,
+        title="Model has not been trained",
+        detail="Model {} has no trained checkpoint, train it first.".format(modelID),
     )
 
-    register_transcription_model(modelID, persephone_model)
-    MAX_EPOCHS = 100 # TODO: Set maximum epochs somewhere else
-    if current_model.max_epochs:
-        epochs = current_model.max_epochs
+def save_decoded_transcription(current_model: TranscriptionModel, audio_info: Audio,
+                               decoded: List[str], *, commit: bool=True) -> Transcription:
+    """Store the labels decoded from an audio file by a model as a Transcription"""
+    transcription_name = "transcribed-{}-model-{}".format(
+        audio_info.file_info.name,
+        current_model.name
+    )
+    prefix = uuid.uuid1()
+    filename = str(prefix) + "TRANSCRIBED_BY_MODEL" + str(audio_info.file_info.name)
+    if decoded == []:
+        text = ""
     else:
-        epochs = MAX_EPOCHS
-
-    # we construct the parameters here so that the call to the model training
-    # respects the default value for arguments as found in the Persephone library
-    parameters = {
-        "min_epochs": current_model.min_epochs,
-        "max_epochs": epochs,
-    }
-    if current_model.early_stopping_steps is not None:
-        parameters["early_stopping_steps"] = current_model.early_stopping_steps
-    if current_model.max_valid_LER is not None:
-        parameters["max_valid_ler"] = current_model.max_valid_LER
-    if current_model.max_train_LER is not None:
-        parameters["max_train_ler"] = current_model.max_train_LER
-
-    persephone_model.train(**parameters)
-    # TODO: Save this information about the network topology of tensorflow with the names
-    # somewhere so it can be easily used in the transcribe step
-    #print("persephone_model.batch_x: ", persephone_model.batch_x)
-    #print("persephone_model.batch_x_lens: ", persephone_model.batch_x_lens)
-    #print("persephone_model.dense_decoded: ", persephone_model.dense_decoded)
-
-    return "Model trained", 200
+        text = " ".join(decoded)
+
+    current_transcription, _ = create_transcription(
+        filepath=filename,
+        data=text,
+        transcription_name=transcription_name,
+        commit=commit
+    )
+    return current_transcription
+
+def decode_micro_batched(descriptor: ModelDescriptor, audio_path: Path) -> List[str]:
+    """Decode audio in the same batch as other requests for this model that arrive at about the same time"""
+    feature_cache = FeatureCache.from_config(flask.current_app.config)
+    # The features and model are held until the batch this joins has been decoded
+    with feature_cache.pinned_features([audio_path], descriptor.feature_type) as feature_paths:
+        with checkout_model(descriptor) as loaded_model:
+            def decode_batch(batch_paths: List[Path]) -> List[List[str]]:
+                return decode_features(loaded_model, batch_paths, descriptor.labels, batch_size=len(batch_paths))
+
+            # Batches must not mix models restored from different checkpoints
+            batch_key = (descriptor.model_id, descriptor.version)
+            return micro_batcher.submit(batch_key, feature_paths[0], decode_batch)
 
 def transcribe(modelID, audioID):
-    """Transcribe audio with the given model"""
+    """Transcribe audio with the given model.
+    If this checkpoint of the model has already transcribed audio with the same
+    contents the existing transcription is returned instead of decoding again."""
     current_model = TranscriptionModel.query.get_or_404(modelID)
     audio_info = Audio.query.get_or_404(audioID)
     # TODO: test that audio file is not empty
 
-    # TODO: handle experiment number in path
-    model_path = Path(flask.current_app.config['MODELS_PATH']) / current_model.filesystem_path / "0"
-    model_checkpoint_path = model_path / "model" / "model_best.ckpt"
     audio_uploads_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
-
-    # putting features into the existing corpus path for now
-    corpus_path = Path(flask.current_app.config['CORPUS_PATH']) / current_model.corpus.filesystem_path
     audio_path = audio_uploads_path / audio_info.file_info.name
 
-    labels = [item.label for item in labels_set(current_model.corpus)]
+    descriptor = model_registry.resolve(current_model)
+    if descriptor is None:
+        return untrained_model_error(modelID)
+    # Uploads stored by content already have their hash, only older uploads are hashed here
+    content_hash = audio_info.file_info.blob_hash or audio_content_hash(audio_path)
+    memo_key = (current_model.id, descriptor.version, content_hash)
+    memoized = find_memoized_transcription(*memo_key)
+    if memoized is not None:
+        return TranscriptionSchema().dump(memoized).data, 200
+
+    def decode_and_save() -> int:
+        """Decode the audio and record the transcription, returns the transcription ID"""
+        if micro_batcher.enabled:
+            decoded = decode_micro_batched(descriptor, audio_path)
+        else:
+            decoded = decode_audio_file(
+                descriptor,
+                audio_path,
+                FeatureCache.from_config(flask.current_app.config)
+            )
+        current_transcription = save_decoded_transcription(current_model, audio_info, decoded, commit=False)
+        return memoize_transcription(*memo_key, current_transcription).id
+
+    # Concurrent requests for the same transcription share one decode
+    transcription_id = transcription_coalescer.run(memo_key, decode_and_save)
+    current_transcription = Transcription.query.get(transcription_id)
+    result = TranscriptionSchema().dump(current_transcription).data
+
+    return result, 201
+
+def transcribe_job(modelID, audioID):
+    """Submit a job to transcribe audio with the given model.
 
-    results = model.decode(
-        model_checkpoint_path, [audio_path],
-        labels,
-        feature_type=current_model.corpus.featureType,
-        batch_x_name="batch_x:0",
-        batch_x_lens_name="batch_x_lens:0",
-        output_name="hyp_dense_decoded:0"
+    The audio is decoded in a pool of worker processes so this returns as soon as
+    the job has been queued, the job can then be polled for the transcription.
+    """
+    current_model = TranscriptionModel.query.get_or_404(modelID)
+    audio_info = Audio.query.get_or_404(audioID)
+
+    audio_uploads_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
+    audio_path = audio_uploads_path / audio_info.file_info.name
+    descriptor = model_registry.resolve(current_model)
+    if descriptor is None:
+        return untrained_model_error(modelID)
+
+    current_job = create_job("transcription")
+
+    def save_result(decoded: List[str]) -> dict:
+        """Create the transcription once the audio has been decoded"""
+        current_transcription = save_decoded_transcription(
+            TranscriptionModel.query.get(modelID),
+            Audio.query.get(audioID),
+            decoded
         )
+        return {
+            "transcriptionID": current_transcription.id,
+            "transcription": TranscriptionSchema().dump(current_transcription).data,
+        }
+
+    app = flask.current_app._get_current_object() # pylint: disable=protected-access
+    submit_job(
+        app,
+        current_job.id,
+        get_executor(app, "transcription", app.config['TRANSCRIPTION_WORKERS']),
+        decode_audio_file,
+        descriptor,
+        audio_path,
+        FeatureCache.from_config(app.config),
+        on_success=save_result
+    )
+    result = JobSchema().dump(current_job).data
+    return result, 202
 
-    transcription_name = "transcribed-{}-model-{}".format(
-        audio_info.file_info.name,
-        current_model.name
+def evaluate(modelID, batchSize=None):
+    """Submit a job to evaluate a model on the test set of its corpus.
+
+    The job result reports the label error rate of each test utterance,
+    the label error rate over the whole test set and the decoding throughput.
+    """
+    current_model = TranscriptionModel.query.get_or_404(modelID)
+    descriptor = model_registry.resolve(current_model)
+    if descriptor is None:
+        return untrained_model_error(modelID)
+
+    app = flask.current_app._get_current_object() # pylint: disable=protected-access
+    if batchSize is None:
+        batchSize = app.config['TRANSCRIPTION_BATCH_SIZE']
+    corpus_path = Path(app.config['CORPUS_PATH']) / current_model.corpus.filesystem_path
+
+    current_job = create_job("evaluation")
+    submit_job(
+        app,
+        current_job.id,
+        get_executor(app, "transcription", app.config['TRANSCRIPTION_WORKERS']),
+        evaluate_model,
+        descriptor,
+        corpus_path,
+        batchSize,
+        on_success=lambda summary: summary
     )
-    prefix = uuid.uuid1()
-    filename = str(prefix) + "TRANSCRIBED_BY_MODEL" + str(audio_info.file_info.name)
-    if results[0] == []:
-        text = ""
-    else:
-        text = " ".join(results[0])
+    result = JobSchema().dump(current_job).data
+    return result, 202
 
-    current_transcription = create_transcription(
-        filepath=filename,
-        data=text,
-        transcription_name=transcription_name
+def transcribe_batch(modelID, batchInfo):
+    """Transcribe many audio files with the given model.
+
+    The model and its labels are loaded once and the audio is decoded in fixed size batches.
+    Results are streamed back as newline delimited JSON as each batch is decoded,
+    all the transcriptions are created in a single transaction that is committed
+    once every batch has been decoded.
+    """
+    current_model = TranscriptionModel.query.get_or_404(modelID)
+    audio_ids = batchInfo['audioIDs']
+    batch_size = batchInfo.get('batchSize', flask.current_app.config['TRANSCRIPTION_BATCH_SIZE'])
+
+    audio_by_id = {audio.id: audio for audio in Audio.query.filter(Audio.id.in_(audio_ids)).all()}
+    missing_ids = sorted(set(audio_ids) - set(audio_by_id))
+    if missing_ids:
+        return error_information(
+            status=404,
+            title="Audio not found",
+            detail="No audio files exist with the IDs {}".format(missing_ids),
+        )
+    audio_infos = [audio_by_id[audio_id] for audio_id in audio_ids]
+    descriptor = model_registry.resolve(current_model)
+    if descriptor is None:
+        return untrained_model_error(modelID)
+
+    audio_uploads_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
+    feature_cache = FeatureCache.from_config(flask.current_app.config)
+
+    def generate_results():
+        """Decode one batch at a time, yielding a JSON line for each transcription"""
+        try:
+            with checkout_model(descriptor) as loaded_model:
+                for audio_batch in make_batches(audio_infos, batch_size):
+                    audio_paths = [audio_uploads_path / audio_info.file_info.name for audio_info in audio_batch]
+                    with feature_cache.pinned_features(audio_paths, descriptor.feature_type) as feature_paths:
+                        results = decode_features(loaded_model, feature_paths, descriptor.labels, batch_size)
+                    transcriptions = [
+                        save_decoded_transcription(current_model, audio_info, decoded, commit=False)
+                        for audio_info, decoded in zip(audio_batch, results)
+                    ]
+                    db.session.flush() # assign IDs before serializing
+                    for audio_info, transcription in zip(audio_batch, transcriptions):
+                        yield json.dumps({
+                            "audioID": audio_info.id,
+                            "transcription": TranscriptionSchema().dump(transcription).data,
+                        }) + "\n"
+            db.session.commit()
+        except BaseException:
+            # Also covers the client disconnecting part way through the stream
+            db.session.rollback()
+            raise
+        yield json.dumps({"committed": len(audio_infos)}) + "\n"
+
+    return flask.Response(
+        flask.stream_with_context(generate_results()),
+        status=201,
+        mimetype="application/x-ndjson"
     )
-    result = TranscriptionSchema().dump(current_transcription).data
 
-    return result, 201
+def transcribe_long(modelID, audioID, maxSegmentSeconds=None, batchSize=None):
+    """Transcribe a long recording with the given model.
+
+    The recording is split into segments at pauses and the segments are decoded in batches.
+    Each segment is streamed back as newline delimited JSON with its start and end time
+    as soon as its batch is decoded, then the whole transcription is stored.
+    """
+    current_model = TranscriptionModel.query.get_or_404(modelID)
+    audio_info = Audio.query.get_or_404(audioID)
+
+    config = flask.current_app.config
+    audio_path = Path(config['UPLOADED_AUDIO_DEST']) / audio_info.file_info.name
+    descriptor = model_registry.resolve(current_model)
+    if descriptor is None:
+        return untrained_model_error(modelID)
+
+    def generate_results():
+        """Yield a JSON line for each segment, then one for the stored transcription"""
+        decoded = [] # type: List[str]
+        segment_count = 0
+        with checkout_model(descriptor) as loaded_model:
+            segments = decode_long_audio(
+                loaded_model,
+                audio_path,
+                descriptor.feature_type,
+                descriptor.labels,
+                batch_size=batchSize or config['LONG_AUDIO_BATCH_SIZE'],
+                max_seconds=maxSegmentSeconds or config['LONG_AUDIO_MAX_SEGMENT_SECONDS'],
+                min_silence_seconds=config['LONG_AUDIO_MIN_SILENCE_SECONDS'],
+                silence_threshold_db=config['LONG_AUDIO_SILENCE_THRESHOLD_DB'],
+            )
+            for segment in segments:
+                decoded.extend(segment["labels"])
+                segment_count += 1
+                yield json.dumps({
+                    "start": segment["start"],
+                    "end": segment["end"],
+                    "transcription": " ".join(segment["labels"]),
+                }) + "\n"
+        current_transcription = save_decoded_transcription(current_model, audio_info, decoded)
+        yield json.dumps({
+            "segments": segment_count,
+            "transcription": TranscriptionSchema().dump(current_transcription).data,
+        }) + "\n"
+
+    return flask.Response(
+        flask.stream_with_context(generate_results()),
+        status=201,
+        mimetype="application/x-ndjson"
+    )
@@ -0,0 +1,165 @@
+"""
+API endpoints for /sweep
+This deals with hyperparameter sweeps, sets of models trained to compare parameters
+"""
+import functools
+import json
+from pathlib import Path
+
+import flask
+import jsonschema
+import yaml
+
+from .model import model_from_info
+
+from ..db_models import DBcorpus, Job, Sweep
+from ..error_response import error_information
+from ..extensions import db
+from ..serialization import SweepSchema, TranscriptionModelSchema
+from ..sweeps import SWEEP_PARAMETERS, grid_runs, random_runs
+from ..training_progress import best_validation_ler, last_completed_epoch
+from ..training_scheduler import SCRATCH, training_scheduler
+
+
+@functools.lru_cache()
+def model_information_validator() -> jsonschema.Draft4Validator:
+    """Validator of model descriptions, from the modelInformation definition of the API specification"""
+    with (Path(__file__).parent.parent / "api_spec.yaml").open(encoding='utf-8') as spec_file:
+        definitions = yaml.safe_load(spec_file)["definitions"]
+    schema = definitions["modelInformation"]
+    # JSON schema has no x-nullable, null is given as one of the types instead
+    properties = {
+        name: dict(prop, type=[prop["type"], "null"]) if prop.get("x-nullable") else prop
+        for name, prop in schema["properties"].items()
+    }
+    return jsonschema.Draft4Validator(dict(schema, properties=properties, definitions=definitions))
+
+def sweep_runs(sweepInfo: dict):
+    """Parameters of each run described by a sweep request"""
+    if 'grid' in sweepInfo:
+        return grid_runs(sweepInfo['grid'])
+    return random_runs(sweepInfo['random'], sweepInfo.get('numberRuns', 1), sweepInfo.get('seed'))
+
+def post(sweepInfo):
+    """Create a model for every run of a sweep and queue them all for training"""
+    current_corpus = DBcorpus.query.get(sweepInfo['corpusID'])
+    if current_corpus is None:
+        return error_information(
+            status=400,
+            title="The corpus ID provided is not available",
+            detail="The corpus ID provided is not available, "
+                   "make sure the corpus your sweep is using exists first.",
+        )
+    if current_corpus.completed_build_stage != "ready":
+        return error_information(
+            status=400,
+            title="The corpus is not ready",
+            detail="The corpus {} hasn't finished building, its last completed build stage is {}. "
+                   "Wait for its build job to finish or restart the build.".format(
+                       current_corpus.id, current_corpus.completed_build_stage),
+        )
+
+    if ('grid' in sweepInfo) == ('random' in sweepInfo):
+        return error_information(
+            status=400,
+            title="Invalid sweep specification",
+            detail="Give either a grid of parameter values or a random search space, but not both.",
+        )
+    swept = set(sweepInfo.get('grid') or sweepInfo.get('random'))
+    unknown = swept - set(SWEEP_PARAMETERS)
+    if unknown:
+        return error_information(
+            status=400,
+            title="Invalid sweep specification",
+            detail="These parameters can't be swept: {}. Sweepable parameters are {}".format(
+                ", ".join(sorted(unknown)), ", ".join(SWEEP_PARAMETERS)),
+        )
+    try:
+        runs = sweep_runs(sweepInfo)
+    except (KeyError, TypeError, ValueError) as error:
+        return error_information(
+            status=400,
+            title="Invalid sweep specification",
+            detail="The parameter values of the sweep couldn't be read: {}".format(error),
+        )
+    max_runs = flask.current_app.config['SWEEP_MAX_RUNS']
+    if not runs or len(runs) > max_runs:
+        return error_information(
+            status=400,
+            title="Invalid number of runs",
+            detail="A sweep must have between 1 and {} runs, this sweep has {}".format(max_runs, len(runs)),
+        )
+
+    spec = {key: sweepInfo[key] for key in ('base', 'grid', 'random', 'numberRuns', 'seed') if key in sweepInfo}
+    current_sweep = Sweep(name=sweepInfo['name'], corpus=current_corpus, spec=json.dumps(spec))
+    models = []
+    for run_number, run_parameters in enumerate(runs, start=1):
+        model_info = dict(sweepInfo.get('base', {}))
+        model_info.update(run_parameters)
+        model_info['name'] = "{} #{}".format(sweepInfo['name'], run_number)
+        # The request validation only checks the sweep, not the models it describes
+        errors = sorted(model_information_validator().iter_errors(dict(model_info, corpusID=current_corpus.id)),
+                        key=lambda error: list(error.path))
+        if errors:
+            return error_information(
+                status=400,
+                title="Invalid sweep specification",
+                detail="Run {} is invalid: {}".format(run_number, "; ".join(
+                    "{}: {}".format(".".join(str(part) for part in error.path) or "model", error.message)
+                    for error in errors)),
+            )
+        try:
+            current_model = model_from_info(model_info, current_corpus)
+        except ValueError as error:
+            return error_information(
+                status=400,
+                title="Invalid sweep specification",
+                detail="Run {} is invalid: {}".format(run_number, error),
+            )
+        current_model.sweep = current_sweep
+        models.append(current_model)
+    db.session.add(current_sweep)
+    db.session.add_all(models)
+    db.session.commit()
+
+    priority = sweepInfo.get('priority', 0)
+    for current_model in models:
+        training_scheduler.submit(
+            current_model,
+            priority,
+            parameters={"mode": SCRATCH, "sweepID": current_sweep.id}
+        )
+    return sweep_result(current_sweep), 202
+
+def get(sweepID):
+    """Get a sweep with its runs ranked by the best validation label error rate they reached"""
+    current_sweep = Sweep.query.get_or_404(sweepID)
+    return sweep_result(current_sweep), 200
+
+def sweep_result(current_sweep: Sweep) -> dict:
+    """Serialize a sweep with the progress of its runs, best run first.
+    Runs that haven't completed an epoch yet are ranked last."""
+    models_path = Path(flask.current_app.config['MODELS_PATH'])
+    spec = json.loads(current_sweep.spec)
+    swept = sorted(spec.get('grid') or spec.get('random') or {})
+    runs = []
+    for current_model in current_sweep.models:
+        model_path = models_path / current_model.filesystem_path
+        model_result = TranscriptionModelSchema().dump(current_model).data
+        latest_job = (Job.query.filter_by(kind="training", model_id=current_model.id)
+                      .order_by(Job.id.desc()).first())
+        runs.append({
+            "modelID": current_model.id,
+            "parameters": {name: model_result.get(name) for name in swept},
+            "jobID": latest_job.id if latest_job else None,
+            "status": latest_job.status if latest_job else None,
+            "bestValidationLER": best_validation_ler(model_path) if model_path.is_dir() else None,
+            "epochs": last_completed_epoch(model_path) if model_path.is_dir() else 0,
+        })
+    runs.sort(key=lambda run: (run["bestValidationLER"] is None, run["bestValidationLER"] or 0, run["modelID"]))
+    for rank, run in enumerate(runs, start=1):
+        run["rank"] = rank
+
+    result = SweepSchema().dump(current_sweep).data
+    result["runs"] = runs
+    return result
@@ -2,44 +2,58 @@
 API endpoints for /transcription
 This deals with the API access for transcription files uploading/downloading.
 """
-import os
 from pathlib import Path
+from typing import Tuple
 import uuid
 
 import flask
-import flask_uploads
 
+from ..blob_store import BlobStore, find_existing_file, link_named_file, remove_named_file
 from ..error_response import error_information
 from ..extensions import db
-from ..db_models import Transcription, FileMetaData
+from ..db_models import FileMetaData, MemoizedTranscription, Transcription
 from ..serialization import TranscriptionSchema
 from ..unicode_handling import normalize
 from ..upload_config import text_files, uploads_url_base
 
 
 def create_transcription(filepath: Path, data: str, *, base_path: Path=None,
-                         transcription_name: str=None) -> Transcription:
+                         transcription_name: str=None, commit: bool=True,
+                         reuse_existing: bool=False) -> Tuple[Transcription, bool]:
     """Creates the transcription rows in the database,
-    returns the ORM object that corresponds to this transcription
+    returns the ORM object that corresponds to this transcription and whether it was created
 
     Args:
-        filepath: The relative path to this file
+        filepath: The relative path to this file, a number is added to the
+          file name if it is already in use
         data: the data contained in this transcription
         base_path: The path to the storage for transcription files, if this not provided
           it will default to the upload file destination found in the app config
           `config['UPLOADED_TEXT_DEST']`
+        transcription_name: An optional name for this transcription
+        commit: If false the rows are added to the session but not committed,
+          this allows many transcriptions to be created in one transaction
+        reuse_existing: If a transcription with the same normalized text already
+          exists it is returned instead of creating a new one
     """
     if not base_path:
         base_path = Path(flask.current_app.config['UPLOADED_TEXT_DEST'])
     if not base_path.is_dir():
         base_path.mkdir()
     normalized_text = normalize(data)
-    storage_location = base_path / filepath
-    with storage_location.open('w') as transcription_storage:
-        transcription_storage.write(normalized_text)
-    filename = str(filepath)
+    store = BlobStore.from_config(flask.current_app.config)
+    blob = store.store_bytes(normalized_text.encode('utf-8'))
+    existing = find_existing_file(blob.hash, Transcription) if reuse_existing else None
+    if existing is not None:
+        return existing, False
+    requested_location = base_path / filepath
+    storage_location = link_named_file(store, blob, requested_location.parent, requested_location.name)
+    try:
+        filename = str(storage_location.relative_to(base_path))
+    except ValueError:
+        filename = str(storage_location)
     file_url = uploads_url_base + 'text_uploads/' + filename
-    file_metadata = FileMetaData(path=file_url, name=str(storage_location))
+    file_metadata = FileMetaData(path=file_url, name=str(storage_location), blob=blob)
 
     # If no optional name was provided we will just use the file name for
     # naming this transcription
@@ -53,8 +67,9 @@ def create_transcription(filepath: Path, data: str, *, base_path: Path=None,
         file_info=file_metadata,
     )
     db.session.add(current_transcription)
-    db.session.commit()
-    return current_transcription
+    if commit:
+        db.session.commit()
+    return current_transcription, True
 
 def post(body):
     """Create a transcription from a POST request that contains the
@@ -67,32 +82,27 @@ def post(body):
         optional_args['transcription_name'] = body['name']
     except KeyError:
         pass
-    current_transcription = create_transcription(filename, text, **optional_args)
+    current_transcription, _ = create_transcription(filename, text, **optional_args)
     result = TranscriptionSchema().dump(current_transcription).data
     return result, 201
 
-def from_file(transcriptionFile):
-    """handle POST request for transcription file"""
-    try:
-        filename = text_files.save(transcriptionFile)
-    except flask_uploads.UploadNotAllowed:
+def from_file(transcriptionFile, reuseExisting=False):
+    """handle POST request for transcription file.
+    If reuseExisting is set and a transcription with the same text was uploaded before,
+    that transcription is returned with a 200 status instead of creating a new one."""
+    basename = text_files.get_basename(transcriptionFile.filename)
+    if not text_files.file_allowed(transcriptionFile, basename):
         return error_information(
             status=415,
             title="Invalid file format for transcription upload",
             detail="Invalid file format for transcription upload, must be a text file"
                    " Got filename {} , allowed extensions are {}".format(transcriptionFile.filename, text_files.extensions),
         )
-    else:
-        # We re-open here because the passed in file is a generator that
-        # is expended by the save above, there may be a better way of dealing
-        # with this in the future
-        with open(text_files.path(filename), 'r') as tf:
-            raw_data = tf.read()
-        file_path = Path(filename)
-        current_transcription = create_transcription(file_path, raw_data)
+    raw_data = transcriptionFile.stream.read().decode('utf-8')
+    current_transcription, created = create_transcription(Path(basename), raw_data, reuse_existing=reuseExisting)
 
     result = TranscriptionSchema().dump(current_transcription).data
-    return result, 201
+    return result, 201 if created else 200
 
 def get(transcriptionID):
     """Handle GET request for transcription file information.
@@ -104,6 +114,25 @@ def get(transcriptionID):
     result = TranscriptionSchema().dump(transcription).data
     return result, 200
 
+def delete(transcriptionID):
+    """Delete a transcription that isn't part of any utterance.
+    Its file is removed once no other transcription has the same text."""
+    transcription = Transcription.query.get_or_404(transcriptionID)
+    if transcription.utterances:
+        return error_information(
+            status=409,
+            title="Transcription is in use",
+            detail="Transcription {} is part of the utterances {}".format(
+                transcriptionID, ", ".join(str(utterance.id) for utterance in transcription.utterances)),
+        )
+    # Memoized results of models refer to the transcriptions they made
+    MemoizedTranscription.query.filter_by(transcription_id=transcription.id).delete()
+    remove_named_file(BlobStore.from_config(flask.current_app.config), transcription.file_info,
+                      Path(flask.current_app.config['UPLOADED_TEXT_DEST']))
+    db.session.delete(transcription)
+    db.session.commit()
+    return None, 204
+
 
 def search(pageNumber=1, pageSize=20):
     """Search transcription files"""
@@ -6,9 +6,13 @@ import flask_uploads
 
 from . import api_endpoints
 
-from .extensions import db
+from .extensions import db, micro_batcher, model_cache
+from .model_registry import model_registry
+from .session_config import session_settings
 from .settings import ProdConfig
+from .training_scheduler import training_scheduler
 from .upload_config import configure_uploads
+from .warmup import warmup
 
 from flask_cors import CORS
 
@@ -43,4 +47,10 @@ def register_swagger_api(connexion_flask_app) -> None:
 def register_extensions(app) -> None:
     """Register Flask extensions."""
     db.init_app(app)
+    model_cache.init_app(app)
+    micro_batcher.init_app(app)
+    model_registry.init_app(app)
+    session_settings.init_app(app)
+    warmup.init_app(app)
+    training_scheduler.init_app(app)
     return None
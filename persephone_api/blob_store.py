@@ -0,0 +1,231 @@
+"""Content addressed storage of uploaded files
+
+Uploads are hashed with SHA-256 while they are streamed to disk and stored once
+per distinct content, under their hash. The named file that each upload is
+served and read from is a link to its blob, so uploading the same audio or
+transcription many times only stores it once. Blobs keep a count of the files
+referring to them so that they can be removed once nothing uses them.
+Files only exist while the rows describing them do: files created in a
+transaction that is rolled back are removed, and files of rows that were
+deleted are removed once the deletion is committed. A blob file is never
+removed while a committed row refers to it.
+The hash is the same as the content hash the feature cache and transcription
+memoization use, so it is a stable key for anything derived from an upload.
+"""
+import contextlib
+import fcntl
+import hashlib
+import io
+import os
+from pathlib import Path
+import tempfile
+from typing import BinaryIO, Iterable, Optional, Tuple, Union
+
+import sqlalchemy
+
+from .db_models import Audio, Blob, FileMetaData, Transcription
+from .extensions import db
+from .file_links import link_or_copy
+
+# Size of the chunks read from uploads while hashing them
+CHUNK_SIZE = 1024 * 1024
+
+# Keys of the session info holding files to remove if the transaction is
+# rolled back, and files to remove once it is committed
+CREATED_FILES = "blob_store_created_files"
+REMOVED_FILES = "blob_store_removed_files"
+# Keys of the session info holding the blob files the transaction created, the blob
+# files it deleted the rows of, and the (blob file, copy) pairs of blob files it uses
+# that already existed. Concurrent transactions can share a blob file before either
+# commits its row, so a blob file is only removed while holding the lock of its store
+# and if no committed row refers to it. Each transaction keeps its own copy of a blob
+# file it didn't create until it commits, to put back a file removed in the meantime.
+CREATED_BLOBS = "blob_store_created_blobs"
+REMOVED_BLOBS = "blob_store_removed_blobs"
+SHARED_BLOBS = "blob_store_shared_blobs"
+
+# File in the blob store locked while blob files are put back or removed
+LOCK_FILENAME = "lock"
+
+
+def _remove_files(paths: Iterable[Path]) -> None:
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+@contextlib.contextmanager
+def _store_lock(blob_path: Path):
+    """Exclusive lock on the blob store holding `blob_path`"""
+    with (blob_path.parent.parent / LOCK_FILENAME).open('a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _remove_unused_blob_files(session, blob_paths: Iterable[Path]) -> None:
+    """Remove blob files that no committed row refers to"""
+    for blob_path in blob_paths:
+        with _store_lock(blob_path):
+            with session.get_bind().connect() as connection:
+                committed = connection.execute(
+                    sqlalchemy.select([Blob.hash]).where(Blob.hash == blob_path.name)).first()
+            if committed is None:
+                _remove_files([blob_path])
+
+def _restore_shared_blob_files(shared: Iterable[Tuple[Path, Path]]) -> None:
+    """Put back blob files that were removed by another transaction since they were stored,
+    and remove the copies kept for that"""
+    for blob_path, copy_path in shared:
+        with _store_lock(blob_path):
+            if blob_path.exists():
+                _remove_files([copy_path])
+            else:
+                os.replace(str(copy_path), str(blob_path))
+
+@sqlalchemy.event.listens_for(db.session, "after_commit")
+def _remove_deleted_files(session) -> None:
+    """Remove the files of rows deleted in the committed transaction"""
+    if session.transaction.nested:
+        # Released savepoints are only committed with the transaction around them
+        return
+    session.info.pop(CREATED_FILES, None)
+    session.info.pop(CREATED_BLOBS, None)
+    _restore_shared_blob_files(session.info.pop(SHARED_BLOBS, []))
+    _remove_files(session.info.pop(REMOVED_FILES, []))
+    _remove_unused_blob_files(session, session.info.pop(REMOVED_BLOBS, []))
+
+@sqlalchemy.event.listens_for(db.session, "after_soft_rollback")
+def _remove_uncommitted_files(session, previous_transaction) -> None:
+    """Remove the files created in a transaction that was rolled back,
+    savepoints rolled back inside the transaction are left to it"""
+    if previous_transaction.parent is not None:
+        return
+    session.info.pop(REMOVED_FILES, None)
+    session.info.pop(REMOVED_BLOBS, None)
+    _remove_files(copy_path for _, copy_path in session.info.pop(SHARED_BLOBS, []))
+    _remove_files(session.info.pop(CREATED_FILES, []))
+    _remove_unused_blob_files(session, session.info.pop(CREATED_BLOBS, []))
+
+
+class BlobStore:
+    """Blobs stored at `path`, named by the SHA-256 of their contents"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    @classmethod
+    def from_config(cls, config) -> 'BlobStore':
+        """Create the blob store described by a flask app config"""
+        return cls(Path(config['BLOB_STORE_PATH']))
+
+    def blob_path(self, content_hash: str) -> Path:
+        """Where the blob with this hash is stored"""
+        return self.path / content_hash[:2] / content_hash
+
+    def store(self, stream: BinaryIO) -> Blob:
+        """Store the contents of a stream, hashing them as they are read.
+        Returns the blob for the contents, which is added to the session if it is new.
+        Its reference count is not changed, see `add_reference`."""
+        temporary_dir = self.path / "tmp"
+        temporary_dir.mkdir(parents=True, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=str(temporary_dir), delete=False) as temporary_file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                size += len(chunk)
+                temporary_file.write(chunk)
+        content_hash = sha256.hexdigest()
+
+        destination = self.blob_path(content_hash)
+        destination.parent.mkdir(exist_ok=True)
+        try:
+            # Linking fails if the file exists, so only one upload creates it
+            os.link(temporary_file.name, str(destination))
+        except FileExistsError:
+            db.session.info.setdefault(SHARED_BLOBS, []).append((destination, Path(temporary_file.name)))
+        else:
+            os.unlink(temporary_file.name)
+            db.session.info.setdefault(CREATED_BLOBS, []).append(destination)
+
+        blob = Blob.query.get(content_hash)
+        if blob is None:
+            try:
+                with db.session.begin_nested():
+                    blob = Blob(hash=content_hash, size=size, ref_count=0)
+                    db.session.add(blob)
+            except sqlalchemy.exc.IntegrityError:
+                # Another upload of the same contents recorded the blob first
+                blob = Blob.query.get(content_hash)
+        return blob
+
+    def store_bytes(self, data: bytes) -> Blob:
+        """Store contents that are already in memory"""
+        return self.store(io.BytesIO(data))
+
+    def materialize(self, blob: Blob, destination: Path) -> None:
+        """Make the contents of a blob available at `destination`, linking rather than copying if possible"""
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(self.blob_path(blob.hash), destination)
+
+    @staticmethod
+    def add_reference(blob: Blob) -> None:
+        """Record that another file has the contents of this blob"""
+        # Incremented in SQL so that concurrent uploads don't lose counts,
+        # and flushed so that another reference in this session adds to it
+        blob.ref_count = Blob.ref_count + 1
+        db.session.flush()
+
+    def release(self, blob: Blob) -> None:
+        """Record that a file with the contents of this blob was removed,
+        removing the blob once no files refer to it.
+        The blob file is removed when the session is committed."""
+        blob.ref_count = Blob.ref_count - 1
+        db.session.flush()
+        db.session.refresh(blob)
+        if blob.ref_count <= 0:
+            db.session.delete(blob)
+            db.session.info.setdefault(REMOVED_BLOBS, []).append(self.blob_path(blob.hash))
+
+
+def find_existing_file(content_hash: str, file_kind) -> Optional[Union[Audio, Transcription]]:
+    """The first Audio or Transcription, as given by `file_kind`, whose file has these contents"""
+    return (file_kind.query.join(file_kind.file_info)
+            .filter(FileMetaData.blob_hash == content_hash)
+            .order_by(file_kind.id).first())
+
+def unique_destination(directory: Path, filename: str) -> Path:
+    """A path in `directory` for `filename` that isn't in use, numbering the name if needed
+    the same way flask_uploads resolves conflicts"""
+    destination = directory / filename
+    stem, extension = os.path.splitext(filename)
+    count = 0
+    while destination.exists():
+        count += 1
+        destination = directory / "{}_{}{}".format(stem, count, extension)
+    return destination
+
+def link_named_file(store: BlobStore, blob: Blob, directory: Path, filename: str) -> Path:
+    """Make the contents of a blob available at a free path for `filename` in `directory`
+    and add the reference of that file to the blob. Returns the path of the file."""
+    while True:
+        destination = unique_destination(directory, filename)
+        try:
+            store.materialize(blob, destination)
+        except FileExistsError:
+            # Taken by a concurrent upload with the same name
+            continue
+        db.session.info.setdefault(CREATED_FILES, []).append(destination)
+        store.add_reference(blob)
+        return destination
+
+def remove_named_file(store: BlobStore, file_info: FileMetaData, directory: Path) -> None:
+    """Delete the row of an uploaded file in `directory`, releasing its blob.
+    The file is removed when the session is committed."""
+    db.session.info.setdefault(REMOVED_FILES, []).append(directory / file_info.name)
+    if file_info.blob is not None:
+        store.release(file_info.blob)
+    db.session.delete(file_info)
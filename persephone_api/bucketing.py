@@ -0,0 +1,62 @@
+"""Length bucketed batching of training utterances
+
+persephone's CorpusReader groups training utterances into batches of a fixed size
+in random order, so short and long clips end up in the same batch and most of
+each batch is padding. Batches made by `bucket_batches` only hold utterances of
+similar length, and their size is chosen so that the padded number of frames in
+each batch stays within a budget. Short utterances are batched in large numbers
+and long ones in small numbers, which keeps memory use bounded.
+"""
+from typing import List, Sequence
+
+import numpy as np
+from persephone.corpus_reader import CorpusReader
+
+# Strategies for batching training utterances
+FIXED = "fixed"
+BUCKETED = "bucketed"
+
+# Frames per batch used by the bucketed strategy if a model doesn't specify a budget
+DEFAULT_FRAMES_PER_BATCH = 20000
+
+
+def bucket_batches(lengths: Sequence[int], frames_per_batch: int) -> List[List[int]]:
+    """Group utterances into batches of similar length, returns the indices of the utterances in each batch.
+    The padded size of a batch, its number of utterances times its longest utterance,
+    is at most `frames_per_batch` unless a single utterance is longer than that."""
+    batches = [] # type: List[List[int]]
+    batch = [] # type: List[int]
+    for index in np.argsort(lengths, kind='mergesort'):
+        # Utterances are in order of length, so this one is the longest in the batch
+        if batch and (len(batch) + 1) * lengths[index] > frames_per_batch:
+            batches.append(batch)
+            batch = []
+        batch.append(int(index))
+    if batch:
+        batches.append(batch)
+    return batches
+
+def feature_frames(feature_path: str) -> int:
+    """Number of frames in a feature file, this only reads the file's header"""
+    return np.load(feature_path, mmap_mode='r').shape[0]
+
+
+class BucketedCorpusReader(CorpusReader):
+    """CorpusReader that makes training batches from utterances of similar length
+    within a budget of frames per batch"""
+
+    def __init__(self, corpus, frames_per_batch: int = DEFAULT_FRAMES_PER_BATCH, **kwargs) -> None:
+        # Every utterance is used, so a batch size of 1 satisfies CorpusReader's divisibility check
+        super().__init__(corpus, batch_size=1, **kwargs)
+        self.frames_per_batch = frames_per_batch
+
+    def make_batches(self, utterance_fns):
+        """Group utterances into length buckets, each entry is a tuple of feature and label paths"""
+        # A corpus manifest has the number of frames of every utterance, which
+        # saves reading the header of every feature file each epoch
+        frames = getattr(self.corpus, "feature_frames", feature_frames)
+        lengths = [frames(feature_path) for feature_path, _ in utterance_fns]
+        return [
+            [utterance_fns[index] for index in batch]
+            for batch in bucket_batches(lengths, self.frames_per_batch)
+        ]
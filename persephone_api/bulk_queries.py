@@ -0,0 +1,68 @@
+"""Bulk inserts and set based lookups
+
+Adding one ORM object per row makes the session flush every row separately,
+which takes minutes for the hundreds of thousands of rows of a large corpus.
+Rows are instead inserted with a single statement for the whole set, COPY on
+PostgreSQL and an executemany elsewhere such as SQLite. Likewise a large set
+of IDs is looked up with one query that passes all the IDs as a single array
+parameter, rather than one bound parameter per ID which SQLite limits.
+"""
+import csv
+import io
+import json
+from typing import Iterable, Sequence, Set
+
+import sqlalchemy
+
+
+def dialect_name(session) -> str:
+    """Name of the database dialect the session is bound to, such as "postgresql" or "sqlite" """
+    return session.get_bind().dialect.name
+
+def bulk_insert(session, table: sqlalchemy.Table, rows: Sequence[dict]) -> None:
+    """Insert rows, given as dictionaries of column values, into a table
+    as part of the current transaction of the session"""
+    if not rows:
+        return
+    columns = list(rows[0])
+    if dialect_name(session) == "postgresql":
+        preparer = session.get_bind().dialect.identifier_preparer
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+        data.seek(0)
+        # The DBAPI connection of the session, so the rows are copied in its transaction
+        cursor = session.connection().connection.cursor()
+        try:
+            cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                preparer.format_table(table),
+                ", ".join(preparer.quote(column) for column in columns)
+            ), data)
+        finally:
+            cursor.close()
+    else:
+        session.execute(table.insert(), rows)
+
+def missing_ids(session, column: sqlalchemy.Column, ids: Iterable[int]) -> Set[int]:
+    """The IDs that aren't values of `column`, looked up with one query however many IDs there are"""
+    wanted = sorted(set(ids))
+    if not wanted:
+        return set()
+    preparer = session.get_bind().dialect.identifier_preparer
+    existing = "SELECT 1 FROM {table} WHERE {table}.{column} = wanted.id".format(
+        table=preparer.format_table(column.table),
+        column=preparer.quote(column.name)
+    )
+    dialect = dialect_name(session)
+    if dialect == "postgresql":
+        query = "SELECT wanted.id FROM unnest(:ids) AS wanted(id) WHERE NOT EXISTS ({})".format(existing)
+        parameters = {"ids": wanted}
+    elif dialect == "sqlite":
+        query = ("SELECT wanted.id FROM (SELECT value AS id FROM json_each(:ids)) AS wanted "
+                 "WHERE NOT EXISTS ({})".format(existing))
+        parameters = {"ids": json.dumps(wanted)}
+    else:
+        found = session.query(column).filter(column.in_(wanted))
+        return set(wanted) - {row[0] for row in found}
+    return {row[0] for row in session.execute(sqlalchemy.text(query), parameters)}
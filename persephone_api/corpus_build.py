@@ -0,0 +1,144 @@
+"""Staged building of corpora
+
+Building a corpus takes far longer than a request should for a large corpus,
+so creating a corpus only records and validates it and a background job
+builds it. A build runs these stages in order:
+
+validate     check the data splits and uploaded files before touching the filesystem,
+             this is done by the request creating the corpus
+materialize  link the audio and label files of the utterances into the corpus
+features     extract the features of every utterance
+labels       find the labels used by the corpus, register them and write its manifest
+ready        mark the corpus ready for training
+
+The last completed stage is stored on the corpus, so a build that failed or
+was interrupted restarts from the stage after it rather than from the start.
+The job progress reports the stage being run and the stages so far, the job
+result lists every stage in order with its status, "completed" for stages
+run by the job along with the time they took and "skipped" for stages
+completed before the job started.
+"""
+import functools
+import logging
+from pathlib import Path
+import shutil
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .corpus_manifest import write_manifest
+from .db_models import CorpusLabelSet, DBcorpus, Label, get_or_create
+from .extensions import db
+from .feature_cache import FeatureCache
+
+logger = logging.getLogger(__name__)
+
+# The stages of a build in the order they are run
+STAGES = ("validate", "materialize", "features", "labels", "ready")
+
+
+def remaining_stages(build_stage: Optional[str]) -> Tuple[str, ...]:
+    """The stages still to run after the last completed stage, all of them if none has completed"""
+    if build_stage is None:
+        return STAGES
+    return STAGES[STAGES.index(build_stage) + 1:]
+
+def validate_stage(app, corpus: DBcorpus, corpus_path: Path, report: Callable) -> dict:
+    """Check that the data splits don't overlap and that every uploaded file exists"""
+    from .api_endpoints.corpus import validate_partitions
+    return validate_partitions(Path(app.config['UPLOADED_AUDIO_DEST']), Path(app.config['UPLOADED_TEXT_DEST']),
+                               corpus, corpus_path)
+
+def materialize_stage(app, corpus: DBcorpus, corpus_path: Path, report: Callable) -> dict:
+    """Lay out the files of the corpus, replacing any left by an interrupted build"""
+    from .api_endpoints.corpus import create_corpus_file_structure
+    if corpus_path.exists():
+        shutil.rmtree(str(corpus_path))
+    create_corpus_file_structure(Path(app.config['UPLOADED_AUDIO_DEST']), Path(app.config['UPLOADED_TEXT_DEST']),
+                                 corpus, corpus_path, max_workers=app.config['CORPUS_MATERIALIZE_WORKERS'])
+    return {}
+
+def features_stage(app, corpus: DBcorpus, corpus_path: Path, report: Callable) -> dict:
+    """Extract the features of the utterances in parallel, reusing any already extracted for
+    the same audio, so that persephone finds them and doesn't extract them again"""
+    from .jobs import get_executor
+    from .preprocessing import extract_corpus_features
+    summary = extract_corpus_features(
+        corpus_path,
+        corpus.featureType,
+        get_executor(app, "feature-extraction", app.config['FEATURE_EXTRACTION_WORKERS']),
+        feature_cache=FeatureCache.from_config(app.config),
+        progress=lambda completed, total: report(completed=completed, total=total)
+    )
+    corpus.preprocessed = True
+    return summary
+
+def labels_stage(app, corpus: DBcorpus, corpus_path: Path, report: Callable) -> dict:
+    """Create the persephone corpus, register the labels it found and write the manifest
+    models are created from"""
+    from persephone.corpus import Corpus
+
+    # Creating the corpus object has the side-effect of creating a directory located at the path
+    # given to `tgt_dir`
+    persephone_corpus = Corpus(
+        feat_type=corpus.featureType,
+        label_type=corpus.labelType,
+        tgt_dir=corpus_path,
+    )
+    write_manifest(persephone_corpus, corpus_path)
+    # Labels registered by an earlier attempt are replaced
+    CorpusLabelSet.query.filter_by(corpus_id=corpus.id).delete()
+    # Create database entries for any labels in the corpus that don't
+    # currently exist in the Label table
+    for l in persephone_corpus.labels:
+        current_label = get_or_create(db.session, Label, label=l)
+        db.session.add(current_label)
+
+        # Make CorpusLabelSet entry
+        db.session.add(
+            CorpusLabelSet(
+                corpus=corpus,
+                label=current_label
+            )
+        )
+    return {"labels": len(persephone_corpus.labels)}
+
+def ready_stage(app, corpus: DBcorpus, corpus_path: Path, report: Callable) -> dict:
+    """Nothing more to do, completing this stage marks the corpus ready"""
+    return {}
+
+STAGE_FUNCTIONS = {
+    "validate": validate_stage,
+    "materialize": materialize_stage,
+    "features": features_stage,
+    "labels": labels_stage,
+    "ready": ready_stage,
+} # type: Dict[str, Callable[..., dict]]
+
+
+def run_corpus_build(app, job_id: int, corpus_id: int) -> dict:
+    """Work of a corpus build job, runs the stages after the last completed one.
+
+    The stage is stored on the corpus as soon as it completes, so if a stage
+    fails the next build starts again from that stage.
+    Returns the ID of the corpus and the status of each stage in order.
+    """
+    from .jobs import record_progress
+
+    with app.app_context():
+        corpus = DBcorpus.query.get(corpus_id)
+        corpus_path = Path(app.config['CORPUS_PATH']) / corpus.filesystem_path
+        pending = remaining_stages(corpus.completed_build_stage)
+        stages = [
+            {"name": stage, "status": "skipped"}
+            for stage in STAGES if stage not in pending
+        ] # type: List[dict]
+        for stage in pending:
+            report = functools.partial(record_progress, job_id, stage=stage, stages=stages)
+            report()
+            start_time = time.time()
+            details = STAGE_FUNCTIONS[stage](app, corpus, corpus_path, report)
+            stages.append(dict(details, name=stage, status="completed", seconds=time.time() - start_time))
+            corpus.build_stage = stage
+            db.session.commit()
+            logger.info("Corpus %s completed build stage %s: %s", corpus_id, stage, stages[-1])
+        return {"corpusID": corpus_id, "stages": stages}
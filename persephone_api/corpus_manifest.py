@@ -0,0 +1,186 @@
+"""Compact manifests of built corpora
+
+persephone keeps everything about a corpus in a pickled Corpus object, which
+has to be unpickled whole each time a model is created, trained or evaluated.
+Instead the manifest written when a corpus is built holds just what a
+CorpusReader needs: the utterance prefixes of each data split, the number of
+feature frames of every utterance and the label set. Utterances are stored as
+a numpy structured array that is memory mapped, and only read from once a data
+split is used, with a small JSON header holding the labels and where each data
+split starts and ends in the array. `ManifestCorpus` reads a manifest and
+stands in for the persephone Corpus given to a CorpusReader.
+"""
+import json
+import logging
+from pathlib import Path
+import pickle
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Files of the manifest in the corpus directory
+MANIFEST_HEADER = "manifest.json"
+MANIFEST_UTTERANCES = "manifest.npy"
+
+# Version of the manifest format
+MANIFEST_VERSION = 1
+
+# Data splits in the order their utterances are stored
+PARTITIONS = ("train", "valid", "test", "untranscribed")
+
+
+def feature_shape(feature_path: Path) -> Tuple[int, ...]:
+    """Shape of the features in a feature file, this only reads the file's header"""
+    return np.load(str(feature_path), mmap_mode='r').shape
+
+def features_per_frame(shape: Sequence[int]) -> int:
+    """Number of features of each frame, the same way persephone counts them"""
+    if len(shape) == 3:
+        # Multiple channels of multiple features
+        return shape[1] * shape[2]
+    if len(shape) == 2:
+        return shape[1]
+    raise ValueError("Feature matrix of shape {} unexpected".format(shape))
+
+def write_manifest(corpus, corpus_path: Path) -> None:
+    """Write the manifest of a persephone Corpus to its directory
+
+    :corpus: The persephone Corpus, its data splits must already be made
+    :corpus_path: Directory of the corpus
+    """
+    prefixes = [] # type: List[str]
+    partitions = {} # type: Dict[str, List[int]]
+    for name in PARTITIONS:
+        partition_prefixes = list(getattr(corpus, name + "_prefixes"))
+        partitions[name] = [len(prefixes), len(prefixes) + len(partition_prefixes)]
+        prefixes.extend(partition_prefixes)
+
+    utterances = np.zeros(len(prefixes), dtype=[
+        ("prefix", "U{}".format(max([len(prefix) for prefix in prefixes], default=1))),
+        ("frames", np.int32),
+    ])
+    num_feats = None
+    for index, prefix in enumerate(prefixes):
+        shape = feature_shape(corpus_path / "feat" / "{}.{}.npy".format(prefix, corpus.feat_type))
+        utterances[index] = (prefix, shape[0])
+        if num_feats is None:
+            num_feats = features_per_frame(shape)
+
+    header = {
+        "version": MANIFEST_VERSION,
+        "featureType": corpus.feat_type,
+        "labelType": corpus.label_type,
+        "numberFeatures": num_feats,
+        "labels": sorted(corpus.labels),
+        "partitions": partitions,
+    }
+    # The header is written last, so a manifest with a header is complete
+    np.save(str(corpus_path / MANIFEST_UTTERANCES), utterances)
+    with (corpus_path / MANIFEST_HEADER).open('w') as header_file:
+        json.dump(header, header_file)
+    logger.info("Wrote manifest of %s utterances for corpus %s", len(prefixes), corpus_path)
+
+def load_manifest(corpus_path: Path) -> 'ManifestCorpus':
+    """Read the manifest of a corpus.
+    Corpora built before manifests existed have one written from their pickled Corpus the first time."""
+    if not (corpus_path / MANIFEST_HEADER).exists():
+        with (corpus_path / "corpus.p").open('rb') as pickle_file:
+            write_manifest(pickle.load(pickle_file), corpus_path)
+    return ManifestCorpus(corpus_path)
+
+
+class ManifestCorpus:
+    """The parts of a persephone Corpus used by a CorpusReader, read from a corpus manifest"""
+
+    def __init__(self, corpus_path: Path) -> None:
+        self.tgt_dir = Path(corpus_path)
+        self.feat_dir = self.tgt_dir / "feat"
+        self.label_dir = self.tgt_dir / "label"
+        with (self.tgt_dir / MANIFEST_HEADER).open() as header_file:
+            header = json.load(header_file)
+        if header["version"] != MANIFEST_VERSION:
+            raise ValueError("Unsupported corpus manifest version {}".format(header["version"]))
+        self.feat_type = header["featureType"]
+        self.label_type = header["labelType"]
+        self.num_feats = header["numberFeatures"]
+        self.labels = set(header["labels"])
+        self.vocab_size = len(self.labels)
+        # Index 0 is reserved for padding, as in persephone
+        self.INDEX_TO_LABEL = dict(enumerate(["pad"] + header["labels"]))
+        self.LABEL_TO_INDEX = {label: index for index, label in self.INDEX_TO_LABEL.items()}
+        self._partitions = header["partitions"]
+        self._utterances = None # type: np.ndarray
+        self._prefixes = {} # type: Dict[str, List[str]]
+        self._frames = None # type: Dict[str, int]
+
+    @property
+    def utterances(self) -> np.ndarray:
+        """Prefix and number of frames of every utterance, memory mapped on first use"""
+        if self._utterances is None:
+            self._utterances = np.load(str(self.tgt_dir / MANIFEST_UTTERANCES), mmap_mode='r')
+        return self._utterances
+
+    def partition_size(self, name: str) -> int:
+        """Number of utterances in a data split, without reading the utterances"""
+        start, stop = self._partitions[name]
+        return stop - start
+
+    def partition_prefixes(self, name: str) -> List[str]:
+        """Prefixes of the utterances in a data split, in the order persephone gave them"""
+        if name not in self._prefixes:
+            start, stop = self._partitions[name]
+            self._prefixes[name] = self.utterances["prefix"][start:stop].tolist()
+        return self._prefixes[name]
+
+    @property
+    def train_prefixes(self) -> List[str]:
+        return self.partition_prefixes("train")
+
+    @property
+    def valid_prefixes(self) -> List[str]:
+        return self.partition_prefixes("valid")
+
+    @property
+    def test_prefixes(self) -> List[str]:
+        return self.partition_prefixes("test")
+
+    @property
+    def untranscribed_prefixes(self) -> List[str]:
+        return self.partition_prefixes("untranscribed")
+
+    def feature_frames(self, feature_path: str) -> int:
+        """Number of frames in the feature file of an utterance of this corpus"""
+        if self._frames is None:
+            self._frames = {
+                str(self.feat_dir / "{}.{}.npy".format(prefix, self.feat_type)): int(frames)
+                for prefix, frames in zip(self.utterances["prefix"].tolist(), self.utterances["frames"].tolist())
+            }
+        return self._frames[str(feature_path)]
+
+    def prefixes_to_fns(self, prefixes: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """Paths of the feature files and label files of utterances"""
+        feat_fns = [str(self.feat_dir / "{}.{}.npy".format(prefix, self.feat_type)) for prefix in prefixes]
+        label_fns = [str(self.label_dir / "{}.{}".format(prefix, self.label_type)) for prefix in prefixes]
+        return feat_fns, label_fns
+
+    def get_train_fns(self) -> Tuple[List[str], List[str]]:
+        return self.prefixes_to_fns(self.train_prefixes)
+
+    def get_valid_fns(self) -> Tuple[List[str], List[str]]:
+        return self.prefixes_to_fns(self.valid_prefixes)
+
+    def get_test_fns(self) -> Tuple[List[str], List[str]]:
+        return self.prefixes_to_fns(self.test_prefixes)
+
+    def get_untranscribed_fns(self) -> List[str]:
+        return self.prefixes_to_fns(self.untranscribed_prefixes)[0]
+
+    def indices_to_labels(self, indices: Sequence[int]) -> List[str]:
+        """Convert a sequence of indices into their labels"""
+        return [self.INDEX_TO_LABEL[index] for index in indices]
+
+    def labels_to_indices(self, labels: Sequence[str]) -> List[int]:
+        """Convert a sequence of labels into their indices"""
+        return [self.LABEL_TO_INDEX[label] for label in labels]
@@ -1,4 +1,5 @@
 import datetime
+from typing import Optional
 
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
@@ -27,6 +28,21 @@ def get_or_create(session, model, **kwargs):
         session.add(instance)
     return instance
 
+class Blob(db.Model):
+    """Contents of uploaded files, stored once however many files have the same contents"""
+    __tablename__ = 'blob'
+
+    # SHA-256 of the contents
+    hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Number of files with these contents, the blob can be removed when this is 0
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return "<Blob(hash={}, size={}, ref_count={})>".format(self.hash, self.size, self.ref_count)
+
+
 class FileMetaData(db.Model):
     """Database ORM definition for file metadata"""
     __tablename__ = 'file_metadata'
@@ -34,6 +50,10 @@ class FileMetaData(db.Model):
     name = db.Column(db.String)
     path = db.Column(db.String)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    # Files uploaded before the blob store was introduced have no blob
+    blob_hash = db.Column(db.String(64), db.ForeignKey('blob.hash'), nullable=True, index=True)
+    blob = db.relationship('Blob')
     def __repr__(self):
         return "<FileMetaData(name={}, path={}, created_at={})>".format(
             self.name, self.path, self.created_at)
@@ -119,6 +139,11 @@ class DBcorpus(db.Model):
     #Flag to track if DBcorpus has been preprocessed and ready for use in ML models
     preprocessed = db.Column(db.Boolean, unique=False, default=False)
 
+    # The last stage of building this corpus that completed, see corpus_build.STAGES.
+    # None until the first stage completes, the corpus is ready for use once it is "ready".
+    # Use completed_build_stage, which accounts for corpora built before this was recorded.
+    build_stage = db.Column(db.String)
+
     # the type of the feature files in this corpus
     featureType = db.Column(db.String)
 
@@ -130,6 +155,14 @@ class DBcorpus(db.Model):
     # If an utterance is longer than this, it is not included in the corpus.
     max_samples = db.Column(db.Integer)
 
+    @property
+    def completed_build_stage(self) -> Optional[str]:
+        """The last build stage that completed. Corpora created before builds were
+        staged have no stage recorded, they were built in full when they were created."""
+        if self.build_stage is None and self.filesystem_path is not None:
+            return "ready"
+        return self.build_stage
+
     def __repr__(self):
         return '<DBcorpus(name="{}", labelType="{}", featureType="{}", max_samples="{}")>'.format(self.name, self.labelType, self.featureType, self.max_samples)
 
@@ -241,6 +274,19 @@ class TranscriptionModel(db.Model):
 
     filesystem_path = db.Column(db.String, nullable=False)
 
+    # How training utterances are grouped into batches, see bucketing.py
+    batching_strategy = db.Column(db.String, default="fixed", nullable=False)
+    # Maximum padded frames in a batch for the bucketed batching strategy
+    frames_per_batch = db.Column(db.Integer, nullable=True)
+
+    # The hyperparameter sweep this model was created by, if any
+    sweep_id = db.Column(
+        db.Integer,
+        db.ForeignKey('sweep.id'),
+        nullable=True
+    )
+    sweep = db.relationship('Sweep', backref='models')
+
     def __repr__(self):
         return ("<Model(name={}, corpus={}, min_epochs={}, max_epochs={}, "
                "max_valid_LER={}, max_train_LER={}, "
@@ -250,6 +296,30 @@ class TranscriptionModel(db.Model):
                     self.early_stopping_steps, self.beam_width, self.decoding_merge_repeated)
 
 
+class Sweep(db.Model):
+    """Represents a hyperparameter sweep, a set of models that differ in some parameters
+    and are trained to find the parameters that give the lowest validation label error rate"""
+    __tablename__ = 'sweep'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+
+    corpus_id = db.Column(
+        db.Integer,
+        db.ForeignKey('corpus.id'),
+        nullable=False
+    )
+    corpus = db.relationship(DBcorpus)
+
+    # JSON encoded description of the parameters explored by the sweep
+    spec = db.Column(db.UnicodeText, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return "<Sweep(name={}, corpus={})>".format(self.name, self.corpus)
+
+
 class Label(db.Model):
     """Represents a phonetic label"""
     __tablename__ = 'label'
@@ -280,4 +350,91 @@ class CorpusLabelSet(db.Model):
         db.ForeignKey('label.id'),
         nullable=False
     )
-    label = db.relationship(Label)
\ No newline at end of file
+    label = db.relationship(Label)
+
+
+class MemoizedTranscription(db.Model):
+    """Records the transcription a model produced for audio with a given content,
+    so that transcribing the same audio with the same checkpoint again reuses it"""
+    __tablename__ = 'memoized_transcription'
+    __table_args__ = (
+        db.UniqueConstraint('model_id', 'checkpoint_version', 'audio_hash'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    model_id = db.Column(
+        db.Integer,
+        db.ForeignKey('transcriptionmodel.id'),
+        nullable=False
+    )
+    model = db.relationship('TranscriptionModel')
+
+    # Version of the checkpoint that produced the transcription, see inference.checkpoint_version
+    checkpoint_version = db.Column(db.BigInteger, nullable=False)
+    # SHA-256 of the audio file contents
+    audio_hash = db.Column(db.String(64), nullable=False)
+
+    transcription_id = db.Column(
+        db.Integer,
+        db.ForeignKey('transcription.id'),
+        nullable=False
+    )
+    transcription = db.relationship('Transcription')
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return "<MemoizedTranscription(model={}, audio_hash={}, transcription={})>".format(
+            self.model_id, self.audio_hash, self.transcription_id)
+
+
+class Job(db.Model):
+    """Represents work that runs in the background, outside of the request that submitted it"""
+    __tablename__ = 'job'
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # What sort of work this job does, for example "transcription"
+    kind = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default=QUEUED)
+
+    # Queued jobs with a higher priority are started first
+    priority = db.Column(db.Integer, nullable=False, default=0)
+
+    # The model this job trains, if it is a training job
+    model_id = db.Column(
+        db.Integer,
+        db.ForeignKey('transcriptionmodel.id'),
+        nullable=True
+    )
+    model = db.relationship('TranscriptionModel')
+
+    # Host name of the node and ID of the process running this job
+    node = db.Column(db.String, nullable=True)
+    pid = db.Column(db.Integer, nullable=True)
+    # Comma separated IDs of the CPUs the process is pinned to
+    cpus = db.Column(db.String, nullable=True)
+
+    # JSON encoded parameters of the work, for example how a training job initializes the model
+    parameters = db.Column(db.UnicodeText, nullable=True)
+
+    # JSON encoded progress of a running job, for example how many items are done
+    progress = db.Column(db.UnicodeText, nullable=True)
+    # JSON encoded result of the job once it has succeeded
+    result = db.Column(db.UnicodeText, nullable=True)
+    # Description of the error if the job failed
+    error = db.Column(db.UnicodeText, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return "<Job(kind={}, status={}, created_at={})>".format(self.kind, self.status, self.created_at)
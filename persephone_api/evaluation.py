@@ -0,0 +1,101 @@
+"""Evaluation of trained transcription models on the test set of their corpus
+
+The test utterances are decoded in large batches with the model from the model
+cache and the label error rate is computed server side, so a model can be
+evaluated with one request instead of one transcription request per utterance.
+"""
+from pathlib import Path
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .corpus_manifest import load_manifest
+from .inference import ModelDescriptor, checkout_model, decode_features
+
+
+def edit_distances(hypotheses: Sequence[Sequence[str]], references: Sequence[Sequence[str]]) -> np.ndarray:
+    """Levenshtein distance between each hypothesis and its reference.
+
+    Every pair is computed at once, one row of the dynamic programming table at a time.
+    Within a row the dependency on the cell to the left is resolved with a cumulative
+    minimum, so each row is a handful of numpy operations over the whole batch.
+    """
+    if len(hypotheses) != len(references):
+        raise ValueError("Expected the same number of hypotheses and references")
+    num_pairs = len(references)
+    if num_pairs == 0:
+        return np.zeros(0, dtype=int)
+
+    vocabulary = {} # type: Dict[str, int]
+    def encode(sequences, padding):
+        lengths = np.array([len(sequence) for sequence in sequences])
+        encoded = np.full((num_pairs, max(lengths.max(), 1)), padding)
+        for i, sequence in enumerate(sequences):
+            encoded[i, :len(sequence)] = [vocabulary.setdefault(label, len(vocabulary)) for label in sequence]
+        return encoded, lengths
+
+    # Padding values differ so padding never matches
+    hyp, hyp_lengths = encode(hypotheses, -1)
+    ref, ref_lengths = encode(references, -2)
+
+    positions = np.arange(hyp.shape[1] + 1)
+    row = np.tile(positions, (num_pairs, 1))
+    distances = row[np.arange(num_pairs), hyp_lengths].copy()
+    for i in range(1, ref.shape[1] + 1):
+        substitution_cost = (hyp != ref[:, i - 1:i]).astype(int)
+        candidates = np.empty_like(row)
+        candidates[:, 0] = i
+        candidates[:, 1:] = np.minimum(row[:, 1:] + 1, row[:, :-1] + substitution_cost)
+        # row[j] = min(candidates[j], row[j - 1] + 1) == j + min over k <= j of (candidates[k] - k)
+        row = np.minimum.accumulate(candidates - positions, axis=1) + positions
+        finished = ref_lengths == i
+        distances[finished] = row[finished, hyp_lengths[finished]]
+    return distances
+
+
+def evaluate_model(descriptor: ModelDescriptor, corpus_path: Path, batch_size: int = 64) -> dict:
+    """Decode the test set of a model's corpus and report the label error rates.
+    This only takes picklable arguments so that it can be run in a worker process.
+
+    :descriptor: The trained model being evaluated
+    :corpus_path: Directory of the corpus that the model was trained on
+    :batch_size: Number of utterances decoded at once
+    """
+    corpus = load_manifest(corpus_path)
+    prefixes = list(corpus.test_prefixes)
+    feature_paths, label_paths = corpus.prefixes_to_fns(prefixes)
+    references = [] # type: List[List[str]]
+    for label_path in label_paths:
+        with open(label_path, encoding='utf-8') as label_file:
+            references.append(label_file.read().split())
+
+    start_time = time.time()
+    with checkout_model(descriptor) as loaded_model:
+        hypotheses = decode_features(loaded_model, feature_paths, descriptor.labels, batch_size=batch_size)
+    decode_seconds = time.time() - start_time
+
+    errors = edit_distances(hypotheses, references)
+    reference_lengths = np.array([len(reference) for reference in references])
+    utterances = []
+    for prefix, hypothesis, reference, error_count in zip(prefixes, hypotheses, references, errors):
+        utterances.append({
+            "prefix": prefix,
+            "hypothesis": " ".join(hypothesis),
+            "reference": " ".join(reference),
+            "errors": int(error_count),
+            "labelErrorRate": float(error_count) / len(reference) if reference else None,
+        })
+
+    total_labels = int(reference_lengths.sum())
+    total_errors = int(errors.sum())
+    return {
+        "modelID": descriptor.model_id,
+        "numberUtterances": len(prefixes),
+        "totalErrors": total_errors,
+        "totalLabels": total_labels,
+        "labelErrorRate": total_errors / total_labels if total_labels else None,
+        "decodeSeconds": decode_seconds,
+        "utterancesPerSecond": len(prefixes) / decode_seconds if decode_seconds > 0 else None,
+        "utterances": utterances,
+    }
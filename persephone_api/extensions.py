@@ -1,4 +1,9 @@
 """Each flask extension is initialized in the app factory located in app.py."""
 from flask_sqlalchemy import SQLAlchemy
 
+from .micro_batching import MicroBatcher
+from .model_cache import ModelCache
+
 db = SQLAlchemy()
+model_cache = ModelCache()
+micro_batcher = MicroBatcher()
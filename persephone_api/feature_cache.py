@@ -0,0 +1,187 @@
+"""Content addressed cache of extracted speech features
+
+Feature extraction is a large part of the time taken to transcribe short audio.
+Features are stored in the cache as `.npy` files keyed by a hash of the audio
+content, the feature type and the feature extraction parameters, so the same
+audio only has its features extracted once no matter how many models or times
+it is transcribed. The cache is bounded in size, the least recently used
+entries are removed first. Another request can evict an entry at any time, so
+entries are hard linked to where they are used, or pinned with hard links of
+their own while they are read, rather than used directly from the cache.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Parameters that persephone uses to extract each type of feature.
+# These are part of the cache key, so changing them makes existing entries unreachable.
+FEATURE_PARAMETERS = {
+    "fbank": {"filters": 40, "energy": True, "deltas": 2, "flat": True},
+    "fbank_and_pitch": {"filters": 40, "energy": True, "deltas": 2, "flat": True, "pitch": "kaldi"},
+    "mfcc13_d": {"coefficients": 13, "energy": True, "deltas": 1},
+    "pitch": {"pitch": "kaldi"},
+}
+
+# Size of the chunks read when hashing audio
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Times an entry is extracted again if it keeps being evicted before it can be linked
+LINK_ATTEMPTS = 3
+
+# Directory of the cache holding the hard links of pinned entries
+PINS_DIRECTORY = ".pinned"
+
+_hash_memo = {} # type: Dict[Tuple[str, int, int], str]
+_hash_memo_lock = threading.Lock()
+
+
+def audio_content_hash(audio_path: Path) -> str:
+    """SHA-256 of the contents of an audio file.
+    Hashes are remembered for as long as the file is unchanged."""
+    stat = audio_path.stat()
+    memo_key = (str(audio_path), stat.st_size, stat.st_mtime_ns)
+    with _hash_memo_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+    sha256 = hashlib.sha256()
+    with audio_path.open('rb') as audio_file:
+        for chunk in iter(lambda: audio_file.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    content_hash = sha256.hexdigest()
+    with _hash_memo_lock:
+        _hash_memo[memo_key] = content_hash
+    return content_hash
+
+def extract_features(audio_path: Path, feature_type: str, output_path: Path) -> None:
+    """Extract features from an audio file the same way a persephone Corpus does,
+    saving them to `output_path`"""
+    from persephone.preprocess import feat_extract
+
+    with tempfile.TemporaryDirectory(dir=str(output_path.parent)) as work_dir:
+        work_path = Path(work_dir)
+        # persephone expects 16kHz mono audio
+        feat_extract.convert_wav(audio_path, work_path / "audio.wav")
+        feat_extract.from_dir(work_path, feature_type)
+        os.replace(str(work_path / "audio.{}.npy".format(feature_type)), str(output_path))
+
+def hard_link(source: Path, destination: Path) -> None:
+    """Create a hard link to `source` at `destination`"""
+    os.link(str(source), str(destination))
+
+def load_feature_batch(feature_paths: Sequence[Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """Load features into a zero padded batch, returns the batch and the length of each utterance.
+    Feature files are memory mapped so they are only copied once, into the batch."""
+    features = [np.load(str(path), mmap_mode='r') for path in feature_paths]
+    lengths = np.array([feature.shape[0] for feature in features])
+    batch = np.zeros((len(features), lengths.max()) + features[0].shape[1:])
+    for i, feature in enumerate(features):
+        batch[i, :feature.shape[0]] = feature
+    return batch, lengths
+
+
+class FeatureCache:
+    """On disk cache of features stored at `path`, holding at most `max_bytes` of feature files.
+    This only stores paths and limits so that it can be passed to worker processes."""
+
+    def __init__(self, path: Path, max_bytes: int = None) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config) -> 'FeatureCache':
+        """Create the feature cache described by a flask app config"""
+        return cls(Path(config['FEATURE_CACHE_PATH']), config['FEATURE_CACHE_MAX_BYTES'])
+
+    def key(self, content_hash: str, feature_type: str) -> str:
+        """Cache key for features of audio with the given content hash"""
+        parameters = json.dumps(FEATURE_PARAMETERS.get(feature_type), sort_keys=True)
+        key_data = "{}:{}:{}".format(content_hash, feature_type, parameters)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        """Where the features for a key are stored"""
+        return self.path / key[:2] / "{}.npy".format(key)
+
+    def features_for(self, audio_path: Path, feature_type: str, *, evict: bool = True) -> Path:
+        """Path to the features of an audio file, extracting them if they aren't cached
+
+        :evict: Enforce the size limit after extracting, callers extracting many
+                files can pass False and call `evict` once they are done
+        """
+        entry = self.entry_path(self.key(audio_content_hash(audio_path), feature_type))
+        if entry.exists():
+            # The modification time records when an entry was last used
+            os.utime(str(entry))
+            return entry
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        extract_features(audio_path, feature_type, entry)
+        if evict:
+            self.evict()
+        return entry
+
+    def link_features(self, audio_path: Path, feature_type: str, destination: Path, *, evict: bool = True,
+                      link: Callable[[Path, Path], object] = hard_link) -> None:
+        """Link the features of an audio file to `destination`, extracting them if they aren't cached.
+        If the entry is evicted by another request before it is linked it is extracted again.
+
+        :link: Called with the entry and `destination` to link them, a hard link by default
+        """
+        for attempt in range(1, LINK_ATTEMPTS + 1):
+            entry = self.features_for(audio_path, feature_type, evict=evict)
+            try:
+                link(entry, destination)
+                return
+            except FileNotFoundError:
+                if attempt == LINK_ATTEMPTS:
+                    raise
+                logger.info("Feature cache entry %s was evicted before it was linked, extracting it again", entry)
+
+    @contextlib.contextmanager
+    def pinned_features(self, audio_paths: Sequence[Path], feature_type: str) -> Iterator[List[Path]]:
+        """Paths to the features of audio files that stay readable for the duration of a with block,
+        even if their entries are evicted. These are hard links that are removed afterwards."""
+        pins_path = self.path / PINS_DIRECTORY
+        pins_path.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=str(pins_path)) as pin_dir:
+            pinned = [] # type: List[Path]
+            for index, audio_path in enumerate(audio_paths):
+                pin = Path(pin_dir) / "{}.npy".format(index)
+                self.link_features(audio_path, feature_type, pin)
+                pinned.append(pin)
+            yield pinned
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache is within its size limit"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        total_size = 0
+        for entry in self.path.glob("*/*.npy"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+            total_size += stat.st_size
+        entries.sort()
+        # The newest entry is kept even if it alone is over the limit, it is about to be used
+        for _, size, entry in entries[:-1]:
+            if total_size <= self.max_bytes:
+                break
+            logger.info("Evicting %s from the feature cache", entry)
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
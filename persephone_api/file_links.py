@@ -0,0 +1,90 @@
+"""Materializing files into a corpus without duplicating their contents
+
+A corpus needs its own directory of audio and label files laid out the way
+persephone expects, but those files are already stored in the upload
+directories. Rather than copying them each file is reflinked, a copy-on-write
+clone that shares its blocks with the original, on filesystems that support
+it, and otherwise hardlinked. Files are only copied when neither is possible,
+such as when the corpus storage is on a different filesystem from the uploads.
+persephone only reads the files of a corpus, so sharing their contents with
+the uploads is safe.
+"""
+from collections import Counter
+import concurrent.futures
+import errno
+import fcntl
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+from typing import Dict, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Linux ioctl request to clone the contents of one file into another
+FICLONE = 0x40049409
+
+# How a file was materialized
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY = "copy"
+
+# Errors meaning that a filesystem can't reflink or hardlink between these paths
+_UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EMLINK}
+
+# Pairs of source and destination devices found not to support reflinks
+_no_reflink_devices = set() # type: Set[Tuple[int, int]]
+_no_reflink_devices_lock = threading.Lock()
+
+
+def reflink(source: Path, destination: Path) -> None:
+    """Clone the contents of `source` into a new file at `destination`"""
+    with source.open('rb') as source_file, destination.open('xb') as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            destination.unlink()
+            raise
+
+def copy(source: Path, destination: Path) -> None:
+    """Copy the contents of `source` into a new file at `destination`"""
+    with source.open('rb') as source_file, destination.open('xb') as destination_file:
+        try:
+            shutil.copyfileobj(source_file, destination_file)
+        except OSError:
+            destination.unlink()
+            raise
+
+def link_or_copy(source: Path, destination: Path) -> str:
+    """Materialize `source` at `destination`, by reflink, hardlink or copy in that order of preference.
+    Returns how the file was materialized. Raises FileExistsError if `destination` exists,
+    whichever way it would have been materialized."""
+    device = (source.stat().st_dev, destination.parent.stat().st_dev)
+    with _no_reflink_devices_lock:
+        try_reflink = device not in _no_reflink_devices
+    if try_reflink:
+        try:
+            reflink(source, destination)
+            return REFLINK
+        except OSError as error:
+            if error.errno not in _UNSUPPORTED_ERRORS:
+                raise
+            with _no_reflink_devices_lock:
+                _no_reflink_devices.add(device)
+    try:
+        os.link(str(source), str(destination))
+        return HARDLINK
+    except OSError as error:
+        if error.errno not in _UNSUPPORTED_ERRORS:
+            raise
+    copy(source, destination)
+    return COPY
+
+def materialize_files(files: Iterable[Tuple[Path, Path]], max_workers: int = 8) -> Dict[str, int]:
+    """Materialize many (source, destination) pairs of files in parallel.
+    Returns the number of files materialized each way."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        methods = dict(Counter(executor.map(lambda pair: link_or_copy(*pair), files)))
+    logger.info("Materialized files: %s", methods)
+    return methods
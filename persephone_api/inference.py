@@ -0,0 +1,179 @@
+"""Decoding audio with trained transcription models
+
+This wraps the restored TensorFlow session of a trained model so that it can be
+kept in the model cache and reused across requests, instead of restoring the
+checkpoint for every decode as `persephone.model.decode` does.
+Once a model is trained an inference only graph is exported from its checkpoint,
+with variables folded into constants and training operations removed. Models
+are loaded from that export when there is one, which is faster and uses less
+memory than restoring the full training graph and optimizer state.
+"""
+import contextlib
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from persephone import utils
+from persephone.model import dense_to_human_readable
+from persephone.preprocess import labels as persephone_labels
+
+from .extensions import model_cache
+from .feature_cache import FeatureCache, load_feature_batch
+from .session_config import SessionOptions, session_config, session_settings
+
+# Tensor names of the RNN CTC models created by persephone
+BATCH_X_NAME = "batch_x:0"
+BATCH_X_LENS_NAME = "batch_x_lens:0"
+OUTPUT_NAME = "hyp_dense_decoded:0"
+
+# Name of the exported inference graph, stored next to the checkpoint it was exported from
+FROZEN_GRAPH_FILENAME = "frozen_inference_graph.pb"
+
+# Everything needed to decode with a trained model, as resolved by the model registry.
+# This is picklable so that it can be passed to worker processes.
+ModelDescriptor = NamedTuple('ModelDescriptor', [
+    ('model_id', int),
+    ('checkpoint_path', Path),
+    ('version', int),
+    ('labels', Tuple[str, ...]),
+    ('feature_type', str),
+    ('batch_x_name', str),
+    ('batch_x_lens_name', str),
+    ('output_name', str),
+    ('frozen_graph_path', Optional[Path]),
+])
+
+
+def checkpoint_version(checkpoint_path: Path) -> int:
+    """Version identifier of a checkpoint, this changes whenever the checkpoint is re-saved"""
+    return os.stat(str(checkpoint_path) + ".index").st_mtime_ns
+
+def frozen_graph_path(checkpoint_path: Path) -> Path:
+    """Where the inference graph exported from a checkpoint is stored"""
+    return Path(checkpoint_path).parent / FROZEN_GRAPH_FILENAME
+
+def export_frozen_graph(checkpoint_path: Path, *, batch_x_name: str = BATCH_X_NAME,
+                        batch_x_lens_name: str = BATCH_X_LENS_NAME, output_name: str = OUTPUT_NAME) -> Path:
+    """Export an inference only graph from a checkpoint, returns the path it was saved to.
+    Variables are replaced by constants holding their values and training operations are removed."""
+    import tensorflow as tf
+
+    def node_name(tensor_name: str) -> str:
+        return tensor_name.split(":")[0]
+
+    graph = tf.Graph()
+    # This runs in the training process
+    config = session_config(session_settings.training)
+    with graph.as_default(), tf.Session(graph=graph, config=config) as session:
+        saver = tf.train.import_meta_graph(str(checkpoint_path) + ".meta", clear_devices=True)
+        saver.restore(session, str(checkpoint_path))
+        frozen_graph_def = tf.graph_util.convert_variables_to_constants(
+            session,
+            graph.as_graph_def(),
+            [node_name(output_name)]
+        )
+    frozen_graph_def = tf.graph_util.remove_training_nodes(
+        frozen_graph_def,
+        protected_nodes=[node_name(name) for name in (batch_x_name, batch_x_lens_name, output_name)]
+    )
+
+    export_path = frozen_graph_path(checkpoint_path)
+    temporary_path = export_path.with_name(export_path.name + ".tmp")
+    temporary_path.write_bytes(frozen_graph_def.SerializeToString())
+    os.replace(str(temporary_path), str(export_path))
+    return export_path
+
+def checkpoint_size(checkpoint_path: Path) -> int:
+    """Estimate the memory needed for a restored checkpoint from the size of its files on disk"""
+    checkpoint_path = Path(checkpoint_path)
+    return sum(
+        path.stat().st_size
+        for path in checkpoint_path.parent.glob(checkpoint_path.name + ".*")
+    )
+
+
+class LoadedModel:
+    """A trained model restored into its own TensorFlow graph and session.
+    If `frozen_graph_path` is given the exported inference graph is loaded
+    instead of restoring the checkpoint. The session uses the inference
+    session options unless others are given."""
+
+    def __init__(self, checkpoint_path: Path, *, batch_x_name: str = BATCH_X_NAME,
+                 batch_x_lens_name: str = BATCH_X_LENS_NAME, output_name: str = OUTPUT_NAME,
+                 frozen_graph_path: Path = None, session_options: SessionOptions = None) -> None:
+        import tensorflow as tf
+
+        config = session_config(session_options or session_settings.inference)
+
+        self.checkpoint_path = Path(checkpoint_path)
+        self.batch_x_name = batch_x_name
+        self.batch_x_lens_name = batch_x_lens_name
+        self.output_name = output_name
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            if frozen_graph_path is not None:
+                graph_def = tf.GraphDef()
+                graph_def.ParseFromString(Path(frozen_graph_path).read_bytes())
+                tf.import_graph_def(graph_def, name="")
+                self.session = tf.Session(graph=self.graph, config=config)
+                self.memory_size = Path(frozen_graph_path).stat().st_size
+            else:
+                saver = tf.train.import_meta_graph(str(self.checkpoint_path) + ".meta")
+                self.session = tf.Session(graph=self.graph, config=config)
+                saver.restore(self.session, str(self.checkpoint_path))
+                self.memory_size = checkpoint_size(self.checkpoint_path)
+
+    def run(self, batch_x, batch_x_lens):
+        """Run a batch of features through the network, returns the dense decoded output"""
+        feed_dict = {
+            self.batch_x_name: batch_x,
+            self.batch_x_lens_name: batch_x_lens,
+        }
+        return self.session.run(self.output_name, feed_dict=feed_dict)
+
+    def close(self) -> None:
+        """Release the TensorFlow session"""
+        self.session.close()
+
+
+def decode_features(loaded_model: LoadedModel, feature_paths: Sequence[Path],
+                    label_set: Iterable[str], batch_size: int = 64) -> List[List[str]]:
+    """Decode feature files with a loaded model, returns the labels decoded for each file"""
+    indices_to_labels = persephone_labels.make_indices_to_labels(set(label_set))
+    results = [] # type: List[List[str]]
+    for feature_batch in utils.make_batches(feature_paths, batch_size):
+        batch_x, batch_x_lens = load_feature_batch(feature_batch)
+        dense_decoded = loaded_model.run(batch_x, batch_x_lens)
+        results.extend(dense_to_human_readable(dense_decoded, indices_to_labels))
+    return results
+
+def model_loader(descriptor: ModelDescriptor) -> Callable[[], LoadedModel]:
+    """Function restoring the model of a descriptor from disk"""
+    return lambda: LoadedModel(
+        descriptor.checkpoint_path,
+        batch_x_name=descriptor.batch_x_name,
+        batch_x_lens_name=descriptor.batch_x_lens_name,
+        output_name=descriptor.output_name,
+        frozen_graph_path=descriptor.frozen_graph_path
+    )
+
+def load_cached_model(descriptor: ModelDescriptor) -> LoadedModel:
+    """Get the restored model for this checkpoint from this process's model cache,
+    restoring it from disk if it isn't cached. This is for loading models ahead of use,
+    decode with a model from `checkout_model` so that it isn't closed while in use."""
+    return model_cache.get(descriptor.model_id, descriptor.version, model_loader(descriptor))
+
+@contextlib.contextmanager
+def checkout_model(descriptor: ModelDescriptor) -> Iterator[LoadedModel]:
+    """Use the restored model for this checkpoint from this process's model cache for the
+    duration of a with block, restoring it from disk if it isn't cached"""
+    with model_cache.checkout(descriptor.model_id, descriptor.version, model_loader(descriptor)) as loaded_model:
+        yield loaded_model
+
+def decode_audio_file(descriptor: ModelDescriptor, audio_path: Path, feature_cache: FeatureCache) -> List[str]:
+    """Decode a single audio file, returns the decoded labels.
+    This only takes picklable arguments so that it can be run in a worker process."""
+    with feature_cache.pinned_features([audio_path], descriptor.feature_type) as feature_paths:
+        with checkout_model(descriptor) as loaded_model:
+            return decode_features(loaded_model, feature_paths, descriptor.labels)[0]
@@ -0,0 +1,187 @@
+"""Background jobs
+
+Slow work such as decoding audio is run in a pool of worker processes instead
+of inside the request that asked for it. The state of every job is kept in the
+`Job` table so that any of the API worker processes can report on it.
+Worker processes are spawned rather than forked, because the API workers hold
+TensorFlow sessions and TensorFlow doesn't survive a fork. A spawned process
+starts without the app, so it sets one up from the configuration of the app
+that started it.
+"""
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict
+
+from .db_models import Job
+from .extensions import db
+
+logger = logging.getLogger(__name__)
+
+_executors = {} # type: Dict[str, concurrent.futures.Executor]
+_executors_lock = threading.Lock()
+# App of this process if it is a worker of a SpawnedProcessPool
+_worker_app = None
+
+
+class EagerExecutor(concurrent.futures.Executor):
+    """Executor that runs the submitted work straight away in the calling thread.
+    This is used if RUN_JOBS_EAGERLY is set in the app config."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future() # type: concurrent.futures.Future
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as error: # pylint: disable=broad-except
+            future.set_exception(error)
+        return future
+
+
+class SpawnedProcessPool(concurrent.futures.Executor):
+    """Executor running the submitted work in a pool of spawned worker processes.
+    The ProcessPoolExecutor of Python 3.5 always forks, so this wraps a multiprocessing Pool."""
+
+    def __init__(self, max_workers: int, config: dict) -> None:
+        self._pool = spawn_context(config).Pool(
+            max_workers, initializer=init_worker_process, initargs=(config,))
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future() # type: concurrent.futures.Future
+        future.set_running_or_notify_cancel()
+        self._pool.apply_async(fn, args, kwargs,
+                               callback=future.set_result, error_callback=future.set_exception)
+        return future
+
+    def shutdown(self, wait=True):
+        self._pool.close()
+        if wait:
+            self._pool.join()
+
+
+def python_executable(config) -> str:
+    """The Python interpreter that spawned processes run. Under uwsgi `sys.executable` is the
+    uwsgi binary, so unless PYTHON_EXECUTABLE is configured the interpreter of the environment is used."""
+    if config.get('PYTHON_EXECUTABLE'):
+        return config['PYTHON_EXECUTABLE']
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    return os.path.join(sys.exec_prefix, "bin", "python3")
+
+def spawn_context(config):
+    """Multiprocessing context that spawns processes running the Python interpreter"""
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable(config))
+    return context
+
+def process_config(app) -> dict:
+    """Configuration of the app, passed to spawned processes to set up their own app"""
+    return dict(app.config)
+
+def worker_app(config: dict):
+    """Create the app of a spawned process from the configuration of the app that started it,
+    with the extensions that background work uses"""
+    import flask
+    from .extensions import model_cache
+    from .model_registry import model_registry
+    from .session_config import session_settings
+
+    app = flask.Flask(__name__)
+    app.config.update(config)
+    db.init_app(app)
+    model_cache.init_app(app)
+    model_registry.init_app(app)
+    session_settings.init_app(app)
+    return app
+
+def init_worker_process(config: dict) -> None:
+    """Set up a process of a worker pool, run when the process starts"""
+    global _worker_app # pylint: disable=global-statement
+    _worker_app = worker_app(config)
+
+def get_executor(app, name: str, max_workers: int, *, threads: bool = False) -> concurrent.futures.Executor:
+    """Get the pool of spawned processes with the given name, creating it on first use
+
+    :threads: Use a pool of threads in this process instead, for jobs that
+              coordinate work in other processes and report on it as it happens
+    """
+    if app.config.get('RUN_JOBS_EAGERLY'):
+        return EagerExecutor()
+    with _executors_lock:
+        if name not in _executors:
+            if threads:
+                _executors[name] = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+            else:
+                _executors[name] = SpawnedProcessPool(max_workers, process_config(app))
+        return _executors[name]
+
+def create_job(kind: str) -> Job:
+    """Create the DB entry that tracks a job"""
+    current_job = Job(kind=kind, status=Job.QUEUED)
+    db.session.add(current_job)
+    db.session.commit()
+    return current_job
+
+def record_started(job_id: int) -> None:
+    """Mark a queued job as running, must be called inside an app context"""
+    Job.query.filter_by(id=job_id, status=Job.QUEUED).update({
+        "status": Job.RUNNING,
+        "started_at": datetime.datetime.utcnow(),
+    })
+    db.session.commit()
+
+def run_job(app, job_id: int, fn: Callable, *args) -> Any:
+    """Record that a job has started then do its work, this runs wherever the executor runs the work
+
+    :app: The flask app, None in the worker processes of a SpawnedProcessPool
+          which use the app they were set up with
+    """
+    with (app or _worker_app).app_context():
+        record_started(job_id)
+    return fn(*args)
+
+def record_progress(job_id: int, **progress) -> None:
+    """Record the progress of a running job, must be called inside an app context"""
+    Job.query.filter_by(id=job_id).update({
+        "status": Job.RUNNING,
+        "progress": json.dumps(progress),
+    })
+    db.session.commit()
+
+def submit_job(app, job_id: int, executor: concurrent.futures.Executor,
+               fn: Callable, *args, on_success: Callable[[Any], dict]) -> concurrent.futures.Future:
+    """Run `fn(*args)` on the executor, recording on the job when it starts and its outcome.
+
+    :app: The flask app, this is needed to access the DB when the work completes
+    :job_id: ID of the job as returned by `create_job`
+    :executor: Where to run the work, `fn` and `args` must be picklable for process pools
+    :on_success: Called inside an app context with the value returned by `fn`,
+                 this stores the outcome and returns the JSON serializable job result.
+    """
+    def record_outcome(future):
+        """Update the job once the work has finished"""
+        with app.app_context():
+            try:
+                result = on_success(future.result())
+            except Exception as error: # pylint: disable=broad-except
+                logger.exception("Job %s failed", job_id)
+                db.session.rollback()
+                finished_job = Job.query.get(job_id)
+                finished_job.status = Job.FAILED
+                finished_job.error = str(error)
+            else:
+                finished_job = Job.query.get(job_id)
+                finished_job.status = Job.SUCCEEDED
+                finished_job.result = json.dumps(result)
+            finished_job.finished_at = datetime.datetime.utcnow()
+            db.session.commit()
+
+    # The app can't be passed to other processes
+    run_in = None if isinstance(executor, SpawnedProcessPool) else app
+    future = executor.submit(run_job, run_in, job_id, fn, *args)
+    future.add_done_callback(record_outcome)
+    return future
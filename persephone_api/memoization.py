@@ -0,0 +1,87 @@
+"""Memoization of transcription results
+
+Decoding is deterministic for a given checkpoint, so the transcription a model
+produced for some audio is recorded against the model, the checkpoint version
+and a hash of the audio contents. Requests to transcribe the same audio again
+with the same checkpoint then return the existing transcription.
+Concurrent requests for the same transcription in a worker process are
+coalesced so that only one of them decodes the audio.
+"""
+import concurrent.futures
+import threading
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+import sqlalchemy
+
+from .db_models import MemoizedTranscription, Transcription
+from .extensions import db
+
+T = TypeVar('T')
+
+
+class Coalescer:
+    """Runs work once for concurrent callers asking for the same key"""
+
+    def __init__(self) -> None:
+        self._in_flight = {} # type: Dict[Hashable, concurrent.futures.Future]
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Call `fn` and return its result, unless a call for the same key is already running
+        in which case its result is returned once it finishes"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+
+def find_memoized_transcription(model_id: int, checkpoint_version: int,
+                                audio_hash: str) -> Optional[Transcription]:
+    """The transcription made by this checkpoint of a model from audio with this hash, if there is one"""
+    memoized = MemoizedTranscription.query.filter_by(
+        model_id=model_id,
+        checkpoint_version=checkpoint_version,
+        audio_hash=audio_hash,
+    ).first()
+    if memoized is None:
+        return None
+    return memoized.transcription
+
+def memoize_transcription(model_id: int, checkpoint_version: int, audio_hash: str,
+                          current_transcription: Transcription) -> Transcription:
+    """Record a transcription made by a model and commit it.
+
+    If another worker recorded a transcription for the same audio first, the
+    new transcription is discarded and the one that was recorded is returned.
+    """
+    db.session.add(MemoizedTranscription(
+        model_id=model_id,
+        checkpoint_version=checkpoint_version,
+        audio_hash=audio_hash,
+        transcription=current_transcription,
+    ))
+    try:
+        db.session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        existing = find_memoized_transcription(model_id, checkpoint_version, audio_hash)
+        if existing is None:
+            raise
+        return existing
+    return current_transcription
+
+
+# Coalesces concurrent requests for the same transcription in this process
+transcription_coalescer = Coalescer()
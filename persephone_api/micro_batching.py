@@ -0,0 +1,104 @@
+"""Micro-batching of concurrent transcription requests
+
+When many requests to transcribe single audio files with the same model arrive
+at about the same time, decoding them one at a time wastes most of the work a
+batched decode could share. With micro-batching enabled, the first request for a
+model waits for up to MICRO_BATCHING_WINDOW_MS for other requests for that model
+to join it, or until MICRO_BATCHING_MAX_BATCH_SIZE requests have joined, then
+decodes them all as one batch and hands each request its own result.
+This only batches requests handled by threads of the same worker process, so
+it needs API workers that handle requests on several threads, such as uwsgi
+workers with `threads` set. It is turned off in workers that only have one.
+"""
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def uwsgi_request_threads() -> Optional[int]:
+    """Number of threads that handle requests in each uwsgi worker, None if not running under uwsgi"""
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    return int(uwsgi.opt.get('threads', 1))
+
+
+class _Batch:
+    """Items waiting to be processed together"""
+
+    def __init__(self) -> None:
+        self.items = [] # type: List[Any]
+        self.results = None # type: List[Any]
+        self.error = None # type: BaseException
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent callers into batches"""
+
+    def __init__(self, window: float = 0.02, max_batch_size: int = 16) -> None:
+        """
+        :window: Seconds the first item of a batch waits for others to join it
+        :max_batch_size: Number of items at which a batch is processed without waiting
+        """
+        self.enabled = False
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = {} # type: Dict[Hashable, _Batch]
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Configure micro-batching from the app config"""
+        self.enabled = app.config.get('MICRO_BATCHING_ENABLED', False)
+        if self.enabled and uwsgi_request_threads() == 1:
+            # No other request could join a batch, every request would wait for nothing
+            logger.warning("Micro-batching is turned off because uwsgi workers handle one request at a time, "
+                           "set threads in the uwsgi configuration to use it")
+            self.enabled = False
+        self.window = app.config.get('MICRO_BATCHING_WINDOW_MS', 20) / 1000
+        self.max_batch_size = app.config.get('MICRO_BATCHING_MAX_BATCH_SIZE', 16)
+
+    def submit(self, key: Hashable, item: Any, process_batch: Callable[[List[Any]], List[Any]]) -> Any:
+        """Process an item together with any others submitted under the same key, returns its result.
+
+        :key: Only items with equal keys are batched together
+        :item: The item to process
+        :process_batch: Called with the items of a batch, returns a result for each item in order.
+                        The function given by the first caller of a batch is the one used.
+        """
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._pending[key] = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                # Later items start a new batch
+                del self._pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            try:
+                batch.results = process_batch(batch.items)
+            except BaseException as error:
+                batch.error = error
+                raise
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
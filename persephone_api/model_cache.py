@@ -0,0 +1,176 @@
+"""Per-process cache of restored inference models
+
+Restoring a TensorFlow graph and checkpoint takes seconds, so each worker process
+keeps restored models around between requests. Entries are keyed by the
+TranscriptionModel ID and the version of the checkpoint they were restored from,
+so a model that has been retrained is reloaded on its next use.
+Entries are evicted in least recently used order whenever the number of cached
+models or their estimated memory use goes over the configured limits.
+Requests decode with a model they have checked out, an entry that is evicted or
+replaced while checked out is only closed once its last user has released it.
+"""
+from collections import OrderedDict
+import contextlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCache:
+    """LRU cache of loaded models, keyed by model ID and checkpoint version.
+
+    Cached objects must expose a `memory_size` attribute (estimated size in bytes)
+    and a `close()` method that releases their resources on eviction.
+    """
+
+    def __init__(self, max_models: int = 4, memory_budget: Optional[int] = None) -> None:
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict() # type: OrderedDict
+        self._lock = threading.Lock()
+        self._loading_locks = {} # type: Dict[int, threading.Lock]
+        # Number of users of each checked out model, by the id() of the model
+        self._users = {} # type: Dict[int, int]
+        # id() of the checked out models that have been removed from the cache
+        self._retired = set() # type: Set[int]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app) -> None:
+        """Read the cache limits from the flask app configuration"""
+        self.max_models = app.config.get('MODEL_CACHE_MAX_MODELS', self.max_models)
+        self.memory_budget = app.config.get('MODEL_CACHE_MEMORY_BUDGET', self.memory_budget)
+
+    def get(self, model_id: int, version: Any, loader: Callable[[], Any]) -> Any:
+        """Return the cached model for `model_id` at checkpoint `version`,
+        calling `loader` to create it if it isn't already cached.
+        The model may be closed as soon as it is evicted, use `checkout` to decode with it.
+        """
+        return self._get(model_id, version, loader, check_out=False)
+
+    @contextlib.contextmanager
+    def checkout(self, model_id: int, version: Any, loader: Callable[[], Any]) -> Iterator[Any]:
+        """Use the cached model for `model_id` at checkpoint `version` for the duration of
+        a with block, as `get` does. The model isn't closed before the block ends."""
+        loaded = self._get(model_id, version, loader, check_out=True)
+        try:
+            yield loaded
+        finally:
+            self._release(loaded)
+
+    def _get(self, model_id: int, version: Any, loader: Callable[[], Any], check_out: bool) -> Any:
+        """Find or load the model, counting a user of it if `check_out` is true"""
+        with self._lock:
+            loaded = self._lookup(model_id, version)
+            if loaded is not None:
+                return self._count_user(loaded, check_out)
+            loading_lock = self._loading_locks.setdefault(model_id, threading.Lock())
+
+        # Restoring is slow so it happens outside of the cache lock, the per-model
+        # lock makes concurrent requests for the same model wait for a single load.
+        with loading_lock:
+            with self._lock:
+                loaded = self._lookup(model_id, version)
+                if loaded is not None:
+                    return self._count_user(loaded, check_out)
+                self.misses += 1
+            loaded = loader()
+            with self._lock:
+                self._discard(model_id)
+                self._entries[model_id] = (version, loaded)
+                self._count_user(loaded, check_out)
+                self._evict_over_limits()
+        return loaded
+
+    def invalidate(self, model_id: int) -> None:
+        """Drop any cached entry for this model"""
+        with self._lock:
+            self._discard(model_id)
+
+    def clear(self) -> None:
+        """Drop every cached entry"""
+        with self._lock:
+            for model_id in list(self._entries):
+                self._discard(model_id)
+
+    def memory_usage(self) -> int:
+        """Estimated memory in bytes used by all cached models"""
+        return sum(loaded.memory_size for _, loaded in self._entries.values())
+
+    def stats(self) -> dict:
+        """Counters and current occupancy of this cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "cachedModels": list(self._entries),
+                "memoryUsage": self.memory_usage(),
+                "maxModels": self.max_models,
+                "memoryBudget": self.memory_budget,
+            }
+
+    def _lookup(self, model_id: int, version: Any) -> Any:
+        """Find a current entry and mark it as most recently used.
+        Must be called with the cache lock held."""
+        entry = self._entries.get(model_id)
+        if entry is None:
+            return None
+        cached_version, loaded = entry
+        if cached_version != version:
+            # A newer checkpoint has been published since this was restored
+            self._discard(model_id)
+            return None
+        self._entries.move_to_end(model_id)
+        self.hits += 1
+        return loaded
+
+    def _count_user(self, loaded: Any, check_out: bool) -> Any:
+        """Count a user of a model that is being checked out.
+        Must be called with the cache lock held."""
+        if check_out:
+            self._users[id(loaded)] = self._users.get(id(loaded), 0) + 1
+        return loaded
+
+    def _release(self, loaded: Any) -> None:
+        """End a checkout of a model, closing it if it was removed from the cache while in use"""
+        with self._lock:
+            users = self._users.pop(id(loaded)) - 1
+            if users:
+                self._users[id(loaded)] = users
+                return
+            if id(loaded) not in self._retired:
+                return
+            self._retired.discard(id(loaded))
+        loaded.close()
+
+    def _discard(self, model_id: int) -> None:
+        """Remove an entry and release its resources, or leave that to the last
+        user of its model if it is checked out. Must be called with the cache lock held."""
+        entry = self._entries.pop(model_id, None)
+        if entry is not None:
+            _, loaded = entry
+            if id(loaded) in self._users:
+                self._retired.add(id(loaded))
+            else:
+                loaded.close()
+
+    def _evict_over_limits(self) -> None:
+        """Evict least recently used entries until the cache is within its limits.
+        The most recently added entry is always kept, even if it alone is over budget.
+        Must be called with the cache lock held."""
+        def over_limits():
+            if self.max_models is not None and len(self._entries) > self.max_models:
+                return True
+            if self.memory_budget is not None and self.memory_usage() > self.memory_budget:
+                return True
+            return False
+
+        while len(self._entries) > 1 and over_limits():
+            model_id = next(iter(self._entries))
+            logger.info("Evicting model %s from the model cache", model_id)
+            self._discard(model_id)
+            self.evictions += 1
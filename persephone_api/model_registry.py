@@ -0,0 +1,146 @@
+"""Registry of trained models shared by every API worker
+
+The source of truth for a trained model is its DB entry together with a metadata
+file that training publishes in the model directory. The metadata records the
+checkpoint to decode with, the label set and the names of the input and output
+tensors, so any worker on any node that can see the model storage can serve the
+model. Workers resolve models lazily and keep the resolved descriptions until
+the metadata file changes, at which point a newly published checkpoint is used.
+"""
+import datetime
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from .db_models import CorpusLabelSet, TranscriptionModel
+from .inference import (BATCH_X_LENS_NAME, BATCH_X_NAME, OUTPUT_NAME, ModelDescriptor,
+                        checkpoint_version, frozen_graph_path)
+
+METADATA_FILENAME = "model_metadata.json"
+
+# Where persephone saves the best checkpoint of the first training run,
+# used for models trained before metadata was published
+DEFAULT_CHECKPOINT = Path("0") / "model" / "model_best.ckpt"
+
+def metadata_path(model_path: Path) -> Path:
+    """Path to the metadata of the model stored at `model_path`"""
+    return model_path / METADATA_FILENAME
+
+def latest_checkpoint(model_path: Path) -> Optional[Path]:
+    """The most recently saved checkpoint of any training run of the model stored at `model_path`,
+    including runs that were interrupted before publishing"""
+    checkpoints = [
+        index_path.with_suffix("")
+        for index_path in model_path.glob("*/model/model_best.ckpt.index")
+    ]
+    if not checkpoints:
+        return None
+    return max(checkpoints, key=checkpoint_version)
+
+def publish_model(model_path: Path, current_model: TranscriptionModel, checkpoint_path: Path,
+                  labels: Iterable[str], frozen_graph_path: Path = None) -> None:
+    """Publish a trained checkpoint of a model so that workers start decoding with it.
+    The metadata is replaced atomically so readers never see a partly written file.
+
+    :frozen_graph_path: The inference graph exported from the checkpoint, if there is one
+    """
+    metadata = {
+        "modelID": current_model.id,
+        "checkpoint": str(Path(checkpoint_path).relative_to(model_path)),
+        "frozenGraph": str(Path(frozen_graph_path).relative_to(model_path)) if frozen_graph_path else None,
+        "labels": sorted(labels),
+        "featureType": current_model.corpus.featureType,
+        "tensorNames": {
+            "batchX": BATCH_X_NAME,
+            "batchXLens": BATCH_X_LENS_NAME,
+            "output": OUTPUT_NAME,
+        },
+        "publishedAt": datetime.datetime.utcnow().isoformat(),
+    }
+    temporary_path = model_path / (METADATA_FILENAME + ".tmp")
+    with temporary_path.open('w') as metadata_file:
+        json.dump(metadata, metadata_file)
+    os.replace(str(temporary_path), str(metadata_path(model_path)))
+
+
+class ModelRegistry:
+    """Resolves models to descriptors, caching them in this process until their metadata changes"""
+
+    def __init__(self) -> None:
+        self.app = None
+        self._descriptors = {} # type: Dict[int, Tuple[Tuple[int, int], ModelDescriptor]]
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Keep a reference to the app to find the model storage"""
+        self.app = app
+
+    def resolve(self, current_model: TranscriptionModel) -> Optional[ModelDescriptor]:
+        """Describe the published checkpoint of a model, None if the model hasn't been trained"""
+        model_path = Path(self.app.config['MODELS_PATH']) / current_model.filesystem_path
+        try:
+            stat = metadata_path(model_path).stat()
+        except FileNotFoundError:
+            return self._resolve_unpublished(current_model, model_path)
+        # Publishing replaces the file, so its inode changes even if the modification
+        # time doesn't on file systems with coarse timestamps
+        metadata_version = (stat.st_mtime_ns, stat.st_ino)
+
+        with self._lock:
+            cached = self._descriptors.get(current_model.id)
+        if cached is not None and cached[0] == metadata_version:
+            descriptor = cached[1]
+        else:
+            with metadata_path(model_path).open() as metadata_file:
+                metadata = json.load(metadata_file)
+            tensor_names = metadata["tensorNames"]
+            descriptor = ModelDescriptor(
+                model_id=current_model.id,
+                checkpoint_path=model_path / metadata["checkpoint"],
+                version=0,
+                labels=tuple(metadata["labels"]),
+                feature_type=metadata["featureType"],
+                batch_x_name=tensor_names["batchX"],
+                batch_x_lens_name=tensor_names["batchXLens"],
+                output_name=tensor_names["output"],
+                frozen_graph_path=model_path / metadata["frozenGraph"] if metadata.get("frozenGraph") else None,
+            )
+            with self._lock:
+                self._descriptors[current_model.id] = (metadata_version, descriptor)
+        return self._with_version(descriptor)
+
+    def _resolve_unpublished(self, current_model: TranscriptionModel,
+                             model_path: Path) -> Optional[ModelDescriptor]:
+        """Describe a model trained before metadata was published, from the DB and persephone's defaults"""
+        labels = CorpusLabelSet.query.filter_by(corpus_id=current_model.corpus_id).all()
+        descriptor = ModelDescriptor(
+            model_id=current_model.id,
+            checkpoint_path=model_path / DEFAULT_CHECKPOINT,
+            version=0,
+            labels=tuple(sorted(item.label.label for item in labels)),
+            feature_type=current_model.corpus.featureType,
+            batch_x_name=BATCH_X_NAME,
+            batch_x_lens_name=BATCH_X_LENS_NAME,
+            output_name=OUTPUT_NAME,
+            frozen_graph_path=frozen_graph_path(model_path / DEFAULT_CHECKPOINT),
+        )
+        return self._with_version(descriptor)
+
+    @staticmethod
+    def _with_version(descriptor: ModelDescriptor) -> Optional[ModelDescriptor]:
+        """Fill in the current version of the checkpoint, None if there is no checkpoint.
+        The exported inference graph is only used if it exists."""
+        try:
+            version = checkpoint_version(descriptor.checkpoint_path)
+        except FileNotFoundError:
+            return None
+        descriptor = descriptor._replace(version=version)
+        if descriptor.frozen_graph_path is not None and not descriptor.frozen_graph_path.exists():
+            descriptor = descriptor._replace(frozen_graph_path=None)
+        return descriptor
+
+
+# The registry of this process, initialized in the app factory
+model_registry = ModelRegistry()
@@ -0,0 +1,150 @@
+"""Parallel feature extraction for corpora
+
+Creating a persephone Corpus extracts the features of every utterance in a
+single process, which takes most of a day for a large corpus. Instead the
+features of each utterance are extracted separately across a pool of
+processes and written where persephone looks for them,
+`feat/<prefix>.<feature type>.npy` in the corpus directory, so that persephone
+finds them and skips its own extraction. The feature cache key of the audio
+that the features of each utterance were made from is recorded with the corpus,
+features whose key matches the current audio are up to date and aren't
+extracted again. Modification times aren't compared as linked features keep the
+modification time of the file they were linked from.
+Features are taken from the feature cache, which is keyed by the content of the
+audio, and linked into the corpus. Utterances that were already part of an
+earlier corpus, or were transcribed before, reuse those features and only new
+audio is extracted.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .feature_cache import FeatureCache, audio_content_hash
+from .file_links import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between progress reports
+PROGRESS_INTERVAL = 1.0
+
+
+def feature_path(corpus_path: Path, prefix: str, feature_type: str) -> Path:
+    """Where persephone expects the features of an utterance of a corpus"""
+    return corpus_path / "feat" / "{}.{}.npy".format(prefix, feature_type)
+
+def feature_sources_path(corpus_path: Path, feature_type: str) -> Path:
+    """Where the feature cache keys of the audio the features of a corpus were made from are recorded"""
+    return corpus_path / "feature_sources.{}.json".format(feature_type)
+
+def read_feature_sources(corpus_path: Path, feature_type: str) -> Dict[str, str]:
+    """The feature cache key of the audio that the features of each utterance were made from, by prefix"""
+    try:
+        with feature_sources_path(corpus_path, feature_type).open() as sources_file:
+            return json.load(sources_file)
+    except (FileNotFoundError, ValueError):
+        # Without a record every utterance is extracted again
+        return {}
+
+def write_feature_sources(corpus_path: Path, feature_type: str, sources: Dict[str, str]) -> None:
+    """Record the feature cache keys the features of a corpus were made from"""
+    sources_path = feature_sources_path(corpus_path, feature_type)
+    temporary_path = sources_path.with_name(sources_path.name + ".tmp")
+    with temporary_path.open('w') as sources_file:
+        json.dump(sources, sources_file, sort_keys=True)
+    os.replace(str(temporary_path), str(sources_path))
+
+def features_up_to_date(features_path: Path, source_key: Optional[str], current_key: str) -> bool:
+    """Check if features exist and were made from audio with the current feature cache key"""
+    return source_key == current_key and features_path.exists()
+
+def pending_extractions(corpus_path: Path, feature_type: str,
+                        feature_cache: FeatureCache) -> Tuple[List[Tuple[Path, Path]], int, Dict[str, str]]:
+    """The (audio, features) paths of utterances of a corpus whose features need extracting,
+    the number of utterances whose features are up to date and the feature cache key of
+    the audio of every utterance by prefix"""
+    sources = read_feature_sources(corpus_path, feature_type)
+    pending = []
+    up_to_date = 0
+    current_keys = {}
+    for wav_path in sorted((corpus_path / "wav").glob("*.wav")):
+        features_path = feature_path(corpus_path, wav_path.stem, feature_type)
+        current_keys[wav_path.stem] = feature_cache.key(audio_content_hash(wav_path), feature_type)
+        if features_up_to_date(features_path, sources.get(wav_path.stem), current_keys[wav_path.stem]):
+            up_to_date += 1
+        else:
+            pending.append((wav_path, features_path))
+    return pending, up_to_date, current_keys
+
+def link_utterance_features(feature_cache: FeatureCache, wav_path: Path, feature_type: str,
+                            features_path: Path) -> bool:
+    """Put the features of an utterance at `features_path`, from the feature cache if
+    they are cached and extracting them into the cache otherwise.
+    Returns True if cached features were reused."""
+    entry = feature_cache.entry_path(feature_cache.key(audio_content_hash(wav_path), feature_type))
+    reused = entry.exists()
+    # Linked beside the destination first, so stale features are replaced in one step
+    temporary_path = features_path.with_name(features_path.name + ".tmp")
+    if temporary_path.exists():
+        temporary_path.unlink()
+    feature_cache.link_features(wav_path, feature_type, temporary_path, evict=False, link=link_or_copy)
+    os.replace(str(temporary_path), str(features_path))
+    return reused
+
+def extract_corpus_features(corpus_path: Path, feature_type: str, executor: concurrent.futures.Executor,
+                            *, feature_cache: FeatureCache, progress: Callable[[int, int], None] = None) -> dict:
+    """Extract the features of every utterance of a corpus that isn't up to date.
+
+    :executor: Runs the extraction of each utterance, a process pool to extract in parallel
+    :feature_cache: Where features are reused from and extracted to
+    :progress: Called with the number of utterances completed and the total while extracting
+    Returns a summary of the number of utterances extracted, reused from the
+    feature cache and skipped as up to date, and the time taken.
+    """
+    start_time = time.time()
+    pending, up_to_date, current_keys = pending_extractions(corpus_path, feature_type, feature_cache)
+    total = len(pending) + up_to_date
+    (corpus_path / "feat").mkdir(exist_ok=True)
+
+    completed = up_to_date
+    reused = 0
+    last_report = 0.0
+    futures = [
+        executor.submit(link_utterance_features, feature_cache, wav_path, feature_type, features_path)
+        for wav_path, features_path in pending
+    ]
+    for future in concurrent.futures.as_completed(futures):
+        reused += future.result()
+        completed += 1
+        if progress is not None and time.time() - last_report >= PROGRESS_INTERVAL:
+            progress(completed, total)
+            last_report = time.time()
+    if progress is not None:
+        progress(completed, total)
+    write_feature_sources(corpus_path, feature_type, current_keys)
+    feature_cache.evict()
+
+    summary = {
+        "utterances": total,
+        "extracted": len(pending) - reused,
+        "reused": reused,
+        "skipped": up_to_date,
+        "seconds": time.time() - start_time,
+    }
+    logger.info("Extracted features of corpus %s: %s", corpus_path, summary)
+    return summary
+
+def preprocess_corpus(app, job_id: int, corpus_path: Path, feature_type: str) -> dict:
+    """Work of a preprocessing job, extracts the features of a corpus reporting progress on the job"""
+    from .jobs import get_executor, record_progress
+
+    def report(completed: int, total: int) -> None:
+        with app.app_context():
+            record_progress(job_id, completed=completed, total=total)
+
+    executor = get_executor(app, "feature-extraction", app.config['FEATURE_EXTRACTION_WORKERS'])
+    return extract_corpus_features(corpus_path, feature_type, executor,
+                                   feature_cache=FeatureCache.from_config(app.config), progress=report)
@@ -0,0 +1,120 @@
+"""Transcription of long recordings
+
+Persephone models are trained on utterance length clips, decoding an hour long
+recording in one go needs too much memory and time. Long recordings are split
+into segments at pauses found by a simple energy based silence detector, with a
+maximum segment length so that speech without pauses is still bounded. The audio
+is read a block at a time and segments are decoded a batch at a time, so memory
+use depends on the segment and batch sizes rather than the recording length.
+"""
+from pathlib import Path
+import tempfile
+from typing import Iterable, Iterator, List, Tuple
+import wave
+
+import numpy as np
+
+from .inference import LoadedModel, decode_features
+
+# persephone models are trained on 16kHz mono audio
+SAMPLE_RATE = 16000
+
+# Full scale amplitude of 16 bit samples, used as the reference for dBFS
+FULL_SCALE = 32768.0
+
+
+def frame_levels(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """Level in dBFS of each complete frame of `frame_length` samples"""
+    num_frames = len(samples) // frame_length
+    frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length).astype(np.float64)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(rms / FULL_SCALE)
+
+def find_segments(wav_path: Path, *, max_seconds: float = 10.0, min_silence_seconds: float = 0.3,
+                  silence_threshold_db: float = -40.0, frame_seconds: float = 0.01,
+                  block_seconds: float = 60.0) -> Iterator[Tuple[int, int]]:
+    """Find the segments of speech in a 16 bit mono wav file, yields the start and end sample of each.
+
+    :max_seconds: Segments are cut at this length even if there is no pause
+    :min_silence_seconds: Length of silence that ends a segment
+    :silence_threshold_db: Frames quieter than this level in dBFS are silent
+    :frame_seconds: Length of the frames that silence is detected on
+    :block_seconds: Length of audio read from the file at once
+    """
+    with wave.open(str(wav_path), 'rb') as wav_file:
+        if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1:
+            raise ValueError("Expected 16 bit mono audio in {}".format(wav_path))
+        rate = wav_file.getframerate()
+        frame_length = max(1, int(rate * frame_seconds))
+        max_frames = max(1, int(max_seconds / frame_seconds))
+        min_silence_frames = max(1, int(min_silence_seconds / frame_seconds))
+        block_length = max(1, int(block_seconds / frame_seconds)) * frame_length
+
+        segment_start = None
+        silence_run = 0
+        frame_index = 0
+        while True:
+            samples = np.frombuffer(wav_file.readframes(block_length), dtype='<i2')
+            if len(samples) == 0:
+                break
+            for level in frame_levels(samples, frame_length):
+                silent = level < silence_threshold_db
+                if segment_start is None:
+                    if not silent:
+                        segment_start = frame_index
+                        silence_run = 0
+                else:
+                    silence_run = silence_run + 1 if silent else 0
+                    if silence_run >= min_silence_frames:
+                        yield segment_start * frame_length, (frame_index - silence_run + 1) * frame_length
+                        segment_start = None
+                    elif frame_index + 1 - segment_start >= max_frames:
+                        # Cut at the start of the current pause if there is one
+                        yield segment_start * frame_length, (frame_index + 1 - silence_run) * frame_length
+                        segment_start = None
+                frame_index += 1
+        if segment_start is not None:
+            yield segment_start * frame_length, (frame_index - silence_run) * frame_length
+
+def write_segment(wav_path: Path, start: int, end: int, segment_path: Path) -> None:
+    """Copy the samples from `start` to `end` of a wav file into a new wav file"""
+    with wave.open(str(wav_path), 'rb') as source:
+        source.setpos(start)
+        data = source.readframes(end - start)
+        with wave.open(str(segment_path), 'wb') as target:
+            target.setparams(source.getparams())
+            target.writeframes(data)
+
+def decode_long_audio(loaded_model: LoadedModel, audio_path: Path, feature_type: str,
+                      label_set: Iterable[str], *, batch_size: int = 16, **segment_options) -> Iterator[dict]:
+    """Decode a recording of any length, yielding the start and end in seconds
+    and the decoded labels of each segment as soon as its batch has been decoded.
+
+    :segment_options: Passed to `find_segments`
+    """
+    from persephone.preprocess import feat_extract
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        converted_path = Path(work_dir) / "audio.wav"
+        feat_extract.convert_wav(audio_path, converted_path)
+
+        def decode_batch(batch: List[Tuple[int, int]]) -> Iterator[dict]:
+            with tempfile.TemporaryDirectory(dir=work_dir) as batch_dir:
+                batch_path = Path(batch_dir)
+                for i, (start, end) in enumerate(batch):
+                    write_segment(converted_path, start, end, batch_path / "{}.wav".format(i))
+                feat_extract.from_dir(batch_path, feature_type)
+                feature_paths = [batch_path / "{}.{}.npy".format(i, feature_type) for i in range(len(batch))]
+                results = decode_features(loaded_model, feature_paths, label_set, batch_size)
+            for (start, end), decoded in zip(batch, results):
+                yield {"start": start / SAMPLE_RATE, "end": end / SAMPLE_RATE, "labels": decoded}
+
+        batch = [] # type: List[Tuple[int, int]]
+        for segment in find_segments(converted_path, **segment_options):
+            batch.append(segment)
+            if len(batch) == batch_size:
+                yield from decode_batch(batch)
+                batch = []
+        if batch:
+            yield from decode_batch(batch)
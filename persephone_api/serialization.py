@@ -2,6 +2,8 @@
 Serialization for data defined in ORM/DB
 """
 
+import json
+
 from marshmallow_sqlalchemy import ModelSchema
 from marshmallow import fields
 
@@ -9,8 +11,10 @@ from . import db_models
 
 class FileInfoSchema(ModelSchema):
     """Serialization for file information"""
+    sha256 = fields.Str(attribute="blob_hash")
     class Meta:
         model = db_models.FileMetaData
+        exclude = ('blob', 'blob_hash')
 
 class AudioSchema(ModelSchema):
     file_info = fields.Nested("FileInfoSchema")
@@ -30,41 +34,108 @@ class UtteranceSchema(ModelSchema):
         model = db_models.DBUtterance
 
 class CorpusSchema(ModelSchema):
+    """Serialization for a corpus, the utterances in its data splits
+    are added separately so that they can be fetched for many corpora at once"""
+    buildStage = fields.Str(attribute="completed_build_stage")
     class Meta:
         model = db_models.DBcorpus
-        exclude= ('filesystem_path',)
+        exclude= ('filesystem_path', 'build_stage', 'training', 'testing', 'validation')
 
 class TranscriptionModelSchema(ModelSchema):
     """Serialization for a transcription model
     The mappings here map the API to the DB names
     """
+    batchingStrategy = fields.Str(attribute="batching_strategy")
     beamWidth = fields.Int(attribute="beam_width")
     corpusID = fields.Int(attribute="corpus_id")
     decodingMergeRepeated = fields.Boolean(attribute="decoding_merge_repeated")
     earlyStoppingSteps = fields.Int(attribute="early_stopping_steps")
+    framesPerBatch = fields.Int(attribute="frames_per_batch")
     hiddenSize = fields.Int(attribute="hidden_size")
     maximumEpochs = fields.Int(attribute="max_epochs")
     maximumTrainingLER = fields.Float(attribute="max_train_LER")
     maximumValidationLER = fields.Float(attribute="max_valid_LER")
     minimumEpochs = fields.Int(attribute="min_epochs")
     numberLayers = fields.Int(attribute="num_layers")
+    sweepID = fields.Int(attribute="sweep_id")
     class Meta:
         model = db_models.TranscriptionModel
         exclude = (
+            'batching_strategy',
             'beam_width',
             'corpus',
             'decoding_merge_repeated',
             'early_stopping_steps',
             'filesystem_path',
+            'frames_per_batch',
             'hidden_size',
             'max_epochs',
             'max_train_LER',
             'max_valid_LER',
             'min_epochs',
             'num_layers',
+            'sweep',
         )
 
 
+class SweepSchema(ModelSchema):
+    """Serialization for a hyperparameter sweep"""
+    URL = fields.Method("sweep_url")
+    corpusID = fields.Int(attribute="corpus_id")
+    createdAt = fields.DateTime(attribute="created_at")
+    spec = fields.Method("decode_spec")
+
+    def sweep_url(self, sweep):
+        """Path to check on the progress of this sweep, relative to the API base path"""
+        return "sweep/{}".format(sweep.id)
+
+    def decode_spec(self, sweep):
+        """The spec is stored as JSON in the DB"""
+        return json.loads(sweep.spec)
+
+    class Meta:
+        model = db_models.Sweep
+        exclude = ('corpus', 'created_at', 'models')
+
+
 class LabelSchema(ModelSchema):
     class Meta:
-        model = db_models.Label
\ No newline at end of file
+        model = db_models.Label
+
+
+class JobSchema(ModelSchema):
+    """Serialization for a background job"""
+    URL = fields.Method("job_url")
+    parameters = fields.Method("decode_parameters")
+    progress = fields.Method("decode_progress")
+    result = fields.Method("decode_result")
+    createdAt = fields.DateTime(attribute="created_at")
+    startedAt = fields.DateTime(attribute="started_at")
+    finishedAt = fields.DateTime(attribute="finished_at")
+    modelID = fields.Int(attribute="model_id")
+
+    def job_url(self, job):
+        """Path to check on the progress of this job, relative to the API base path"""
+        return "jobs/{}".format(job.id)
+
+    def decode_parameters(self, job):
+        """The parameters are stored as JSON in the DB"""
+        if job.parameters is None:
+            return None
+        return json.loads(job.parameters)
+
+    def decode_progress(self, job):
+        """The progress is stored as JSON in the DB"""
+        if job.progress is None:
+            return None
+        return json.loads(job.progress)
+
+    def decode_result(self, job):
+        """The result is stored as JSON in the DB"""
+        if job.result is None:
+            return None
+        return json.loads(job.result)
+
+    class Meta:
+        model = db_models.Job
+        exclude = ('created_at', 'started_at', 'finished_at', 'model', 'node', 'pid', 'cpus')
@@ -0,0 +1,102 @@
+"""Thread pools and CPU affinity of TensorFlow sessions
+
+By default every TensorFlow session sizes its thread pools to the number of
+cores, so several API workers and training processes on one node oversubscribe
+the CPUs. Inference sessions (used to transcribe) and training sessions are
+configured separately: each can have its intra-op and inter-op thread counts
+limited and its processes pinned to a set of CPUs. TensorFlow shares one set of
+thread pools between the sessions of a process, sized by the first session, so
+every session the API creates in a process must use the same configuration.
+"""
+import os
+from typing import List, NamedTuple, Optional, Sequence
+
+# How the sessions of one kind are configured, None leaves TensorFlow's default
+SessionOptions = NamedTuple('SessionOptions', [
+    ('intra_op_threads', Optional[int]),
+    ('inter_op_threads', Optional[int]),
+    ('cpus', Optional[List[int]]),
+])
+
+
+def parse_cpu_list(text: Optional[str]) -> Optional[List[int]]:
+    """Parse a CPU list such as "0-3,8" as used by taskset, None if it is empty"""
+    if not text:
+        return None
+    cpus = set()
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+def session_config(options: SessionOptions):
+    """TensorFlow session configuration with the thread counts of `options`"""
+    import tensorflow as tf
+
+    config = tf.ConfigProto()
+    configure_threads(config, options)
+    return config
+
+def configure_threads(config, options: SessionOptions) -> None:
+    """Set the thread counts of `options` on a TensorFlow ConfigProto"""
+    if options.intra_op_threads is not None:
+        config.intra_op_parallelism_threads = options.intra_op_threads
+    if options.inter_op_threads is not None:
+        config.inter_op_parallelism_threads = options.inter_op_threads
+
+def pin_to_cpus(cpus: Sequence[int]) -> None:
+    """Restrict this process, and processes it starts from now on, to the given CPUs"""
+    os.sched_setaffinity(0, cpus)
+
+
+class SessionSettings:
+    """Options for the inference and training sessions of this process"""
+
+    def __init__(self) -> None:
+        self.inference = SessionOptions(None, None, None)
+        self.training = SessionOptions(None, None, None)
+        self.available_cpus = sorted(os.sched_getaffinity(0))
+
+    def init_app(self, app) -> None:
+        """Read the session options from the flask app configuration"""
+        self.inference = SessionOptions(
+            app.config.get('INFERENCE_INTRA_OP_THREADS'),
+            app.config.get('INFERENCE_INTER_OP_THREADS'),
+            app.config.get('INFERENCE_CPUS'),
+        )
+        self.training = SessionOptions(
+            app.config.get('TRAINING_INTRA_OP_THREADS'),
+            app.config.get('TRAINING_INTER_OP_THREADS'),
+            app.config.get('TRAINING_CPUS'),
+        )
+
+    @property
+    def training_cpus(self) -> List[int]:
+        """CPUs shared between the trainings run on this node"""
+        return self.training.cpus or self.available_cpus
+
+    def pin_inference_process(self) -> None:
+        """Pin this process to the inference CPUs if they are configured.
+        This is done in every API worker, training processes pin themselves separately."""
+        if self.inference.cpus:
+            pin_to_cpus(self.inference.cpus)
+
+    def configure_training_process(self, cpus: Sequence[int] = None) -> None:
+        """Pin this training process and size the thread pools of the sessions persephone trains with.
+
+        :cpus: CPUs of the slot this training was given by the scheduler, if any.
+               Without configured thread counts the pools are sized to the CPUs used.
+        """
+        import persephone.model
+
+        cpus = list(cpus) if cpus else self.training_cpus
+        pin_to_cpus(cpus)
+        options = self.training._replace(
+            intra_op_threads=self.training.intra_op_threads or len(cpus),
+            inter_op_threads=self.training.inter_op_threads or min(2, len(cpus)),
+        )
+        configure_threads(persephone.model.allow_growth_config, options)
+
+
+# The session settings of this process, initialized in the app factory
+session_settings = SessionSettings()
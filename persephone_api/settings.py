@@ -1,6 +1,14 @@
 """Application configuration."""
 import os
 
+from .session_config import parse_cpu_list
+
+
+def optional_int(name):
+    """Integer value of an environment variable, None if it isn't set"""
+    value = os.environ.get(name)
+    return int(value) if value else None
+
 
 class Config:
     """Base configuration."""
@@ -13,6 +21,84 @@ class Config:
     # Enable Cross-Origin Resource Sharing headers
     ENABLE_CORS = True
 
+    # Restored transcription models are cached in each worker process.
+    # Least recently used models are evicted when either of these limits is exceeded.
+    MODEL_CACHE_MAX_MODELS = 4
+    # Estimated bytes of memory the cached models may use, None for no limit
+    MODEL_CACHE_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+
+    # Thread pool sizes of the TensorFlow sessions used to transcribe, None for TensorFlow's default
+    # of one thread per core. Every API worker process has its own pools.
+    INFERENCE_INTRA_OP_THREADS = optional_int('PERSEPHONE_INFERENCE_INTRA_OP_THREADS')
+    INFERENCE_INTER_OP_THREADS = optional_int('PERSEPHONE_INFERENCE_INTER_OP_THREADS')
+    # CPUs the API workers are pinned to as a list such as "0-3,8", None to use every CPU
+    INFERENCE_CPUS = parse_cpu_list(os.environ.get('PERSEPHONE_INFERENCE_CPUS'))
+    # Thread pool sizes of the TensorFlow sessions used to train, None to size them
+    # to the CPUs each training is pinned to
+    TRAINING_INTRA_OP_THREADS = optional_int('PERSEPHONE_TRAINING_INTRA_OP_THREADS')
+    TRAINING_INTER_OP_THREADS = optional_int('PERSEPHONE_TRAINING_INTER_OP_THREADS')
+    # CPUs shared out between the trainings on a node, None to use every CPU
+    TRAINING_CPUS = parse_cpu_list(os.environ.get('PERSEPHONE_TRAINING_CPUS'))
+
+    # Maximum bytes of extracted features kept in the feature cache, None for no limit
+    FEATURE_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+
+    # Number of audio files decoded together when transcribing many files at once
+    TRANSCRIPTION_BATCH_SIZE = 64
+
+    # Long recordings are split into segments at pauses before decoding,
+    # segments are cut at the maximum length if there is no pause.
+    LONG_AUDIO_MAX_SEGMENT_SECONDS = 10.0
+    LONG_AUDIO_MIN_SILENCE_SECONDS = 0.3
+    # Audio quieter than this level in dBFS is considered silent
+    LONG_AUDIO_SILENCE_THRESHOLD_DB = -40.0
+    # Number of segments decoded together
+    LONG_AUDIO_BATCH_SIZE = 16
+
+    # Concurrent requests to transcribe audio with the same model can be decoded as one batch.
+    # A request waits at most MICRO_BATCHING_WINDOW_MS for others to join its batch.
+    # Only requests handled by threads of the same worker process are batched together,
+    # so this is turned off in uwsgi workers without threads.
+    MICRO_BATCHING_ENABLED = False
+    MICRO_BATCHING_WINDOW_MS = 20
+    MICRO_BATCHING_MAX_BATCH_SIZE = 16
+
+    # IDs of the models restored by every worker before it reports as ready,
+    # set with a comma separated PERSEPHONE_WARMUP_MODEL_IDS environment variable
+    WARMUP_MODEL_IDS = [int(model_id) for model_id in os.environ.get('PERSEPHONE_WARMUP_MODEL_IDS', '').split(',') if model_id]
+
+    # Number of files linked or copied into a new corpus at the same time
+    CORPUS_MATERIALIZE_WORKERS = 8
+    # Number of corpora built at the same time
+    CORPUS_BUILD_WORKERS = 2
+    # Number of processes extracting the features of corpus utterances
+    FEATURE_EXTRACTION_WORKERS = os.cpu_count() or 1
+
+    # Python interpreter of the processes spawned for jobs and training, by default the
+    # interpreter of the environment the API runs in, since under uwsgi that isn't the running binary
+    PYTHON_EXECUTABLE = os.environ.get('PERSEPHONE_PYTHON_EXECUTABLE')
+    # Number of worker processes that run transcription jobs
+    TRANSCRIPTION_WORKERS = 2
+    # Maximum number of models trained at the same time on this node,
+    # set per node with the PERSEPHONE_TRAINING_MAX_CONCURRENT environment variable
+    TRAINING_MAX_CONCURRENT = int(os.environ.get('PERSEPHONE_TRAINING_MAX_CONCURRENT', 1))
+    # Seconds between checks of the training job queue
+    TRAINING_SCHEDULER_INTERVAL = 5
+    # Training event streams are closed after this many seconds so they don't hold an API
+    # worker for a whole training run, clients reconnect with the Last-Event-ID they saw
+    TRAINING_EVENTS_MAX_STREAM_SECONDS = 300
+
+    # Maximum number of models a hyperparameter sweep may create
+    SWEEP_MAX_RUNS = 100
+    # A sweep run is stopped if after SWEEP_GRACE_EPOCHS its best validation LER is more than
+    # SWEEP_LAGGING_FACTOR times the best that another run of the sweep reached by the same epoch
+    SWEEP_GRACE_EPOCHS = 3
+    SWEEP_LAGGING_FACTOR = 1.5
+
+    # Run background jobs immediately in the process that submitted them,
+    # this is only intended for testing
+    RUN_JOBS_EAGERLY = False
+
 
 class ProdConfig(Config):
     """Production configuration."""
@@ -40,3 +126,4 @@ class TestConfig(Config):
     TESTING = True
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    RUN_JOBS_EAGERLY = True
@@ -0,0 +1,88 @@
+"""Hyperparameter sweeps
+
+A sweep creates a model for every combination of a grid of parameter values, or
+for a number of random draws from the given values and ranges, and queues them
+all for training. Training of the runs is spread over the CPUs of the training
+nodes by the training scheduler. Runs are ranked by the lowest validation label
+error rate they reach, and a run whose validation label error rate falls too far
+behind the best run of the sweep at the same epoch is stopped early.
+"""
+import itertools
+import random
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from .training_progress import best_validation_ler
+
+# Model parameters that a sweep can vary, as named in the API
+SWEEP_PARAMETERS = (
+    "batchingStrategy",
+    "beamWidth",
+    "decodingMergeRepeated",
+    "earlyStoppingSteps",
+    "framesPerBatch",
+    "hiddenSize",
+    "maximumEpochs",
+    "maximumTrainingLER",
+    "maximumValidationLER",
+    "minimumEpochs",
+    "numberLayers",
+)
+
+
+def grid_runs(grid: Dict[str, Sequence]) -> List[dict]:
+    """Parameters of every combination of the values in a grid"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def random_runs(space: Dict[str, object], number_runs: int, seed: int = None) -> List[dict]:
+    """Parameters of random draws from a search space.
+    Each parameter is either a list of values to choose from or a range
+    given as {"minimum": ..., "maximum": ...}, ranges of integers give integers."""
+    rng = random.Random(seed)
+    runs = []
+    for _ in range(number_runs):
+        run = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values, dict):
+                low, high = values["minimum"], values["maximum"]
+                if isinstance(low, int) and isinstance(high, int):
+                    run[name] = rng.randint(low, high)
+                else:
+                    run[name] = rng.uniform(low, high)
+            else:
+                run[name] = rng.choice(values)
+        runs.append(run)
+    return runs
+
+
+class LaggingRunStopper:
+    """Decides at the end of each epoch if a sweep run has fallen behind the other runs.
+
+    A run is stopped once it has trained for `grace_epochs` if its best validation
+    label error rate is more than `factor` times the best that any other run of
+    the sweep had reached by the same epoch.
+    """
+
+    def __init__(self, other_model_paths: Sequence[Path], grace_epochs: int = 3, factor: float = 1.5) -> None:
+        self.other_model_paths = list(other_model_paths)
+        self.grace_epochs = grace_epochs
+        self.factor = factor
+        self.best = None # type: Optional[float]
+
+    def __call__(self, epoch: int, validation_ler: float) -> Optional[str]:
+        """Returns the reason to stop the run, or None if it should carry on"""
+        if self.best is None or validation_ler < self.best:
+            self.best = validation_ler
+        if epoch < self.grace_epochs:
+            return None
+        others = [best_validation_ler(path, up_to_epoch=epoch) for path in self.other_model_paths]
+        others = [ler for ler in others if ler is not None]
+        if not others:
+            return None
+        leader = min(others)
+        if self.best > leader * self.factor:
+            return "Validation LER {:.3f} after {} epochs is behind the best run of the sweep at {:.3f}".format(
+                self.best, epoch, leader)
+        return None
@@ -0,0 +1,159 @@
+"""Training of transcription models
+
+This is independent of the HTTP request handling so that training can be run
+by the training scheduler in its own process.
+"""
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+from persephone import experiment
+from persephone import rnn_ctc
+from persephone.corpus_reader import CorpusReader
+
+from .bucketing import BUCKETED, DEFAULT_FRAMES_PER_BATCH, BucketedCorpusReader
+from .corpus_manifest import load_manifest
+from .db_models import CorpusLabelSet, TranscriptionModel
+from .inference import export_frozen_graph
+from .model_registry import publish_model
+from .training_progress import EpochProgress, StopTraining, record_event
+
+logger = logging.getLogger(__name__)
+
+# Maximum epochs used if a model doesn't specify a maximum
+MAX_EPOCHS = 100
+
+
+def decide_batch_size(num_train: int) -> int:
+    """Determine size of batches for use in training"""
+    if num_train >= 512:
+        batch_size = 16
+    elif num_train < 128:
+        if num_train < 4:
+            batch_size = 1
+        else:
+            batch_size = 4
+    else:
+        batch_size = int(num_train / 32)
+
+    return batch_size
+
+def create_RNN_CTC_model(model_db: TranscriptionModel, corpus_storage_path: Path,
+                         models_storage_path: Path) -> rnn_ctc.Model:
+    """Create a persephone RNN CTC model
+
+    :model: The database entry contaning the information about the model attempting
+            to be created here.
+    :corpus_storage_path: The path the corpuses are stored at.
+    :models_storage_path: The path the models are stored at.
+    """
+    model_path = models_storage_path / model_db.filesystem_path
+    exp_dir = experiment.prep_exp_dir(directory=str(model_path))
+    corpus_db_entry = model_db.corpus
+    corpus = load_manifest(corpus_storage_path / corpus_db_entry.filesystem_path)
+
+    if model_db.batching_strategy == BUCKETED:
+        corpus_reader = BucketedCorpusReader(
+            corpus,
+            frames_per_batch=model_db.frames_per_batch or DEFAULT_FRAMES_PER_BATCH
+        )
+    else:
+        corpus_reader = CorpusReader(corpus, batch_size=decide_batch_size(corpus.partition_size("train")))
+    return rnn_ctc.Model(
+        exp_dir,
+        corpus_reader,
+        num_layers=model_db.num_layers,
+        hidden_size=model_db.hidden_size,
+        beam_width=model_db.beam_width,
+        decoding_merge_repeated=model_db.decoding_merge_repeated
+        )
+
+def train_model(current_model: TranscriptionModel, corpus_storage_path: Path,
+                models_storage_path: Path, *, restore_checkpoint: Path = None,
+                completed_epochs: int = 0,
+                stop_check: Callable[[int, float], Optional[str]] = None) -> None:
+    """Train a model as specified by its DB entry, this can take hours.
+
+    :current_model: The database entry of the model to be trained
+    :corpus_storage_path: The path the corpuses are stored at.
+    :models_storage_path: The path the models are stored at.
+    :restore_checkpoint: Checkpoint to initialize the network and optimizer state from
+                         instead of initializing randomly. This is a checkpoint of this
+                         model when resuming, or of a compatible model when warm starting.
+    :completed_epochs: Epochs of this model already trained when resuming, these count
+                       towards the maximum epochs.
+    :stop_check: Called with the epoch number and validation LER at the end of each
+                 epoch, returns a reason to stop training early or None to carry on.
+                 The best checkpoint so far is published when training is stopped.
+    """
+    persephone_model = create_RNN_CTC_model(
+        current_model,
+        corpus_storage_path=corpus_storage_path,
+        models_storage_path=models_storage_path
+    )
+    model_path = models_storage_path / current_model.filesystem_path
+
+    if current_model.max_epochs:
+        epochs = current_model.max_epochs
+    else:
+        epochs = MAX_EPOCHS
+    remaining_epochs = max(epochs - completed_epochs, 1)
+
+    # we construct the parameters here so that the call to the model training
+    # respects the default value for arguments as found in the Persephone library
+    parameters = {
+        "min_epochs": max(current_model.min_epochs - completed_epochs, 0),
+        "max_epochs": remaining_epochs,
+    }
+    if current_model.early_stopping_steps is not None:
+        parameters["early_stopping_steps"] = current_model.early_stopping_steps
+    if current_model.max_valid_LER is not None:
+        parameters["max_valid_ler"] = current_model.max_valid_LER
+    if current_model.max_train_LER is not None:
+        parameters["max_train_ler"] = current_model.max_train_LER
+
+    num_train = persephone_model.corpus_reader.num_train
+    epoch_progress = EpochProgress(model_path, num_train, epoch_offset=completed_epochs)
+    if stop_check is None:
+        parameters["epoch_callback"] = epoch_progress
+    else:
+        def epoch_callback(epoch_info: dict) -> None:
+            epoch_progress(epoch_info)
+            reason = stop_check(epoch_info["epoch"] + completed_epochs, float(epoch_info["valid_ler"]))
+            if reason is not None:
+                raise StopTraining(reason)
+        parameters["epoch_callback"] = epoch_callback
+    if restore_checkpoint is not None:
+        parameters["restore_model_path"] = str(restore_checkpoint)
+
+    record_event(model_path, "started", numberTraining=num_train, maximumEpochs=epochs,
+                 completedEpochs=completed_epochs)
+    checkpoint_path = Path(persephone_model.exp_dir) / "model" / "model_best.ckpt"
+    try:
+        persephone_model.train(**parameters)
+    except StopTraining as stop:
+        record_event(model_path, "stopped", reason=str(stop))
+        if not Path(str(checkpoint_path) + ".index").exists():
+            record_event(model_path, "finished")
+            return
+    except Exception as error:
+        record_event(model_path, "failed", error=str(error))
+        raise
+
+    try:
+        frozen_graph_path = export_frozen_graph(checkpoint_path)
+    except Exception: # pylint: disable=broad-except
+        # The checkpoint can still be used for decoding
+        logger.exception("Exporting the inference graph of model %s failed", current_model.id)
+        frozen_graph_path = None
+
+    # Workers switch to the new checkpoint once it is published
+    labels = CorpusLabelSet.query.filter_by(corpus_id=current_model.corpus_id).all()
+    publish_model(
+        model_path,
+        current_model,
+        checkpoint_path,
+        [item.label.label for item in labels],
+        frozen_graph_path
+    )
+    record_event(model_path, "finished")
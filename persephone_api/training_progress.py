@@ -0,0 +1,171 @@
+"""Progress reporting for model training
+
+Training runs in its own process, so progress is written as JSON lines to an
+events file in the model directory. Any API worker can then follow that file and
+push the events to clients as Server-Sent Events.
+"""
+import json
+import os
+from pathlib import Path
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+EVENTS_FILENAME = "training_events.jsonl"
+
+# Event that starts a training run
+START_EVENT = "started"
+
+# Events after which no more events will be written for a training run
+TERMINAL_EVENTS = ("finished", "failed", "cancelled")
+
+
+class StopTraining(Exception):
+    """Raised by an epoch callback to end training early, keeping the best checkpoint so far"""
+
+
+def events_path(model_path: Path) -> Path:
+    """Path to the training events file of the model stored at `model_path`"""
+    return model_path / EVENTS_FILENAME
+
+def record_event(model_path: Path, event: str, **data) -> None:
+    """Append an event to the training events of a model.
+    Events are only ever appended, so that the line number of an event identifies it
+    for clients following the events. A START_EVENT marks the start of each run."""
+    data["event"] = event
+    data["time"] = time.time()
+    with events_path(model_path).open('a') as events_file:
+        events_file.write(json.dumps(data) + "\n")
+
+def read_events(model_path: Path) -> Iterator[dict]:
+    """The completely written training events of a model, oldest first"""
+    path = events_path(model_path)
+    if not path.exists():
+        return
+    with path.open() as events_file:
+        for line in events_file:
+            if not line.endswith("\n"):
+                # Still being written
+                break
+            yield json.loads(line)
+
+def latest_run_start(model_path: Path) -> int:
+    """Number of events recorded before the start of the latest training run"""
+    start = 0
+    for line_number, data in enumerate(read_events(model_path)):
+        if data["event"] == START_EVENT:
+            start = line_number
+    return start
+
+def training_epochs(model_path: Path) -> Tuple[List[dict], int]:
+    """The epoch events the current weights of a model were trained over and the number of
+    epochs completed. A run started from scratch discards the epochs of earlier runs,
+    a resumed run keeps those up to the epoch it resumed from."""
+    epochs = [] # type: List[dict]
+    completed = 0
+    for data in read_events(model_path):
+        if data["event"] == START_EVENT:
+            completed = data.get("completedEpochs", 0)
+            epochs = [epoch for epoch in epochs if epoch["epoch"] <= completed]
+        elif data["event"] == "epoch":
+            epochs.append(data)
+            completed = data["epoch"]
+    return epochs, completed
+
+
+def last_completed_epoch(model_path: Path) -> int:
+    """Number of the last epoch the current weights of a model were trained to, 0 if there are none"""
+    return training_epochs(model_path)[1]
+
+
+def best_validation_ler(model_path: Path, up_to_epoch: int = None) -> Optional[float]:
+    """Lowest validation label error rate recorded over the training epochs of a model,
+    optionally only counting epochs up to `up_to_epoch`. None if no epochs have been recorded."""
+    rates = [
+        data["validationLER"] for data in training_epochs(model_path)[0]
+        if up_to_epoch is None or data["epoch"] <= up_to_epoch
+    ]
+    return min(rates) if rates else None
+
+
+class EpochProgress:
+    """Callback for persephone training that records an event at the end of each epoch
+
+    :epoch_offset: Epochs completed by earlier runs that this run resumes from,
+                   so that epoch numbers carry on from where those runs stopped.
+    """
+
+    def __init__(self, model_path: Path, num_train: int, epoch_offset: int = 0) -> None:
+        self.model_path = model_path
+        self.num_train = num_train
+        self.epoch_offset = epoch_offset
+        self.start_time = time.time()
+        self.epoch_start_time = self.start_time
+
+    def __call__(self, epoch_info: dict) -> None:
+        now = time.time()
+        epoch_seconds = now - self.epoch_start_time
+        self.epoch_start_time = now
+        record_event(
+            self.model_path,
+            "epoch",
+            epoch=epoch_info["epoch"] + self.epoch_offset,
+            trainingLER=float(epoch_info["training_ler"]),
+            validationLER=float(epoch_info["valid_ler"]),
+            utterancesPerSecond=self.num_train / epoch_seconds if epoch_seconds > 0 else None,
+            elapsedSeconds=now - self.start_time,
+        )
+
+
+def follow_events(model_path: Path, *, start_after: int = None, poll_interval: float = 1.0,
+                  heartbeat_interval: float = 15.0, max_seconds: float = None,
+                  is_training: Callable[[], bool] = None) -> Iterator[str]:
+    """Follow the training events of a model, yielding them formatted as Server-Sent Events.
+
+    The line number of each event is used as its SSE id, so a client reconnecting with
+    a Last-Event-ID can pass that as `start_after` to only receive newer events.
+    Without it the events are followed from the start of the latest training run.
+    This stops after an event that ends the training run, once `max_seconds` have passed,
+    or once all events are sent while `is_training` reports no training queued or running.
+    """
+    path = events_path(model_path)
+    if start_after is None:
+        start_after = latest_run_start(model_path)
+    line_number = 0
+    started = last_sent = time.time()
+    caught_up = False
+    events_file = None
+    try:
+        while True:
+            if events_file is None and path.exists():
+                events_file = path.open('rb')
+            line = events_file.readline() if events_file is not None else b""
+            if line.endswith(b"\n"):
+                line_number += 1
+                if line_number <= start_after:
+                    continue
+                data = json.loads(line.decode('utf-8'))
+                yield "id: {}\nevent: {}\ndata: {}\n\n".format(
+                    line_number, data["event"], json.dumps(data))
+                last_sent = time.time()
+                if data["event"] in TERMINAL_EVENTS:
+                    return
+                continue
+            if line:
+                # Partially written line, read it again once it is complete
+                events_file.seek(-len(line), os.SEEK_CUR)
+            if max_seconds is not None and time.time() - started >= max_seconds:
+                return
+            if is_training is not None and not is_training():
+                if caught_up:
+                    return
+                # Read once more for events written as the training ended
+                caught_up = True
+                continue
+            if time.time() - last_sent >= heartbeat_interval:
+                # Comment lines keep proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+                last_sent = time.time()
+            time.sleep(poll_interval)
+    finally:
+        if events_file is not None:
+            events_file.close()
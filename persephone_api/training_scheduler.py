@@ -0,0 +1,335 @@
+"""Scheduling of model training
+
+Training a model can take hours, so training requests are queued as jobs in the
+DB and run in separate processes by the scheduler. Every API worker process runs
+a scheduler thread, the schedulers on a node coordinate through the DB and a lock
+file so that no more than TRAINING_MAX_CONCURRENT trainings, and no more than
+the number of training CPUs, run on that node.
+Queued jobs are started highest priority first, then oldest first.
+Training processes are spawned rather than forked, the API workers hold
+TensorFlow sessions and TensorFlow doesn't survive a fork.
+The training CPUs of a node are divided into one slot per concurrent training,
+each training process is pinned to the CPUs of its slot and limits its TensorFlow
+threads to match, so concurrent trainings don't compete for the same cores.
+Because the queue lives in the DB, queued jobs survive a restart and jobs that
+were interrupted by a restart are queued again.
+"""
+import datetime
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import signal
+import socket
+import threading
+from typing import Dict, List, Sequence
+
+from .db_models import Job, TranscriptionModel
+from .extensions import db
+from .jobs import process_config, spawn_context, worker_app
+from .session_config import session_settings
+from .training_progress import last_completed_epoch, record_event
+
+logger = logging.getLogger(__name__)
+
+# How a training job initializes the network
+SCRATCH = "scratch"
+# Continue from the latest checkpoint of the model, with its optimizer state
+RESUME = "resume"
+# Start from the weights of another model trained on the same labels
+WARM_START = "warmStart"
+
+
+def process_exists(pid: int) -> bool:
+    """Check if a process with this ID is running on this node"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+def cpu_slots(cpus: Sequence[int], slot_count: int) -> List[List[int]]:
+    """Divide CPUs into `slot_count` slots of equal size, one for each concurrent training.
+    CPUs left over after an even division aren't used for training."""
+    cpus = sorted(cpus)
+    slot_size = max(1, len(cpus) // max(slot_count, 1))
+    return [cpus[start:start + slot_size] for start in range(0, slot_size * slot_count, slot_size)
+            if cpus[start:start + slot_size]]
+
+def training_arguments(app, current_job: Job) -> dict:
+    """Arguments to `train_model` that set up how the network of a training job is initialized,
+    and when a run of a sweep is stopped early"""
+    from .model_registry import latest_checkpoint, model_registry
+    from .sweeps import LaggingRunStopper
+
+    parameters = json.loads(current_job.parameters) if current_job.parameters else {}
+    arguments = {}
+    mode = parameters.get("mode", SCRATCH)
+    if mode == RESUME:
+        model_path = Path(app.config['MODELS_PATH']) / current_job.model.filesystem_path
+        checkpoint = latest_checkpoint(model_path)
+        if checkpoint is None:
+            raise ValueError("Model {} has no checkpoint to resume from".format(current_job.model_id))
+        arguments = {"restore_checkpoint": checkpoint, "completed_epochs": last_completed_epoch(model_path)}
+    elif mode == WARM_START:
+        source_model = TranscriptionModel.query.get(parameters["fromModelID"])
+        descriptor = model_registry.resolve(source_model) if source_model is not None else None
+        if descriptor is None:
+            raise ValueError("Model {} has no checkpoint to warm start from".format(parameters["fromModelID"]))
+        arguments = {"restore_checkpoint": descriptor.checkpoint_path}
+
+    if parameters.get("sweepID") is not None:
+        other_models = TranscriptionModel.query.filter(
+            TranscriptionModel.sweep_id == parameters["sweepID"],
+            TranscriptionModel.id != current_job.model_id
+        ).all()
+        arguments["stop_check"] = LaggingRunStopper(
+            [Path(app.config['MODELS_PATH']) / other_model.filesystem_path for other_model in other_models],
+            grace_epochs=app.config['SWEEP_GRACE_EPOCHS'],
+            factor=app.config['SWEEP_LAGGING_FACTOR']
+        )
+    return arguments
+
+def run_training_job(app, job_id: int, *, in_subprocess: bool = True) -> None:
+    """Train the model for a job and record the outcome on the job.
+
+    :app: The flask app
+    :job_id: ID of the training job
+    :in_subprocess: True if this is running in a process created by the scheduler
+    """
+    # Imported here so that the scheduler can run without TensorFlow being loaded
+    from .training import train_model
+
+    with app.app_context():
+        current_job = Job.query.get(job_id)
+        try:
+            if in_subprocess:
+                session_settings.configure_training_process(
+                    [int(cpu) for cpu in current_job.cpus.split(",")] if current_job.cpus else None)
+            train_model(
+                current_job.model,
+                corpus_storage_path=Path(app.config['CORPUS_PATH']),
+                models_storage_path=Path(app.config['MODELS_PATH']),
+                **training_arguments(app, current_job)
+            )
+        except Exception as error: # pylint: disable=broad-except
+            logger.exception("Training job %s failed", job_id)
+            db.session.rollback()
+            current_job = Job.query.get(job_id)
+            current_job.status = Job.FAILED
+            current_job.error = str(error)
+        else:
+            current_job.status = Job.SUCCEEDED
+            current_job.result = json.dumps({"modelID": current_job.model_id})
+        current_job.finished_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+def run_training_process(config: dict, job_id: int) -> None:
+    """Entry point of a spawned training process, sets up the app from the configuration
+    of the app that started it and trains the model of the job"""
+    run_training_job(worker_app(config), job_id)
+
+
+class TrainingScheduler:
+    """Starts queued training jobs on this node while respecting the concurrency limit"""
+
+    def __init__(self) -> None:
+        self.app = None
+        self.node = socket.gethostname()
+        self._running = {} # type: Dict[int, multiprocessing.Process]
+        self._thread = None # type: threading.Thread
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Keep a reference to the app, the scheduler thread is started by `start`"""
+        self.app = app
+
+    @property
+    def max_concurrent(self) -> int:
+        """Number of trainings run at once on this node, at most one per training CPU
+        so that every training has a slot of CPUs to itself"""
+        return min(self.app.config['TRAINING_MAX_CONCURRENT'], len(session_settings.training_cpus))
+
+    def start(self) -> None:
+        """Start the scheduler thread in this process if it isn't already running.
+        This must be called after any forking of worker processes."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._running = {}
+            with self.app.app_context():
+                self.recover_interrupted_jobs()
+            self._thread = threading.Thread(target=self._run, name="training-scheduler", daemon=True)
+            self._thread.start()
+
+    def submit(self, current_model: TranscriptionModel, priority: int = 0, parameters: dict = None) -> Job:
+        """Queue a job to train a model, returns the job
+
+        :parameters: How the network is initialized, "mode" is one of SCRATCH, RESUME
+                     or WARM_START. A warm start also needs the "fromModelID" to start from.
+        """
+        current_job = Job(
+            kind="training",
+            status=Job.QUEUED,
+            priority=priority,
+            model=current_model,
+            parameters=json.dumps(parameters) if parameters else None
+        )
+        db.session.add(current_job)
+        db.session.commit()
+        if self.app.config.get('RUN_JOBS_EAGERLY'):
+            current_job.status = Job.RUNNING
+            current_job.started_at = datetime.datetime.utcnow()
+            db.session.commit()
+            run_training_job(self.app, current_job.id, in_subprocess=False)
+        else:
+            self.start()
+            self._wakeup.set()
+        return current_job
+
+    def cancel(self, current_job: Job) -> None:
+        """Cancel a queued job, or stop a running one"""
+        if current_job.status == Job.RUNNING and current_job.node == self.node and current_job.pid:
+            try:
+                os.kill(current_job.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        elif current_job.status == Job.RUNNING:
+            logger.warning("Job %s is running on node %s and can only be stopped from there",
+                           current_job.id, current_job.node)
+        if current_job.status == Job.RUNNING:
+            self._record_model_event(current_job, "cancelled")
+        current_job.status = Job.CANCELLED
+        current_job.finished_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+    def recover_interrupted_jobs(self) -> None:
+        """Queue again any jobs recorded as running on this node whose process no longer exists"""
+        with self._node_lock():
+            interrupted = Job.query.filter_by(kind="training", status=Job.RUNNING, node=self.node).all()
+            for current_job in interrupted:
+                if current_job.pid is None or not process_exists(current_job.pid):
+                    logger.info("Requeueing interrupted training job %s", current_job.id)
+                    current_job.status = Job.QUEUED
+                    current_job.pid = None
+                    current_job.node = None
+                    current_job.cpus = None
+                    current_job.started_at = None
+            db.session.commit()
+
+    def schedule(self) -> None:
+        """Reap finished training processes and start queued jobs if there is capacity"""
+        self._reap_finished()
+        with self._node_lock():
+            running_count = Job.query.filter_by(kind="training", status=Job.RUNNING, node=self.node).count()
+            free_slots = self.max_concurrent - running_count
+            if free_slots <= 0:
+                return
+            queued = (Job.query.filter_by(kind="training", status=Job.QUEUED)
+                      .order_by(Job.priority.desc(), Job.created_at, Job.id)
+                      .limit(free_slots).all())
+            for current_job in queued:
+                self._launch(current_job)
+
+    def _free_cpus(self) -> List[int]:
+        """CPUs of a slot that no running training on this node is pinned to,
+        must be called with the node lock held"""
+        running = Job.query.filter_by(kind="training", status=Job.RUNNING, node=self.node).all()
+        used = {int(cpu) for running_job in running if running_job.cpus for cpu in running_job.cpus.split(",")}
+        for slot in cpu_slots(session_settings.training_cpus, self.max_concurrent):
+            if used.isdisjoint(slot):
+                return slot
+        return []
+
+    def _launch(self, current_job: Job) -> None:
+        """Start the process for a job, must be called with the node lock held"""
+        cpus = self._free_cpus()
+        if not cpus:
+            # Left queued until a running training frees its slot
+            return
+        claimed = Job.query.filter_by(id=current_job.id, status=Job.QUEUED).update({
+            "status": Job.RUNNING,
+            "node": self.node,
+            "started_at": datetime.datetime.utcnow(),
+            "cpus": ",".join(str(cpu) for cpu in cpus),
+        })
+        db.session.commit()
+        if not claimed:
+            # Another node got to this job first
+            return
+        process = spawn_context(self.app.config).Process(
+            target=run_training_process,
+            args=(process_config(self.app), current_job.id),
+            name="training-job-{}".format(current_job.id)
+        )
+        process.start()
+        self._running[current_job.id] = process
+        Job.query.filter_by(id=current_job.id).update({"pid": process.pid})
+        db.session.commit()
+        logger.info("Started training job %s in process %s", current_job.id, process.pid)
+
+    def _reap_finished(self) -> None:
+        """Clean up finished processes, failing any job whose process died without recording an outcome"""
+        for job_id, process in list(self._running.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del self._running[job_id]
+            finished_job = Job.query.get(job_id)
+            if finished_job.status == Job.RUNNING:
+                error = "Training process exited with code {}".format(process.exitcode)
+                # Recorded before the job ends, event streams stop once no job is running
+                self._record_model_event(finished_job, "failed", error=error)
+                finished_job.status = Job.FAILED
+                finished_job.error = error
+                finished_job.finished_at = datetime.datetime.utcnow()
+                db.session.commit()
+
+    def _record_model_event(self, current_job: Job, event: str, **data) -> None:
+        """Record the end of a training run that the training process couldn't record itself"""
+        model_path = Path(self.app.config['MODELS_PATH']) / current_job.model.filesystem_path
+        if model_path.is_dir():
+            record_event(model_path, event, **data)
+
+    def _node_lock(self):
+        """File lock shared by the schedulers of every worker process on this node"""
+        lock_path = Path(self.app.config['MODELS_PATH']) / ".training-scheduler-{}.lock".format(self.node)
+        return _FileLock(lock_path)
+
+    def _run(self) -> None:
+        """Main loop of the scheduler thread"""
+        while True:
+            try:
+                with self.app.app_context():
+                    self.schedule()
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Error while scheduling training jobs")
+            self._wakeup.wait(self.app.config['TRAINING_SCHEDULER_INTERVAL'])
+            self._wakeup.clear()
+
+
+class _FileLock:
+    """Exclusive lock on a file, held for the duration of a with block"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = self.path.open('a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+# The scheduler of this process, initialized in the app factory
+training_scheduler = TrainingScheduler()
@@ -20,6 +20,9 @@ def configure_uploads(flask_app, base_upload_path=None) -> None:
     flask_app.config['UPLOADED_AUDIO_DEST'] = os.path.join(flask_app.config['BASE_UPLOAD_DIRECTORY'], 'audio_uploads')
     flask_app.config['UPLOADED_TEXT_DEST'] = os.path.join(flask_app.config['BASE_UPLOAD_DIRECTORY'], 'text_uploads')
     flask_app.config['UPLOADED_COMPRESSED_DEST'] = os.path.join(flask_app.config['BASE_UPLOAD_DIRECTORY'], 'compressed_uploads')
+    # Uploaded contents are stored once here and linked into the directories above,
+    # keeping them on the same filesystem lets them be hardlinked rather than copied
+    flask_app.config['BLOB_STORE_PATH'] = os.path.join(flask_app.config['BASE_UPLOAD_DIRECTORY'], 'blobs')
     flask_app.config['UPLOADED_FILES_URL'] = uploads_url_base
     flask_uploads.configure_uploads(
         flask_app,
@@ -0,0 +1,120 @@
+"""Warming up worker processes before they serve requests
+
+Importing TensorFlow and restoring a model's graph and checkpoint take seconds,
+so without warming up the first requests a fresh worker serves are slow.
+`preload` runs in the uwsgi master before workers are forked: it imports
+TensorFlow and persephone and reads the checkpoints of the configured models
+into the page cache, so every worker shares those pages copy-on-write.
+TensorFlow sessions don't survive a fork, so `start` then restores the
+configured models into the model cache of each worker after it is forked.
+The readiness endpoint reports when a worker has finished warming up.
+"""
+import logging
+from pathlib import Path
+import threading
+import time
+from typing import Dict, List
+
+from .db_models import TranscriptionModel
+from .extensions import db
+from .inference import ModelDescriptor, load_cached_model
+from .model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read when loading checkpoint files into the page cache
+READ_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def read_into_page_cache(checkpoint_path: Path) -> int:
+    """Read every file of a checkpoint so the OS keeps it in memory, returns the bytes read"""
+    total = 0
+    for path in checkpoint_path.parent.glob(checkpoint_path.name + ".*"):
+        with path.open('rb') as checkpoint_file:
+            for chunk in iter(lambda: checkpoint_file.read(READ_CHUNK_SIZE), b""):
+                total += len(chunk)
+    return total
+
+
+class Warmup:
+    """Tracks the warmup of this process"""
+
+    PENDING = "pending"
+    WARMING = "warming"
+    READY = "ready"
+
+    def __init__(self) -> None:
+        self.app = None
+        self.state = self.PENDING
+        self.models = {} # type: Dict[int, str]
+        self.seconds = None # type: float
+        self._descriptors = [] # type: List[ModelDescriptor]
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Keep a reference to the app, warmup is started by `preload` and `start`"""
+        self.app = app
+        if not app.config.get('WARMUP_MODEL_IDS'):
+            # Nothing to warm up, requests can be served straight away
+            self.state = self.READY
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def status(self) -> dict:
+        """Warmup status of this process"""
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "models": {str(model_id): state for model_id, state in self.models.items()},
+            "seconds": self.seconds,
+        }
+
+    def preload(self) -> None:
+        """Import TensorFlow and read the checkpoints of the configured models.
+        This is meant to run once in the master process before workers are forked."""
+        import tensorflow # pylint: disable=unused-variable
+
+        model_ids = self.app.config.get('WARMUP_MODEL_IDS') or []
+        with self.app.app_context():
+            for model_id in model_ids:
+                current_model = TranscriptionModel.query.get(model_id)
+                descriptor = model_registry.resolve(current_model) if current_model is not None else None
+                if descriptor is None:
+                    logger.warning("Not warming up model %s, it doesn't exist or hasn't been trained", model_id)
+                    self.models[model_id] = "unavailable"
+                    continue
+                size = read_into_page_cache(descriptor.checkpoint_path)
+                logger.info("Preloaded %s bytes of checkpoint for model %s", size, model_id)
+                self._descriptors.append(descriptor)
+                self.models[model_id] = "preloaded"
+            # Connections must not be shared with forked workers
+            db.engine.dispose()
+
+    def start(self) -> None:
+        """Restore the preloaded models in this process in a background thread.
+        This must be called after any forking of worker processes."""
+        with self._lock:
+            if self.state != self.PENDING:
+                return
+            self.state = self.WARMING
+        threading.Thread(target=self._warm_models, name="warmup", daemon=True).start()
+
+    def _warm_models(self) -> None:
+        """Restore each preloaded model into the model cache"""
+        start_time = time.time()
+        for descriptor in self._descriptors:
+            try:
+                load_cached_model(descriptor)
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Warming up model %s failed", descriptor.model_id)
+                self.models[descriptor.model_id] = "failed"
+            else:
+                self.models[descriptor.model_id] = "loaded"
+        self.seconds = time.time() - start_time
+        self.state = self.READY
+
+
+# The warmup of this process, initialized in the app factory
+warmup = Warmup()
@@ -31,6 +31,8 @@ def client(tmpdir):
     app.config['CORPUS_PATH'] = str(corpus_path)
     models_path = tmpdir.mkdir('models')
     app.config['MODELS_PATH'] = str(models_path)
+    feature_cache_path = tmpdir.mkdir('feature_cache')
+    app.config['FEATURE_CACHE_PATH'] = str(feature_cache_path)
     from persephone_api.upload_config import configure_uploads
     configure_uploads(app, base_upload_path=str(uploads_path))
     with app.test_client() as c:
@@ -228,7 +230,7 @@ def create_corpus(init_database, client, upload_audio, upload_transcription, cre
             headers={'Content-Type': 'application/json'}
         )
 
-        assert response.status_code == 201
+        assert response.status_code == 202
         response_data = json.loads(response.data.decode('utf8'))
         return response_data['id']
     return _create_corpus
\ No newline at end of file
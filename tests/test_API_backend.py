@@ -24,3 +24,14 @@ def test_accepted_filetypes(client):
     assert "audio" in accepted_files_response_data
     assert "transcription" in accepted_files_response_data
     assert "wav" in accepted_files_response_data["audio"]
+
+def test_readiness(client):
+    """Test that a backend with no models to warm up reports as ready"""
+    import json
+
+    response = client.get('/v0.1/backend/ready')
+    assert response.status_code == 200
+
+    readiness_data = json.loads(response.data.decode('utf8'))
+    assert readiness_data["ready"]
+    assert readiness_data["state"] == "ready"
@@ -0,0 +1,134 @@
+"""Tests for deduplicated storage of uploads"""
+import io
+import json
+
+
+def upload_audio_file(client, contents: bytes, filename: str, reuse_existing: bool=False):
+    """Upload audio contents with the given filename"""
+    return client.post(
+        '/v0.1/audio?reuseExisting={}'.format(str(reuse_existing).lower()),
+        data={'audioFile': (io.BytesIO(contents), filename)},
+        content_type='multipart/form-data'
+    )
+
+
+def test_duplicate_audio_stored_once(init_database, client):
+    """Test that uploading the same audio twice creates two audio files with one blob"""
+    from persephone_api.db_models import Blob
+    contents = b'RIFF....WAVE' + bytes(range(256))
+
+    first = upload_audio_file(client, contents, 'first.wav')
+    second = upload_audio_file(client, contents, 'second.wav')
+    assert first.status_code == 201
+    assert second.status_code == 201
+    first_data = json.loads(first.data.decode('utf8'))
+    second_data = json.loads(second.data.decode('utf8'))
+    assert first_data['id'] != second_data['id']
+    assert first_data['file_info']['sha256'] == second_data['file_info']['sha256']
+
+    blobs = Blob.query.all()
+    assert len(blobs) == 1
+    assert blobs[0].ref_count == 2
+    assert blobs[0].size == len(contents)
+
+
+def test_reuse_existing_audio(init_database, client):
+    """Test that a duplicate upload can return the existing audio"""
+    contents = b'RIFF....WAVE' + b'reused'
+    first = upload_audio_file(client, contents, 'audio.wav')
+    reused = upload_audio_file(client, contents, 'audio again.wav', reuse_existing=True)
+    assert first.status_code == 201
+    assert reused.status_code == 200
+    assert json.loads(reused.data.decode('utf8'))['id'] == json.loads(first.data.decode('utf8'))['id']
+
+    different = upload_audio_file(client, contents + b'!', 'other.wav', reuse_existing=True)
+    assert different.status_code == 201
+
+
+def test_reuse_existing_transcription(init_database, client):
+    """Test that a duplicate transcription upload can return the existing transcription"""
+    def upload(reuse_existing):
+        return client.post(
+            '/v0.1/transcription/fromFile?reuseExisting={}'.format(str(reuse_existing).lower()),
+            data={'transcriptionFile': (io.BytesIO("ɖ ɯ ɕ i k v̩".encode('utf-8')), 'utterance.phonemes')},
+            content_type='multipart/form-data'
+        )
+    first = upload(False)
+    duplicate = upload(False)
+    reused = upload(True)
+    assert first.status_code == 201
+    assert duplicate.status_code == 201
+    assert reused.status_code == 200
+    first_id = json.loads(first.data.decode('utf8'))['id']
+    assert json.loads(duplicate.data.decode('utf8'))['id'] != first_id
+    assert json.loads(reused.data.decode('utf8'))['id'] == first_id
+
+
+def test_delete_audio_releases_blob(init_database, client):
+    """Test that deleting uploads removes their files, and the blob once neither uses it"""
+    from pathlib import Path
+    import flask
+    from persephone_api.blob_store import BlobStore
+    from persephone_api.db_models import Blob
+    contents = b'RIFF....WAVE' + b'deleted'
+    first = json.loads(upload_audio_file(client, contents, 'first.wav').data.decode('utf8'))
+    second = json.loads(upload_audio_file(client, contents, 'second.wav').data.decode('utf8'))
+    audio_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
+    blob_path = BlobStore.from_config(flask.current_app.config).blob_path(first['file_info']['sha256'])
+
+    response = client.delete('/v0.1/audio/{}'.format(first['id']))
+    assert response.status_code == 204
+    assert not (audio_path / 'first.wav').exists()
+    assert Blob.query.get(first['file_info']['sha256']).ref_count == 1
+    assert blob_path.exists()
+
+    response = client.delete('/v0.1/audio/{}'.format(second['id']))
+    assert response.status_code == 204
+    assert not (audio_path / 'second.wav').exists()
+    assert Blob.query.get(first['file_info']['sha256']) is None
+    assert not blob_path.exists()
+
+
+def test_rollback_removes_created_files(init_database, client):
+    """Test that files created in a transaction that is rolled back are removed"""
+    from persephone_api.api_endpoints.audio import create_audio
+    from persephone_api.blob_store import BlobStore
+    from persephone_api.extensions import db
+    import flask
+    from pathlib import Path
+    audio, _ = create_audio('rolled back.wav', io.BytesIO(b'RIFF....WAVE rolled back'), commit=False)
+    db.session.flush()
+    named_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST']) / audio.file_info.name
+    blob_path = BlobStore.from_config(flask.current_app.config).blob_path(audio.file_info.blob_hash)
+    assert named_path.exists()
+    assert blob_path.exists()
+
+    db.session.rollback()
+    assert not named_path.exists()
+    assert not blob_path.exists()
+
+
+def test_shared_blob_file_kept_for_committed_rows(init_database, client):
+    """Test that a blob file created by a transaction that rolls back is kept,
+    or put back, for another transaction that committed a row for it"""
+    from persephone_api.api_endpoints.audio import create_audio
+    from persephone_api.blob_store import BlobStore, _remove_unused_blob_files
+    from persephone_api.extensions import db
+    import flask
+    import hashlib
+    contents = b'RIFF....WAVE shared'
+    blob_path = BlobStore.from_config(flask.current_app.config).blob_path(hashlib.sha256(contents).hexdigest())
+    # As if created by a concurrent upload that hasn't committed yet
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    blob_path.write_bytes(contents)
+
+    audio, _ = create_audio('shared.wav', io.BytesIO(contents), commit=False)
+    # The concurrent upload rolls back before this one commits
+    _remove_unused_blob_files(db.session, [blob_path])
+    assert not blob_path.exists()
+    db.session.commit()
+    assert blob_path.read_bytes() == contents
+
+    # A later rollback of an upload that created the same file leaves it
+    _remove_unused_blob_files(db.session, [blob_path])
+    assert blob_path.exists()
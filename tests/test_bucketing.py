@@ -0,0 +1,17 @@
+"""Tests for length bucketed batching of training utterances"""
+
+def test_batches_within_frame_budget():
+    """Test that batches hold utterances of similar length within the frame budget"""
+    from persephone_api.bucketing import bucket_batches
+    lengths = [100, 1000, 120, 900, 110, 950]
+    batches = bucket_batches(lengths, frames_per_batch=2000)
+    assert sorted(index for batch in batches for index in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) * max(lengths[index] for index in batch) <= 2000
+    assert [0, 2, 4] in [sorted(batch) for batch in batches]
+
+
+def test_long_utterance_gets_own_batch():
+    """Test that an utterance longer than the budget is still batched"""
+    from persephone_api.bucketing import bucket_batches
+    assert bucket_batches([50, 5000], frames_per_batch=1000) == [[0], [1]]
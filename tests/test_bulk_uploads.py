@@ -47,4 +47,36 @@ def test_small_zip_file(init_database, client):
         content_type='multipart/form-data'
     )
     assert response.status_code == 201
-    upload_response_data = json.loads(response.data.decode('utf8'))
\ No newline at end of file
+    upload_response_data = json.loads(response.data.decode('utf8'))
+
+def test_zip_member_names_flattened(init_database, client):
+    """Test that members in folders or with paths leaving the upload directory
+    are stored in the upload directory under their base name"""
+    import io
+    import json
+    import zipfile
+    from pathlib import Path
+    import flask
+
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, mode='w') as zip_file:
+        zip_file.writestr("nested/folder/", b"")
+        zip_file.writestr("nested/folder/a.wav", b"RIFF nested audio")
+        zip_file.writestr("../../escaped.phonemes", "a b c")
+    data = {'utterancesFile': (io.BytesIO(zip_data.getvalue()), 'paths.zip')}
+    response = client.post(
+        ('/v0.1/bulk_data/utterances'),
+        data=data,
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 201
+    upload_response_data = json.loads(response.data.decode('utf8'))
+    assert [audio['file_info']['name'] for audio in upload_response_data['audios_created']] == ["a.wav"]
+    assert len(upload_response_data['transcriptions_created']) == 1
+
+    audio_path = Path(flask.current_app.config['UPLOADED_AUDIO_DEST'])
+    text_path = Path(flask.current_app.config['UPLOADED_TEXT_DEST'])
+    assert (audio_path / "a.wav").read_bytes() == b"RIFF nested audio"
+    assert not (audio_path / "nested").exists()
+    assert (text_path / "escaped.phonemes").exists()
+    assert not (text_path.parent.parent / "escaped.phonemes").exists()
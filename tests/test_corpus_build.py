@@ -0,0 +1,76 @@
+"""Tests for the staged building of corpora"""
+import json
+
+
+def test_remaining_stages():
+    """Test that a build resumes after the last completed stage"""
+    from persephone_api.corpus_build import STAGES, remaining_stages
+    assert remaining_stages(None) == STAGES
+    assert remaining_stages("materialize") == ("features", "labels", "ready")
+    assert remaining_stages("ready") == ()
+
+
+def test_restart_ready_corpus(init_database, client, create_corpus):
+    """Test that restarting the build of a ready corpus runs no stages"""
+    from persephone_api.corpus_build import STAGES
+    corpus_id = create_corpus()
+    response = client.get('/v0.1/corpus/{}'.format(corpus_id))
+    assert json.loads(response.data.decode('utf8'))['buildStage'] == "ready"
+
+    response = client.post('/v0.1/corpus/build/{}'.format(corpus_id))
+    assert response.status_code == 202
+    job_data = json.loads(response.data.decode('utf8'))
+
+    response = client.get('/v0.1/jobs/{}'.format(job_data['id']))
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "succeeded"
+    assert job_data['result']['corpusID'] == corpus_id
+    assert [stage['name'] for stage in job_data['result']['stages']] == list(STAGES)
+    assert {stage['status'] for stage in job_data['result']['stages']} == {"skipped"}
+
+
+def test_restart_failed_stage(init_database, client, create_corpus):
+    """Test that a build restarts from the stage after the last completed one"""
+    from persephone_api.db_models import DBcorpus
+    corpus_id = create_corpus()
+    init_database.session.query(DBcorpus).filter_by(id=corpus_id).update({"build_stage": "features"})
+    init_database.session.commit()
+
+    response = client.post('/v0.1/corpus/build/{}'.format(corpus_id))
+    job_data = json.loads(response.data.decode('utf8'))
+    response = client.get('/v0.1/jobs/{}'.format(job_data['id']))
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "succeeded"
+    stages = job_data['result']['stages']
+    assert [stage['name'] for stage in stages if stage['status'] == "completed"] == ["labels", "ready"]
+
+    response = client.get('/v0.1/corpus/labels/{}'.format(corpus_id))
+    assert json.loads(response.data.decode('utf8'))['labels']
+
+
+def test_corpus_built_before_stages(init_database, client, create_corpus):
+    """Test that a corpus created before build stages were recorded is ready"""
+    from persephone_api.corpus_build import STAGES
+    from persephone_api.db_models import DBcorpus
+    corpus_id = create_corpus()
+    init_database.session.query(DBcorpus).filter_by(id=corpus_id).update({"build_stage": None})
+    init_database.session.commit()
+
+    response = client.get('/v0.1/corpus/{}'.format(corpus_id))
+    assert json.loads(response.data.decode('utf8'))['buildStage'] == "ready"
+
+    response = client.post('/v0.1/corpus/build/{}'.format(corpus_id))
+    job_data = json.loads(response.data.decode('utf8'))
+    response = client.get('/v0.1/jobs/{}'.format(job_data['id']))
+    job_data = json.loads(response.data.decode('utf8'))
+    assert [stage['name'] for stage in job_data['result']['stages']] == list(STAGES)
+    assert {stage['status'] for stage in job_data['result']['stages']} == {"skipped"}
+
+    response = client.post('/v0.1/corpus/preprocess/{}'.format(corpus_id))
+    assert response.status_code == 202
+
+
+def test_build_missing_corpus(init_database, client):
+    """Test restarting the build of a corpus that doesn't exist"""
+    response = client.post('/v0.1/corpus/build/1234')
+    assert response.status_code == 404
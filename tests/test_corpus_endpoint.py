@@ -73,7 +73,7 @@ def test_corpus_creation(init_database, client, upload_audio, upload_transcripti
         headers={'Content-Type': 'application/json'}
     )
 
-    assert response.status_code == 201
+    assert response.status_code == 202
 
     corpus_response_data = json.loads(response.data.decode('utf8'))
     assert corpus_response_data['partition']
@@ -82,6 +82,15 @@ def test_corpus_creation(init_database, client, upload_audio, upload_transcripti
     assert corpus_response_data['partition']['training'] == [utterance_id_b]
     assert corpus_response_data['partition']['validation'] == [utterance_id_c]
 
+    build_job = corpus_response_data['buildJob']
+    assert build_job['kind'] == "corpus-build"
+    assert build_job['status'] == "succeeded"
+    stages = build_job['result']['stages']
+    assert [stage['name'] for stage in stages] == ["validate", "materialize", "features", "labels", "ready"]
+    # Validation is done by the request, the job runs the other stages
+    assert [stage['status'] for stage in stages] == ["skipped"] + ["completed"] * 4
+    assert corpus_response_data['buildStage'] == "ready"
+
 
 def test_corpus_label_regression(init_database, client, upload_audio,
                                  upload_transcription, create_utterance, create_sine):
@@ -168,11 +177,114 @@ def test_corpus_label_regression(init_database, client, upload_audio,
         headers={'Content-Type': 'application/json'}
     )
 
-    assert response.status_code == 201
+    assert response.status_code == 202
 
     corpus_response_data = json.loads(response.data.decode('utf8'))
     assert corpus_response_data['partition']
 
     assert corpus_response_data['partition']['testing'] == [utterance_id_a]
     assert corpus_response_data['partition']['training'] == [utterance_id_b]
-    assert corpus_response_data['partition']['validation'] == [utterance_id_c]
\ No newline at end of file
+    assert corpus_response_data['partition']['validation'] == [utterance_id_c]
+
+def test_corpus_missing_utterances(init_database, client):
+    """Test that a corpus referring to utterances that don't exist is rejected before it is created"""
+    import json
+
+    data = {
+        "name": "Missing utterances",
+        "labelType": "phonemes",
+        "featureType": "fbank",
+        "testing": [1],
+        "training": [2, 3],
+        "validation": [],
+    }
+    response = client.post(
+        '/v0.1/corpus',
+        data=json.dumps(data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 400
+    assert "1, 2, 3" in json.loads(response.data.decode('utf8'))['detail']
+
+    response = client.get('/v0.1/corpus')
+    assert json.loads(response.data.decode('utf8')) == []
+
+
+def test_corpus_listing_query_count(init_database, client):
+    """Test that listing corpora takes the same number of queries however many are on the page"""
+    import json
+    from sqlalchemy import event
+    from persephone_api.db_models import DBcorpus, TestingDataSet, TrainingDataSet, ValidationDataSet
+    db = init_database
+
+    def add_corpora(count):
+        for _ in range(count):
+            corpus = DBcorpus(name="Listed corpus", labelType="phonemes", featureType="fbank")
+            db.session.add(corpus)
+            db.session.flush()
+            db.session.add(TrainingDataSet(corpus_id=corpus.id, utterance_id=corpus.id * 10))
+            db.session.add(TrainingDataSet(corpus_id=corpus.id, utterance_id=corpus.id * 10 + 1))
+            db.session.add(TestingDataSet(corpus_id=corpus.id, utterance_id=corpus.id * 10 + 2))
+            db.session.add(ValidationDataSet(corpus_id=corpus.id, utterance_id=corpus.id * 10 + 3))
+        db.session.commit()
+
+    statements = []
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def listing_queries():
+        del statements[:]
+        response = client.get('/v0.1/corpus?pageSize=20')
+        assert response.status_code == 200
+        return json.loads(response.data.decode('utf8')), len(statements)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        add_corpora(1)
+        _, single_corpus_queries = listing_queries()
+        add_corpora(19)
+        corpora, page_queries = listing_queries()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+    assert len(corpora) == 20
+    assert page_queries == single_corpus_queries
+    for corpus in corpora:
+        base_id = corpus['id'] * 10
+        assert corpus['partition'] == {
+            "training": [base_id, base_id + 1],
+            "testing": [base_id + 2],
+            "validation": [base_id + 3],
+        }
+
+
+def test_corpus_overlapping_partitions(init_database, client, upload_audio, upload_transcription,
+                                      create_utterance, create_sine):
+    """Test that a corpus with an utterance in two data splits is rejected before it is created"""
+    import json
+
+    response = upload_audio(create_sine(note="A"), filename="a.wav")
+    audio_id = json.loads(response.data.decode('utf8'))['id']
+    response = upload_transcription("a", filename="a.phonemes")
+    transcription_id = json.loads(response.data.decode('utf8'))['id']
+    response = create_utterance(audio_id, transcription_id)
+    utterance_id = json.loads(response.data.decode('utf8'))['id']
+
+    data = {
+        "name": "Overlapping corpus",
+        "labelType": "phonemes",
+        "featureType": "fbank",
+        "testing": [utterance_id],
+        "training": [utterance_id],
+        "validation": [],
+    }
+    response = client.post(
+        '/v0.1/corpus',
+        data=json.dumps(data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 400
+    assert "Overlapping" in json.loads(response.data.decode('utf8'))['detail']
+
+    response = client.get('/v0.1/corpus')
+    assert json.loads(response.data.decode('utf8')) == []
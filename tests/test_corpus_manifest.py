@@ -0,0 +1,60 @@
+"""Tests for corpus manifests"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+
+def make_corpus(corpus_path: Path):
+    """A stand in for a persephone Corpus with features on disk"""
+    (corpus_path / "feat").mkdir()
+    frames = {"long": 30, "short": 10, "valid": 20, "test": 5, "unlabelled": 7}
+    for prefix, count in frames.items():
+        np.save(str(corpus_path / "feat" / "{}.fbank.npy".format(prefix)), np.zeros((count, 41, 3)))
+    return SimpleNamespace(
+        feat_type="fbank",
+        label_type="phonemes",
+        labels={"o", "a", "t"},
+        train_prefixes=["short", "long"],
+        valid_prefixes=["valid"],
+        test_prefixes=["test"],
+        untranscribed_prefixes=["unlabelled"],
+    ), frames
+
+
+def test_manifest_round_trip(tmpdir):
+    """Test that a manifest gives the data splits, frames and labels of the corpus"""
+    from persephone_api.corpus_manifest import ManifestCorpus, write_manifest
+    corpus_path = Path(str(tmpdir))
+    corpus, frames = make_corpus(corpus_path)
+    write_manifest(corpus, corpus_path)
+
+    manifest = ManifestCorpus(corpus_path)
+    assert manifest.partition_size("train") == 2
+    assert manifest.train_prefixes == ["short", "long"]
+    assert manifest.valid_prefixes == ["valid"]
+    assert manifest.test_prefixes == ["test"]
+    assert manifest.untranscribed_prefixes == ["unlabelled"]
+    assert manifest.num_feats == 41 * 3
+
+    feature_paths, label_paths = manifest.get_train_fns()
+    assert label_paths[0] == str(corpus_path / "label" / "short.phonemes")
+    assert [manifest.feature_frames(path) for path in feature_paths] == [frames["short"], frames["long"]]
+
+    # Labels are indexed after padding in sorted order, as persephone does
+    assert manifest.labels_to_indices(["a", "o", "t"]) == [1, 2, 3]
+    assert manifest.indices_to_labels([3, 1]) == ["t", "a"]
+
+
+def test_manifest_written_from_pickle(tmpdir):
+    """Test that a corpus built before manifests gets one from its pickled corpus"""
+    import pickle
+    from persephone_api.corpus_manifest import MANIFEST_HEADER, load_manifest
+    corpus_path = Path(str(tmpdir))
+    corpus, _ = make_corpus(corpus_path)
+    with (corpus_path / "corpus.p").open('wb') as pickle_file:
+        pickle.dump(corpus, pickle_file)
+
+    manifest = load_manifest(corpus_path)
+    assert (corpus_path / MANIFEST_HEADER).exists()
+    assert manifest.test_prefixes == ["test"]
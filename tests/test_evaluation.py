@@ -0,0 +1,24 @@
+"""Tests for model evaluation"""
+
+def test_edit_distances():
+    """Test edit distances of a batch of label sequences of different lengths"""
+    from persephone_api.evaluation import edit_distances
+    hypotheses = [
+        ["a", "b", "c"],
+        ["a", "c"],
+        [],
+        ["x", "y", "z", "w"],
+    ]
+    references = [
+        ["a", "b", "c"],
+        ["a", "b", "c"],
+        ["a", "b"],
+        [],
+    ]
+    assert list(edit_distances(hypotheses, references)) == [0, 1, 2, 4]
+
+
+def test_edit_distances_substitution_and_insertion():
+    """Test that substitutions and insertions are both counted"""
+    from persephone_api.evaluation import edit_distances
+    assert list(edit_distances([["k", "i", "t", "t", "e", "n"]], [["s", "i", "t", "t", "i", "n", "g"]])) == [3]
@@ -0,0 +1,103 @@
+"""Tests for the content addressed feature cache"""
+import os
+
+import numpy as np
+
+
+def test_key_depends_on_content_and_feature_type(tmpdir):
+    """Test that identical audio shares a key and different features don't"""
+    from pathlib import Path
+    from persephone_api.feature_cache import FeatureCache, audio_content_hash
+    first = Path(str(tmpdir.join("first.wav")))
+    first.write_bytes(b"audio data")
+    copy = Path(str(tmpdir.join("copy.wav")))
+    copy.write_bytes(b"audio data")
+    other = Path(str(tmpdir.join("other.wav")))
+    other.write_bytes(b"other audio data")
+
+    cache = FeatureCache(Path(str(tmpdir.join("cache"))))
+    first_hash = audio_content_hash(first)
+    assert first_hash == audio_content_hash(copy)
+    assert first_hash != audio_content_hash(other)
+    assert cache.key(first_hash, "fbank") != cache.key(first_hash, "fbank_and_pitch")
+
+
+def test_cache_hit_skips_extraction(tmpdir, monkeypatch):
+    """Test that features are only extracted the first time they are needed"""
+    from pathlib import Path
+    from persephone_api import feature_cache
+    extracted = []
+    def fake_extract(audio_path, feature_type, output_path):
+        extracted.append(audio_path)
+        np.save(str(output_path), np.ones((3, 2)))
+    monkeypatch.setattr(feature_cache, "extract_features", fake_extract)
+    audio = Path(str(tmpdir.join("audio.wav")))
+    audio.write_bytes(b"audio data")
+
+    cache = feature_cache.FeatureCache(Path(str(tmpdir.join("cache"))))
+    first = cache.features_for(audio, "fbank")
+    second = cache.features_for(audio, "fbank")
+    assert first == second
+    assert len(extracted) == 1
+
+
+def test_pinned_features_survive_eviction(tmpdir, monkeypatch):
+    """Test that pinned features stay readable when their entry is evicted,
+    and that an entry evicted before it is linked is extracted again"""
+    from pathlib import Path
+    from persephone_api import feature_cache
+    extracted = []
+    def fake_extract(audio_path, feature_type, output_path):
+        extracted.append(audio_path)
+        np.save(str(output_path), np.ones((3, 2)))
+    monkeypatch.setattr(feature_cache, "extract_features", fake_extract)
+    audio = Path(str(tmpdir.join("audio.wav")))
+    audio.write_bytes(b"audio data")
+    cache = feature_cache.FeatureCache(Path(str(tmpdir.join("cache"))))
+
+    with cache.pinned_features([audio], "fbank") as (pinned,):
+        cache.features_for(audio, "fbank").unlink()
+        assert np.load(str(pinned)).shape == (3, 2)
+    assert not pinned.exists()
+
+    evictions = []
+    def evicting_link(source, destination):
+        if not evictions:
+            # Another request evicts the entry first
+            evictions.append(source)
+            source.unlink()
+        feature_cache.hard_link(source, destination)
+    destination = Path(str(tmpdir.join("linked.npy")))
+    cache.link_features(audio, "fbank", destination, link=evicting_link)
+    assert np.load(str(destination)).shape == (3, 2)
+    assert len(extracted) == 3
+
+
+def test_eviction_removes_least_recently_used(tmpdir):
+    """Test that the oldest entries are removed once the cache is over its limit"""
+    from pathlib import Path
+    from persephone_api.feature_cache import FeatureCache
+    cache = FeatureCache(Path(str(tmpdir)), max_bytes=1)
+    entries = []
+    for i, key in enumerate(["aa01", "bb02", "cc03"]):
+        entry = cache.entry_path(key)
+        entry.parent.mkdir(parents=True)
+        np.save(str(entry), np.zeros(10))
+        os.utime(str(entry), (i, i))
+        entries.append(entry)
+    cache.evict()
+    assert [entry.exists() for entry in entries] == [False, False, True]
+
+
+def test_load_feature_batch_pads(tmpdir):
+    """Test that features of different lengths are zero padded into one batch"""
+    from pathlib import Path
+    from persephone_api.feature_cache import load_feature_batch
+    short = Path(str(tmpdir.join("short.npy")))
+    long = Path(str(tmpdir.join("long.npy")))
+    np.save(str(short), np.ones((2, 3)))
+    np.save(str(long), np.ones((4, 3)))
+    batch, lengths = load_feature_batch([short, long])
+    assert batch.shape == (2, 4, 3)
+    assert list(lengths) == [2, 4]
+    assert batch[0, 2:].sum() == 0
@@ -0,0 +1,47 @@
+"""Tests for materializing corpus files without copying them"""
+import errno
+from pathlib import Path
+
+import pytest
+
+
+def test_materialize_without_copying(tmpdir):
+    """Test that files on the same filesystem are reflinked or hardlinked"""
+    from persephone_api.file_links import COPY, materialize_files
+    source_dir = Path(str(tmpdir.mkdir("uploads")))
+    destination_dir = Path(str(tmpdir.mkdir("corpus")))
+    files = []
+    for i in range(20):
+        source = source_dir / "{}.wav".format(i)
+        source.write_bytes(bytes([i]) * 1000)
+        files.append((source, destination_dir / "utterance_{}.wav".format(i)))
+
+    methods = materialize_files(files, max_workers=4)
+    assert sum(methods.values()) == 20
+    assert COPY not in methods
+    for source, destination in files:
+        assert destination.read_bytes() == source.read_bytes()
+
+
+def test_copy_across_filesystems(tmpdir, monkeypatch):
+    """Test that files are copied if they can't be linked"""
+    import os
+    from persephone_api import file_links
+
+    def cross_device(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(file_links, "reflink", cross_device)
+    monkeypatch.setattr(os, "link", cross_device)
+
+    source = Path(str(tmpdir)) / "source.txt"
+    source.write_text("a b c")
+    destination = Path(str(tmpdir)) / "destination.txt"
+    assert file_links.link_or_copy(source, destination) == file_links.COPY
+    assert destination.read_text() == "a b c"
+    assert not os.path.samefile(str(source), str(destination))
+
+    # An existing destination isn't overwritten, the same as when linking
+    source.write_text("d e f")
+    with pytest.raises(FileExistsError):
+        file_links.link_or_copy(source, destination)
+    assert destination.read_text() == "a b c"
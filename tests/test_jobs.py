@@ -0,0 +1,70 @@
+"""Tests for background jobs"""
+
+def test_job_not_found(init_database, client):
+    """Test that requesting a job that doesn't exist gives a 404"""
+    response = client.get('/v0.1/jobs/9999999')
+    assert response.status_code == 404
+
+def test_job_success(init_database, client):
+    """Test that the result of a successful job is recorded"""
+    import json
+    import flask
+    from persephone_api.jobs import EagerExecutor, create_job, submit_job
+
+    app = flask.current_app._get_current_object()
+    current_job = create_job("test")
+    submit_job(app, current_job.id, EagerExecutor(), sum, [1, 2], on_success=lambda total: {"total": total})
+
+    response = client.get('/v0.1/jobs/{}'.format(current_job.id))
+    assert response.status_code == 200
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "succeeded"
+    assert job_data['result'] == {"total": 3}
+    assert job_data['startedAt'] is not None
+    assert job_data['URL'] == "jobs/{}".format(current_job.id)
+
+def test_job_failure(init_database, client):
+    """Test that an error raised by the work of a job is recorded"""
+    import json
+    import flask
+    from persephone_api.jobs import EagerExecutor, create_job, submit_job
+
+    def fail():
+        raise ValueError("Could not decode")
+
+    app = flask.current_app._get_current_object()
+    current_job = create_job("test")
+    submit_job(app, current_job.id, EagerExecutor(), fail, on_success=lambda _: {})
+
+    response = client.get('/v0.1/jobs/{}'.format(current_job.id))
+    assert response.status_code == 200
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "failed"
+    assert "Could not decode" in job_data['error']
+
+def test_cancel_queued_training_job(init_database, client):
+    """Test that a queued training job can be cancelled"""
+    import json
+    from persephone_api.db_models import Job
+    db = init_database
+
+    current_job = Job(kind="training", status=Job.QUEUED)
+    db.session.add(current_job)
+    db.session.commit()
+
+    response = client.delete('/v0.1/jobs/{}'.format(current_job.id))
+    assert response.status_code == 200
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "cancelled"
+
+    # Can't cancel a job twice
+    response = client.delete('/v0.1/jobs/{}'.format(current_job.id))
+    assert response.status_code == 409
+
+def test_cancel_transcription_job(init_database, client):
+    """Test that only training jobs can be cancelled"""
+    from persephone_api.jobs import create_job
+    current_job = create_job("transcription")
+
+    response = client.delete('/v0.1/jobs/{}'.format(current_job.id))
+    assert response.status_code == 400
@@ -0,0 +1,42 @@
+"""Tests for coalescing of concurrent identical work"""
+import threading
+import time
+
+import pytest
+
+
+def test_concurrent_calls_are_coalesced():
+    """Test that concurrent calls for the same key run the work once"""
+    from persephone_api.memoization import Coalescer
+    coalescer = Coalescer()
+    calls = []
+    def work():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer.run("key", work))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+
+
+def test_later_calls_run_again():
+    """Test that the result is not kept once the work has finished"""
+    from persephone_api.memoization import Coalescer
+    coalescer = Coalescer()
+    assert coalescer.run("key", lambda: 1) == 1
+    assert coalescer.run("key", lambda: 2) == 2
+
+
+def test_error_is_raised():
+    """Test that errors from the work are raised to the caller"""
+    from persephone_api.memoization import Coalescer
+    coalescer = Coalescer()
+    def fail():
+        raise ValueError("failed")
+    with pytest.raises(ValueError):
+        coalescer.run("key", fail)
@@ -0,0 +1,75 @@
+"""Tests for micro-batching of concurrent requests"""
+import threading
+
+import pytest
+
+
+def run_concurrently(batcher, key_for, count, process_batch):
+    """Submit `count` items from separate threads, returns the results by item"""
+    results = {}
+    def worker(i):
+        results[i] = batcher.submit(key_for(i), i, process_batch)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_items_share_a_batch():
+    """Test that items submitted within the window are processed as one batch"""
+    from persephone_api.micro_batching import MicroBatcher
+    batcher = MicroBatcher(window=1.0, max_batch_size=4)
+    batches = []
+    def process_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+    results = run_concurrently(batcher, lambda i: "model", 4, process_batch)
+    assert results == {0: 0, 1: 10, 2: 20, 3: 30}
+    assert len(batches) == 1
+
+
+def test_keys_are_batched_separately():
+    """Test that items for different keys are never mixed"""
+    from persephone_api.micro_batching import MicroBatcher
+    batcher = MicroBatcher(window=0.05, max_batch_size=8)
+    batches = []
+    lock = threading.Lock()
+    def process_batch(items):
+        with lock:
+            batches.append(sorted(items))
+        return items
+    results = run_concurrently(batcher, lambda i: i % 2, 6, process_batch)
+    assert results == {i: i for i in range(6)}
+    for batch in batches:
+        assert len({item % 2 for item in batch}) == 1
+
+
+def test_error_raised_for_every_item():
+    """Test that a failed batch raises the error for each caller"""
+    from persephone_api.micro_batching import MicroBatcher
+    batcher = MicroBatcher(window=0.01, max_batch_size=1)
+    def process_batch(items):
+        raise ValueError("decoding failed")
+    with pytest.raises(ValueError):
+        batcher.submit("model", 1, process_batch)
+
+
+def test_disabled_without_request_threads(monkeypatch):
+    """Test that micro-batching is turned off in uwsgi workers that handle one request at a time"""
+    import sys
+    from types import SimpleNamespace
+    import flask
+    from persephone_api.micro_batching import MicroBatcher
+    app = flask.Flask(__name__)
+    app.config['MICRO_BATCHING_ENABLED'] = True
+    batcher = MicroBatcher()
+
+    monkeypatch.setitem(sys.modules, 'uwsgi', SimpleNamespace(opt={}))
+    batcher.init_app(app)
+    assert not batcher.enabled
+
+    monkeypatch.setitem(sys.modules, 'uwsgi', SimpleNamespace(opt={'threads': b'4'}))
+    batcher.init_app(app)
+    assert batcher.enabled
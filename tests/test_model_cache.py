@@ -0,0 +1,82 @@
+"""Tests for the per-process cache of restored models"""
+
+class FakeModel:
+    """Stand in for a restored model that tracks if it was released"""
+    def __init__(self, memory_size=1):
+        self.memory_size = memory_size
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_cache_hit_and_miss():
+    """Test that a cached model is returned without calling the loader again"""
+    from persephone_api.model_cache import ModelCache
+    cache = ModelCache(max_models=2)
+    first = cache.get(1, 100, FakeModel)
+    second = cache.get(1, 100, FakeModel)
+    assert first is second
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 0
+
+
+def test_new_checkpoint_version_reloads():
+    """Test that a new checkpoint version replaces the stale cached model"""
+    from persephone_api.model_cache import ModelCache
+    cache = ModelCache(max_models=2)
+    old = cache.get(1, 100, FakeModel)
+    new = cache.get(1, 200, FakeModel)
+    assert old is not new
+    assert old.closed
+    assert cache.stats()["cachedModels"] == [1]
+
+
+def test_lru_eviction_by_count():
+    """Test that the least recently used model is evicted first"""
+    from persephone_api.model_cache import ModelCache
+    cache = ModelCache(max_models=2)
+    model_1 = cache.get(1, 0, FakeModel)
+    cache.get(2, 0, FakeModel)
+    cache.get(1, 0, FakeModel) # model 2 is now least recently used
+    model_3 = cache.get(3, 0, FakeModel)
+    stats = cache.stats()
+    assert stats["cachedModels"] == [1, 3]
+    assert stats["evictions"] == 1
+    assert not model_1.closed
+    assert not model_3.closed
+
+
+def test_eviction_by_memory_budget():
+    """Test that models are evicted to stay within the memory budget"""
+    from persephone_api.model_cache import ModelCache
+    cache = ModelCache(max_models=None, memory_budget=100)
+    model_1 = cache.get(1, 0, lambda: FakeModel(memory_size=60))
+    cache.get(2, 0, lambda: FakeModel(memory_size=60))
+    assert model_1.closed
+    assert cache.stats()["cachedModels"] == [2]
+    # A single model over budget is still kept so that it can be used
+    cache.get(3, 0, lambda: FakeModel(memory_size=500))
+    assert cache.stats()["cachedModels"] == [3]
+
+
+def test_checked_out_model_closed_after_release():
+    """Test that a model evicted while checked out is only closed once every user has released it"""
+    from persephone_api.model_cache import ModelCache
+    cache = ModelCache(max_models=1)
+    with cache.checkout(1, 0, FakeModel) as model_1:
+        with cache.checkout(1, 0, FakeModel) as same_model:
+            assert same_model is model_1
+            cache.get(2, 0, FakeModel)
+            assert cache.stats()["cachedModels"] == [2]
+        assert not model_1.closed
+    assert model_1.closed
+
+    # Releasing a model that is still cached leaves it open
+    with cache.checkout(2, 0, FakeModel) as model_2:
+        pass
+    assert not model_2.closed
+    cache.invalidate(2)
+    assert model_2.closed
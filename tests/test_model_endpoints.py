@@ -186,4 +186,107 @@ def test_get_model(init_database, client, create_corpus):
     assert model_get_data["minimumEpochs"] == 1
     assert model_get_data["maximumEpochs"] == 2
     assert model_get_data["maximumTrainingLER"] == 0.4
-    assert model_get_data["maximumValidationLER"] == 0.8
\ No newline at end of file
+    assert model_get_data["maximumValidationLER"] == 0.8
+
+
+def test_batch_transcribe_missing_audio(init_database, client, create_corpus):
+    """Test that a batch transcription referencing audio that doesn't exist is rejected"""
+    import json
+    corpus_id = create_corpus()
+
+    model_data = {
+        "name": "Test model",
+        "corpusID": corpus_id,
+        "earlyStoppingSteps": 1,
+    }
+
+    response = client.post(
+        '/v0.1/model',
+        data=json.dumps(model_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 201
+    model_id = json.loads(response.data.decode('utf8'))['id']
+
+    response = client.post(
+        '/v0.1/model/transcribe/{}/batch'.format(model_id),
+        data=json.dumps({"audioIDs": [9999999]}),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 404
+
+
+def test_evaluate_untrained_model(init_database, client, create_corpus):
+    """Test that evaluating a model without a trained checkpoint is rejected"""
+    import json
+    corpus_id = create_corpus()
+
+    model_data = {
+        "name": "Test model",
+        "corpusID": corpus_id,
+        "earlyStoppingSteps": 1,
+    }
+
+    response = client.post(
+        '/v0.1/model',
+        data=json.dumps(model_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 201
+    model_id = json.loads(response.data.decode('utf8'))['id']
+
+    response = client.post('/v0.1/model/{}/evaluate'.format(model_id))
+    assert response.status_code == 400
+
+
+def test_resume_untrained_model(init_database, client, create_corpus):
+    """Test that a model without a checkpoint can't be resumed or warm started from"""
+    import json
+    corpus_id = create_corpus()
+
+    model_data = {
+        "name": "Test model",
+        "corpusID": corpus_id,
+        "earlyStoppingSteps": 1,
+    }
+
+    response = client.post(
+        '/v0.1/model',
+        data=json.dumps(model_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 201
+    model_id = json.loads(response.data.decode('utf8'))['id']
+
+    response = client.post('/v0.1/model/train/{}?mode=resume'.format(model_id))
+    assert response.status_code == 400
+
+    response = client.post('/v0.1/model/train/{}?mode=warmStart'.format(model_id))
+    assert response.status_code == 400
+
+    response = client.post('/v0.1/model/train/{}?mode=warmStart&fromModelID={}'.format(model_id, model_id))
+    assert response.status_code == 400
+
+
+def test_create_model_bucketed_batching(init_database, client, create_corpus):
+    """Test creating a model that trains with length bucketed batches"""
+    import json
+    corpus_id = create_corpus()
+
+    model_data = {
+        "name": "Test model",
+        "corpusID": corpus_id,
+        "earlyStoppingSteps": 1,
+        "batchingStrategy": "bucketed",
+        "framesPerBatch": 10000,
+    }
+
+    response = client.post(
+        '/v0.1/model',
+        data=json.dumps(model_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 201
+    model_response_data = json.loads(response.data.decode('utf8'))
+    assert model_response_data["batchingStrategy"] == "bucketed"
+    assert model_response_data["framesPerBatch"] == 10000
@@ -0,0 +1,66 @@
+"""Tests for resolving trained models through the model registry"""
+
+def create_model(client, corpus_id):
+    """Create a model via the API and return it from the DB"""
+    import json
+    from persephone_api.db_models import TranscriptionModel
+    response = client.post(
+        '/v0.1/model',
+        data=json.dumps({"name": "Test model", "corpusID": corpus_id, "earlyStoppingSteps": 1}),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 201
+    return TranscriptionModel.query.get(json.loads(response.data.decode('utf8'))['id'])
+
+def write_checkpoint(checkpoint_path):
+    """Create the files of a fake checkpoint"""
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    for extension in (".index", ".meta", ".data-00000-of-00001"):
+        (checkpoint_path.parent / (checkpoint_path.name + extension)).write_bytes(b"checkpoint")
+
+
+def test_untrained_model_not_resolved(init_database, client, create_corpus):
+    """Test that a model without a checkpoint can't be resolved"""
+    from persephone_api.model_registry import model_registry
+    current_model = create_model(client, create_corpus())
+    assert model_registry.resolve(current_model) is None
+
+
+def test_resolve_published_checkpoint(init_database, client, create_corpus):
+    """Test that the most recently published checkpoint is resolved"""
+    from pathlib import Path
+    import flask
+    from persephone_api.model_registry import model_registry, publish_model
+    current_model = create_model(client, create_corpus())
+    model_path = Path(flask.current_app.config['MODELS_PATH']) / current_model.filesystem_path
+
+    first_checkpoint = model_path / "0" / "model" / "model_best.ckpt"
+    write_checkpoint(first_checkpoint)
+    publish_model(model_path, current_model, first_checkpoint, ["b", "a"])
+    descriptor = model_registry.resolve(current_model)
+    assert descriptor.checkpoint_path == first_checkpoint
+    assert descriptor.labels == ("a", "b")
+
+    second_checkpoint = model_path / "1" / "model" / "model_best.ckpt"
+    write_checkpoint(second_checkpoint)
+    publish_model(model_path, current_model, second_checkpoint, ["a", "b"])
+    assert model_registry.resolve(current_model).checkpoint_path == second_checkpoint
+
+
+def test_resolve_frozen_graph(init_database, client, create_corpus):
+    """Test that the exported inference graph is used only if it exists"""
+    from pathlib import Path
+    import flask
+    from persephone_api.inference import frozen_graph_path
+    from persephone_api.model_registry import model_registry, publish_model
+    current_model = create_model(client, create_corpus())
+    model_path = Path(flask.current_app.config['MODELS_PATH']) / current_model.filesystem_path
+
+    checkpoint = model_path / "0" / "model" / "model_best.ckpt"
+    write_checkpoint(checkpoint)
+    export_path = frozen_graph_path(checkpoint)
+    publish_model(model_path, current_model, checkpoint, ["a"], export_path)
+    assert model_registry.resolve(current_model).frozen_graph_path is None
+
+    export_path.write_bytes(b"graph")
+    assert model_registry.resolve(current_model).frozen_graph_path == export_path
@@ -1,6 +1,6 @@
 from unittest.mock import MagicMock
 
-def test_create_corpus_file_structure(tmpdir):
+def test_create_corpus_file_structure(tmpdir, init_database):
     """Test filesystem tasks related to corpus creation"""
     from persephone_api.api_endpoints.corpus import create_corpus_file_structure
     from pathlib import Path
@@ -14,9 +14,6 @@ def test_create_corpus_file_structure(tmpdir):
     mock_corpus = MagicMock(spec_set=["id","name","training", "testing", "validation"])
     mock_corpus.id = 1
     mock_corpus.name = "mock corpus"
-    mock_corpus.training.utterance.__iter__.return_value = ['0']
-    mock_corpus.testing.utterance.__iter__.return_value = ['1']
-    mock_corpus.validation.utterance.__iter__.return_value = ['2']
 
     create_corpus_file_structure(audio_uploads_dir, transcription_uploads_dir, mock_corpus, corpus_test_dir)
 
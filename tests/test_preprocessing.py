@@ -0,0 +1,84 @@
+"""Tests for parallel extraction of corpus features"""
+import json
+import os
+from pathlib import Path
+
+
+def test_pending_extractions(tmpdir):
+    """Test that only utterances without up to date features are extracted"""
+    from persephone_api.feature_cache import FeatureCache, audio_content_hash
+    from persephone_api.preprocessing import feature_path, pending_extractions, write_feature_sources
+    corpus_path = Path(str(tmpdir))
+    (corpus_path / "wav").mkdir()
+    (corpus_path / "feat").mkdir()
+    feature_cache = FeatureCache(corpus_path / "cache")
+    for prefix in ("a", "b", "c"):
+        (corpus_path / "wav" / "{}.wav".format(prefix)).write_bytes(prefix.encode())
+    # Up to date features for a, stale features for b and none for c
+    for prefix in ("a", "b"):
+        feature_path(corpus_path, prefix, "fbank").write_bytes(b"")
+    write_feature_sources(corpus_path, "fbank", {
+        "a": feature_cache.key(audio_content_hash(corpus_path / "wav" / "a.wav"), "fbank"),
+        "b": feature_cache.key("changed audio", "fbank"),
+    })
+    # Linked features can be older than their audio and still be up to date
+    wav_mtime = (corpus_path / "wav" / "a.wav").stat().st_mtime
+    os.utime(str(feature_path(corpus_path, "a", "fbank")), (wav_mtime - 60, wav_mtime - 60))
+
+    pending, up_to_date, current_keys = pending_extractions(corpus_path, "fbank", feature_cache)
+    assert up_to_date == 1
+    assert [wav_path.stem for wav_path, _ in pending] == ["b", "c"]
+    assert pending[1][1] == corpus_path / "feat" / "c.fbank.npy"
+    assert sorted(current_keys) == ["a", "b", "c"]
+
+
+def test_cached_features_linked(tmpdir):
+    """Test that features already in the feature cache are linked into the corpus instead of extracted"""
+    from persephone_api.feature_cache import FeatureCache, audio_content_hash
+    from persephone_api.preprocessing import link_utterance_features
+    wav_path = Path(str(tmpdir)) / "a.wav"
+    wav_path.write_bytes(b"RIFF audio contents")
+    feature_cache = FeatureCache(Path(str(tmpdir)) / "cache")
+    entry = feature_cache.entry_path(feature_cache.key(audio_content_hash(wav_path), "fbank"))
+    entry.parent.mkdir(parents=True)
+    entry.write_bytes(b"cached features")
+
+    features_path = Path(str(tmpdir)) / "a.fbank.npy"
+    features_path.write_bytes(b"stale features")
+    assert link_utterance_features(feature_cache, wav_path, "fbank", features_path)
+    assert features_path.read_bytes() == b"cached features"
+
+
+def test_preprocess_missing_corpus(init_database, client):
+    """Test preprocessing a corpus that doesn't exist"""
+    response = client.post('/v0.1/corpus/preprocess/1234')
+    assert response.status_code == 404
+
+
+def test_preprocess_unbuilt_corpus(init_database, client, create_corpus):
+    """Test that a corpus can only be preprocessed once it is built"""
+    from persephone_api.db_models import DBcorpus
+    db = init_database
+    corpus_id = create_corpus()
+    DBcorpus.query.get(corpus_id).build_stage = "validate"
+    db.session.commit()
+    response = client.post('/v0.1/corpus/preprocess/{}'.format(corpus_id))
+    assert response.status_code == 409
+
+
+def test_preprocess_corpus(init_database, client, create_corpus):
+    """Test that preprocessing marks the corpus and skips features extracted when it was created"""
+    corpus_id = create_corpus()
+    response = client.post('/v0.1/corpus/preprocess/{}'.format(corpus_id))
+    assert response.status_code == 202
+    job_data = json.loads(response.data.decode('utf8'))
+
+    response = client.get('/v0.1/jobs/{}'.format(job_data['id']))
+    job_data = json.loads(response.data.decode('utf8'))
+    assert job_data['status'] == "succeeded"
+    assert job_data['result']['extracted'] == 0
+    assert job_data['result']['skipped'] == job_data['result']['utterances']
+    assert job_data['progress']['completed'] == job_data['progress']['total']
+
+    response = client.get('/v0.1/corpus/{}'.format(corpus_id))
+    assert json.loads(response.data.decode('utf8'))['preprocessed']
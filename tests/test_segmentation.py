@@ -0,0 +1,39 @@
+"""Tests for splitting long recordings into segments"""
+import wave
+
+import numpy as np
+
+
+def write_wav(path, samples, rate=16000):
+    """Write 16 bit mono samples to a wav file"""
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(np.asarray(samples, dtype='<i2').tobytes())
+
+def tone(seconds, rate=16000):
+    """A loud sine wave"""
+    t = np.arange(int(seconds * rate)) / rate
+    return (10000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+
+def silence(seconds, rate=16000):
+    return np.zeros(int(seconds * rate), dtype=np.int16)
+
+
+def test_split_on_silence(tmpdir):
+    """Test that pauses split the audio and leading and trailing silence is dropped"""
+    from persephone_api.segmentation import find_segments
+    wav_path = tmpdir.join("speech.wav")
+    write_wav(wav_path, np.concatenate([silence(0.5), tone(1), silence(0.5), tone(2), silence(0.5)]))
+    segments = list(find_segments(wav_path, block_seconds=0.25))
+    assert segments == [(8000, 24000), (32000, 64000)]
+
+
+def test_maximum_segment_length(tmpdir):
+    """Test that audio without pauses is cut at the maximum length"""
+    from persephone_api.segmentation import find_segments
+    wav_path = tmpdir.join("speech.wav")
+    write_wav(wav_path, tone(5))
+    segments = list(find_segments(wav_path, max_seconds=2))
+    assert segments == [(0, 32000), (32000, 64000), (64000, 80000)]
@@ -0,0 +1,36 @@
+"""Tests for the configuration of TensorFlow sessions"""
+
+def test_parse_cpu_list():
+    """Test parsing CPU lists in the format used by taskset"""
+    from persephone_api.session_config import parse_cpu_list
+    assert parse_cpu_list("0-3,8") == [0, 1, 2, 3, 8]
+    assert parse_cpu_list("5") == [5]
+    assert parse_cpu_list("2,1-2") == [1, 2]
+    assert parse_cpu_list("") is None
+    assert parse_cpu_list(None) is None
+
+
+def test_settings_read_separately():
+    """Test that inference and training sessions are configured independently"""
+    from persephone_api.session_config import SessionSettings
+
+    class App:
+        config = {
+            'INFERENCE_INTRA_OP_THREADS': 2,
+            'INFERENCE_INTER_OP_THREADS': 1,
+            'INFERENCE_CPUS': [0, 1],
+            'TRAINING_INTRA_OP_THREADS': None,
+            'TRAINING_INTER_OP_THREADS': None,
+            'TRAINING_CPUS': [2, 3, 4, 5],
+        }
+
+    settings = SessionSettings()
+    settings.init_app(App())
+    assert settings.inference.intra_op_threads == 2
+    assert settings.inference.cpus == [0, 1]
+    assert settings.training.intra_op_threads is None
+    assert settings.training_cpus == [2, 3, 4, 5]
+
+    App.config['TRAINING_CPUS'] = None
+    settings.init_app(App())
+    assert settings.training_cpus == settings.available_cpus
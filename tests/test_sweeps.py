@@ -0,0 +1,125 @@
+"""Tests for hyperparameter sweeps"""
+import json
+
+
+def test_grid_runs():
+    """Test that a grid creates a run for every combination of values"""
+    from persephone_api.sweeps import grid_runs
+    runs = grid_runs({"numberLayers": [2, 3], "hiddenSize": [150, 250, 350]})
+    assert len(runs) == 6
+    assert {"numberLayers": 3, "hiddenSize": 150} in runs
+    assert len({json.dumps(run, sort_keys=True) for run in runs}) == 6
+
+
+def test_random_runs_reproducible():
+    """Test that random runs stay within the search space and repeat with the same seed"""
+    from persephone_api.sweeps import random_runs
+    space = {
+        "hiddenSize": {"minimum": 100, "maximum": 400},
+        "maximumTrainingLER": {"minimum": 0.1, "maximum": 0.5},
+        "beamWidth": [50, 100],
+    }
+    runs = random_runs(space, 10, seed=7)
+    assert len(runs) == 10
+    for run in runs:
+        assert isinstance(run["hiddenSize"], int)
+        assert 100 <= run["hiddenSize"] <= 400
+        assert 0.1 <= run["maximumTrainingLER"] <= 0.5
+        assert run["beamWidth"] in (50, 100)
+    assert random_runs(space, 10, seed=7) == runs
+
+
+def test_lagging_run_stopped(tmpdir):
+    """Test that a run is only stopped after the grace epochs if it is far behind another run"""
+    from pathlib import Path
+    from persephone_api.sweeps import LaggingRunStopper
+    from persephone_api.training_progress import record_event
+
+    leader_path = Path(str(tmpdir))
+    record_event(leader_path, "started")
+    for epoch, ler in enumerate([0.8, 0.5, 0.3, 0.2], start=1):
+        record_event(leader_path, "epoch", epoch=epoch, trainingLER=ler, validationLER=ler)
+
+    stopper = LaggingRunStopper([leader_path], grace_epochs=3, factor=1.5)
+    assert stopper(1, 0.9) is None
+    assert stopper(2, 0.9) is None
+    # Compared with the best of the other run by epoch 3, not its later epochs
+    assert stopper(3, 0.44) is None
+    assert stopper(4, 0.44) is not None
+
+
+def test_cpu_slots():
+    """Test that CPUs are divided into equal slots for concurrent trainings"""
+    from persephone_api.training_scheduler import cpu_slots
+    assert cpu_slots(range(8), 2) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert cpu_slots(range(7), 3) == [[0, 1], [2, 3], [4, 5]]
+    assert cpu_slots(range(2), 4) == [[0], [1]]
+
+
+def test_concurrency_limited_to_cpu_slots(init_database, monkeypatch):
+    """Test that no more trainings run at once than there are training CPUs to pin them to"""
+    import flask
+    from persephone_api.session_config import session_settings
+    from persephone_api.training_scheduler import TrainingScheduler
+    app = flask.current_app._get_current_object()
+    scheduler = TrainingScheduler()
+    scheduler.init_app(app)
+    monkeypatch.setitem(app.config, 'TRAINING_MAX_CONCURRENT', 4)
+    monkeypatch.setattr(session_settings, 'available_cpus', [0, 1])
+    monkeypatch.setattr(session_settings, 'training', session_settings.training._replace(cpus=None))
+    assert scheduler.max_concurrent == 2
+
+
+def test_sweep_too_many_runs(init_database, client, create_corpus):
+    """Test that a sweep creating more models than allowed is rejected"""
+    corpus_id = create_corpus()
+    sweep_data = {
+        "name": "Big sweep",
+        "corpusID": corpus_id,
+        "grid": {"numberLayers": list(range(1, 12)), "hiddenSize": list(range(10, 110, 10))},
+    }
+    response = client.post(
+        '/v0.1/sweep',
+        data=json.dumps(sweep_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 400
+
+
+def test_sweep_unknown_parameter(init_database, client, create_corpus):
+    """Test that only model parameters can be swept"""
+    corpus_id = create_corpus()
+    sweep_data = {
+        "name": "Bad sweep",
+        "corpusID": corpus_id,
+        "grid": {"learningRate": [0.1, 0.01]},
+    }
+    response = client.post(
+        '/v0.1/sweep',
+        data=json.dumps(sweep_data),
+        headers={'Content-Type': 'application/json'}
+    )
+    assert response.status_code == 400
+    assert "learningRate" in json.loads(response.data.decode('utf8'))["detail"]
+
+
+def test_sweep_invalid_values(init_database, client, create_corpus):
+    """Test that grid values must be lists and that every run must be a valid model"""
+    from persephone_api.db_models import TranscriptionModel
+    corpus_id = create_corpus()
+    for grid in ({"batchingStrategy": "bucketed"}, {"batchingStrategy": ["fixed", "bucketd"]}):
+        sweep_data = {"name": "Bad sweep", "corpusID": corpus_id, "grid": grid}
+        response = client.post(
+            '/v0.1/sweep',
+            data=json.dumps(sweep_data),
+            headers={'Content-Type': 'application/json'}
+        )
+        assert response.status_code == 400
+    assert "bucketd" in json.loads(response.data.decode('utf8'))["detail"]
+    assert TranscriptionModel.query.count() == 0
+
+
+def test_sweep_not_found(init_database, client):
+    """Test getting a sweep that doesn't exist"""
+    response = client.get('/v0.1/sweep/1')
+    assert response.status_code == 404
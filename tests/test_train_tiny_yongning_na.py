@@ -116,7 +116,7 @@ def test_tiny(init_database, client):
         data=json.dumps(data),
         headers={'Content-Type': 'application/json'}
     )
-    assert response.status_code == 201
+    assert response.status_code == 202
 
     corpus_response_data = json.loads(response.data.decode('utf8'))
     corpus_id = corpus_response_data['id']
@@ -159,3 +159,13 @@ def test_tiny(init_database, client):
     )
 
     assert response.status_code == 201
+    first_transcription = json.loads(response.data.decode('utf8'))
+
+    # Transcribing the same audio again returns the memoized transcription
+    response = client.post(
+        '/v0.1/model/transcribe/{}/{}'.format(model_id, audio_to_transcribe_id),
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    assert json.loads(response.data.decode('utf8'))['id'] == first_transcription['id']
@@ -0,0 +1,93 @@
+"""Tests for training progress events"""
+
+def test_follow_training_events(tmpdir):
+    """Test that recorded events are streamed as Server-Sent Events until training ends"""
+    import json
+    from pathlib import Path
+    from persephone_api.training_progress import EpochProgress, follow_events, record_event
+
+    model_path = Path(str(tmpdir))
+    record_event(model_path, "started", numberTraining=4)
+    epoch_progress = EpochProgress(model_path, num_train=4)
+    epoch_progress({"epoch": 1, "training_ler": 0.5, "valid_ler": 0.75})
+    record_event(model_path, "finished")
+
+    events = list(follow_events(model_path, poll_interval=0.01))
+    assert len(events) == 3
+    assert events[0].startswith("id: 1\nevent: started\n")
+    epoch_lines = events[1].splitlines()
+    assert epoch_lines[1] == "event: epoch"
+    epoch_data = json.loads(epoch_lines[2][len("data: "):])
+    assert epoch_data["epoch"] == 1
+    assert epoch_data["trainingLER"] == 0.5
+    assert epoch_data["validationLER"] == 0.75
+    assert "utterancesPerSecond" in epoch_data
+    assert "elapsedSeconds" in epoch_data
+
+    # Reconnecting clients only get the events they haven't seen
+    events = list(follow_events(model_path, start_after=2, poll_interval=0.01))
+    assert len(events) == 1
+    assert events[0].startswith("id: 3\nevent: finished\n")
+
+def test_new_run_follows_latest_run(tmpdir):
+    """Test that a new training run is appended and followed from its start,
+    while the ids of the events of earlier runs stay the same"""
+    from pathlib import Path
+    from persephone_api.training_progress import follow_events, record_event
+
+    model_path = Path(str(tmpdir))
+    record_event(model_path, "started")
+    record_event(model_path, "failed", error="out of memory")
+    record_event(model_path, "started")
+    record_event(model_path, "finished")
+
+    events = list(follow_events(model_path, poll_interval=0.01))
+    assert [event.splitlines()[:2] for event in events] == [
+        ["id: 3", "event: started"], ["id: 4", "event: finished"]]
+
+    # A client that saw the first run carries on into the next one
+    events = list(follow_events(model_path, start_after=2, poll_interval=0.01))
+    assert [event.splitlines()[0] for event in events] == ["id: 3", "id: 4"]
+
+
+def test_resumed_epochs_carry_on(tmpdir):
+    """Test that epochs of a resumed run are numbered after those already completed"""
+    from pathlib import Path
+    from persephone_api.training_progress import (EpochProgress, best_validation_ler, last_completed_epoch,
+                                                   record_event)
+
+    model_path = Path(str(tmpdir))
+    assert last_completed_epoch(model_path) == 0
+    record_event(model_path, "started", numberTraining=4)
+    EpochProgress(model_path, num_train=4)({"epoch": 1, "training_ler": 0.5, "valid_ler": 0.75})
+    EpochProgress(model_path, num_train=4)({"epoch": 2, "training_ler": 0.5, "valid_ler": 0.75})
+    assert last_completed_epoch(model_path) == 2
+
+    completed = last_completed_epoch(model_path)
+    record_event(model_path, "started", numberTraining=4, completedEpochs=completed)
+    assert last_completed_epoch(model_path) == 2
+    EpochProgress(model_path, num_train=4, epoch_offset=completed)({"epoch": 1, "training_ler": 0.5, "valid_ler": 0.25})
+    assert last_completed_epoch(model_path) == 3
+    assert best_validation_ler(model_path) == 0.25
+    assert best_validation_ler(model_path, up_to_epoch=2) == 0.75
+
+    # Training from scratch starts the epochs again
+    record_event(model_path, "started", numberTraining=4, completedEpochs=0)
+    assert last_completed_epoch(model_path) == 0
+    assert best_validation_ler(model_path) is None
+
+
+def test_follow_events_ends_without_training(tmpdir):
+    """Test that a stream ends once its events are sent if no training is running,
+    and after its time limit otherwise"""
+    from pathlib import Path
+    from persephone_api.training_progress import follow_events, record_event
+
+    model_path = Path(str(tmpdir))
+    record_event(model_path, "started")
+    events = list(follow_events(model_path, poll_interval=0.01, is_training=lambda: False))
+    assert [event.splitlines()[1] for event in events] == ["event: started"]
+
+    events = list(follow_events(model_path, poll_interval=0.01, heartbeat_interval=60,
+                                max_seconds=0.05, is_training=lambda: True))
+    assert len(events) == 1
@@ -5,6 +5,9 @@ from flask import send_from_directory
 from persephone_api.app import create_app
 from persephone_api.settings import DevConfig
 from persephone_api.extensions import db
+from persephone_api.session_config import session_settings
+from persephone_api.training_scheduler import training_scheduler
+from persephone_api.warmup import warmup
 
 app = create_app(DevConfig)
 
@@ -46,6 +49,36 @@ if os.path.isdir(app.config['MODELS_PATH']):
 else:
     os.makedirs(app.config['MODELS_PATH'])
 
+app.config['FEATURE_CACHE_PATH'] = os.path.join(app.config['FILE_STORAGE_BASE'], 'feature_cache')
+if not os.path.isdir(app.config['FEATURE_CACHE_PATH']):
+    os.makedirs(app.config['FEATURE_CACHE_PATH'])
+
+
+# Processes spawned for background jobs import this module as __mp_main__ when
+# the server is run directly, they set up their own app and run nothing else.
+SPAWNED_PROCESS = __name__ == "__mp_main__"
+
+# TensorFlow and the checkpoints of frequently used models are loaded before
+# uwsgi forks the workers so that the workers share them.
+if not SPAWNED_PROCESS:
+    warmup.preload()
+
+def start_worker():
+    """Start the background threads of a worker process"""
+    # Transcription pool processes started by this worker inherit its CPU affinity
+    session_settings.pin_inference_process()
+    # Training jobs are run by a scheduler thread in every worker process
+    training_scheduler.start()
+    warmup.start()
+
+# Under uwsgi the threads have to be started after the workers are forked
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    if not SPAWNED_PROCESS:
+        start_worker()
+else:
+    postfork(start_worker)
 
 
 @app.route('/uploads/<path:path>')